@@ -51,6 +51,30 @@ async def main():
     from utils.cleanup import cleanup_worker
     cleanup_task = asyncio.create_task(cleanup_worker())
 
+    # Start Metrics Worker
+    from services.metrics import metrics_worker
+    metrics_task = asyncio.create_task(metrics_worker())
+
+    # file_id indeksini Postgres'ga partiyalab yozish + eng ommabop yozuvlarni Redis'ga yuklash
+    from services.media_cache import media_cache
+    from services.media_index import media_index
+    media_index_task = asyncio.create_task(media_index.run())
+    # Job bosqichlari vaqtlari (navbat ETA'si va job_timings jadvali)
+    from services.job_timings import job_timings
+    job_timings_task = asyncio.create_task(job_timings.run())
+    warmup_task = asyncio.create_task(media_cache.warm_up())
+
+    # Lokal kesh invalidatsiyasi (boshqa bot processlari yozgan kalitlar)
+    from services.local_cache import local_cache
+    invalidation_task = asyncio.create_task(local_cache.invalidation_listener())
+    # Boshqa process'larda bosilgan Cancel tugmalari
+    from utils.cancellation import download_registry
+    cancel_task = asyncio.create_task(download_registry.cancel_listener())
+
+    # yt-dlp execution backend (thread yoki process pool)
+    from utils.ydl_executor import ydl_executor
+    await ydl_executor.start()
+
     # Start Task Queue Workers
     from utils.task_queue import task_queue
     task_queue.start()
@@ -71,14 +95,35 @@ async def main():
     finally:
         # Cancel cleanup task on exit
         cleanup_task.cancel()
-        await asyncio.gather(cleanup_task, return_exceptions=True)
+        metrics_task.cancel()
+        invalidation_task.cancel()
+        cancel_task.cancel()
+        warmup_task.cancel()
+        await asyncio.gather(
+            cleanup_task, metrics_task, invalidation_task, cancel_task, warmup_task, return_exceptions=True
+        )
     
+    # Task Queue ni to'xtatish (ishlayotgan Redis job'lari restart'dan keyin davom etadi)
+    await task_queue.stop()
+
     # Redis ni yopish
     if loader.redis_client:
         await loader.redis_client.close()
 
-    # Task Queue ni to'xtatish
-    await task_queue.stop()
+    # Qolgan file_id va job vaqtlari yozuvlarini Postgres'ga yozib tugatish
+    media_index_task.cancel()
+    job_timings_task.cancel()
+    await asyncio.gather(media_index_task, job_timings_task, return_exceptions=True)
+
+    # Pool'dagi YoutubeDL instance'larni yopish
+    from utils.ydl_pool import ydl_pool
+    logger.info(f"YoutubeDL pool stats: {ydl_pool.stats()}")
+    ydl_pool.close()
+    ydl_executor.shutdown()
+
+    # Ranged fetch uchun umumiy HTTP sessiyani yopish
+    from utils.ranged_fetch import close_session
+    await close_session()
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,97 @@
+"""
+Audio fast path (parallel Range requests) vs the yt-dlp download path.
+
+A local aiohttp server serves generated 5 MB and 50 MB files with Range
+support; each file is fetched REPEAT times by both paths and the median
+wall time is reported. The yt-dlp path goes through `run_extract` with the
+generic extractor, using aria2c when it is installed (as in production)
+and the native downloader otherwise.
+
+    python -m benchmarks.bench_audio_fetch
+"""
+import asyncio
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+from utils.ranged_fetch import close_session, fetch_ranges
+from utils.ydl_pool import YtDlpLogger, run_extract
+
+SIZES_MB = (5, 50)
+REPEAT = 5
+HOST = "127.0.0.1"
+PORT = 8791
+
+
+async def _start_server(root: Path) -> web.AppRunner:
+    async def handle(request: web.Request) -> web.FileResponse:
+        return web.FileResponse(root / request.match_info["name"])
+
+    app = web.Application()
+    app.router.add_get("/{name}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+    return runner
+
+
+def _ydl_download(url: str, out_dir: Path) -> None:
+    opts = {
+        "quiet": True,
+        "no_warnings": True,
+        "logger": YtDlpLogger(),
+        "outtmpl": str(out_dir / "ydl.%(ext)s"),
+        "http_chunk_size": 10485760,
+    }
+    if shutil.which("aria2c"):
+        opts["external_downloader"] = "aria2c"
+        opts["external_downloader_args"] = ["--max-connection-per-server=4", "--split=4", "--min-split-size=1M"]
+    run_extract("download", opts, url, True)
+
+
+async def _time(coro_factory) -> float:
+    started = time.perf_counter()
+    await coro_factory()
+    return time.perf_counter() - started
+
+
+async def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        out_dir = root / "out"
+        out_dir.mkdir()
+        for size in SIZES_MB:
+            (root / f"audio_{size}mb.m4a").write_bytes(os.urandom(size * 1024 * 1024))
+        runner = await _start_server(root)
+        downloader = "aria2c" if shutil.which("aria2c") else "native"
+        try:
+            for size in SIZES_MB:
+                url = f"http://{HOST}:{PORT}/audio_{size}mb.m4a"
+                ydl_times, fast_times = [], []
+                for _ in range(REPEAT):
+                    ydl_times.append(await _time(lambda: asyncio.to_thread(_ydl_download, url, out_dir)))
+                    for leftover in out_dir.iterdir():
+                        leftover.unlink()
+                    fast_times.append(await _time(lambda: fetch_ranges(url, out_dir / "fast.m4a")))
+                    assert (out_dir / "fast.m4a").stat().st_size == size * 1024 * 1024
+                    (out_dir / "fast.m4a").unlink()
+                ydl_median = statistics.median(ydl_times)
+                fast_median = statistics.median(fast_times)
+                print(f"{size} MB")
+                print("  ", {
+                    f"yt_dlp_{downloader}_ms": round(ydl_median * 1000, 1),
+                    "ranged_fetch_ms": round(fast_median * 1000, 1),
+                    "speedup": round(ydl_median / fast_median, 2),
+                })
+        finally:
+            await close_session()
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
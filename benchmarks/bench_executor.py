@@ -0,0 +1,94 @@
+"""
+Handler latency under 5 concurrent yt-dlp-like jobs: thread vs process executor.
+
+A synthetic job mimics yt-dlp's CPU profile (format list parsing, progress
+hooks every chunk) with short blocking sleeps standing in for network I/O.
+While the jobs run, a probe coroutine plays the role of an aiogram handler
+and records how late the event loop wakes it up.
+
+    python -m benchmarks.bench_executor
+"""
+import asyncio
+import json
+import statistics
+import time
+
+from utils.ydl_executor import YdlExecutor
+
+CONCURRENT_JOBS = 5
+CHUNKS_PER_JOB = 150
+PROBE_INTERVAL = 0.01  # seconds
+
+
+def synthetic_job(job_id: int, progress=None) -> dict:
+    formats = [
+        {"format_id": str(i), "height": 144 + i, "tbr": i * 10.5, "url": "https://example.invalid/" + "x" * 300}
+        for i in range(400)
+    ]
+    total = CHUNKS_PER_JOB * 1024 * 1024
+    for chunk in range(CHUNKS_PER_JOB):
+        # Format/manifest parsing va progress hook'lar - GIL'ni band qiladigan qism
+        parsed = json.loads(json.dumps(formats))
+        parsed.sort(key=lambda f: (f["height"], f["tbr"]), reverse=True)
+        if progress:
+            progress({"status": "downloading", "downloaded_bytes": (chunk + 1) * 1024 * 1024, "total_bytes": total})
+        # Tarmoq I/O (GIL bo'shatiladi)
+        time.sleep(0.002)
+    return {"id": job_id, "formats": len(formats)}
+
+
+async def _probe(stop: asyncio.Event, lags: list[float]) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append((time.perf_counter() - started - PROBE_INTERVAL) * 1000)
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+async def run_mode(mode: str) -> dict:
+    executor = YdlExecutor(mode=mode, workers=CONCURRENT_JOBS, max_jobs_per_worker=20)
+    await executor.start()
+    progress_events = 0
+
+    def on_progress(_data: dict) -> None:
+        nonlocal progress_events
+        progress_events += 1
+
+    try:
+        # Warm-up: process rejimida worker'larni spawn qilish o'lchovga kirmasin
+        await asyncio.gather(*(executor.run(synthetic_job, -1) for _ in range(CONCURRENT_JOBS)))
+
+        lags: list[float] = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(_probe(stop, lags))
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            executor.run(synthetic_job, i, progress_hook=on_progress) for i in range(CONCURRENT_JOBS)
+        ))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await probe
+    finally:
+        executor.shutdown()
+
+    return {
+        "mode": mode,
+        "wall_s": round(elapsed, 2),
+        "lag_p50_ms": round(statistics.median(lags), 2),
+        "lag_p99_ms": round(_percentile(lags, 0.99), 2),
+        "lag_max_ms": round(max(lags), 2),
+        "progress_events": progress_events,
+    }
+
+
+async def main() -> None:
+    for mode in ("thread", "process"):
+        print(await run_mode(mode))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+"""
+Format planner vs the previous per-height selector on a fixture info dict.
+
+The fixtures are trimmed yt-dlp info dicts (formats section only) in the
+shape YouTube returns: a 10-minute 4K upload with H.264/VP9/AV1 video-only
+ladders, and a 7-minute 1080p upload without AV1 (the common case), both
+with m4a/opus audio, itag 18 and storyboards. For every quality button
+we count expected download bytes, ffmpeg merge/remux steps and how many
+results Telegram can't play inline (sent as document / no preview).
+
+    python -m benchmarks.bench_format_planner
+"""
+import json
+import time
+from pathlib import Path
+
+from utils.format_planner import (
+    TARGET_HEIGHTS,
+    estimate_format_size_bytes,
+    is_storyboard,
+    plan_formats,
+)
+
+FIXTURES = sorted((Path(__file__).parent / "fixtures").glob("youtube_info_*.json"))
+REPEAT = 2000
+
+# Oldingi selector: av01 > vp9 > avc1, progressive ustun, ext = video format ext
+LEGACY_CODEC_PRIORITY = {"av01": 3, "vp9": 2, "avc1": 1}
+
+
+def _legacy_rank(fmt: dict) -> tuple[int, float]:
+    vcodec = fmt.get("vcodec") or ""
+    rank = next((r for prefix, r in LEGACY_CODEC_PRIORITY.items() if vcodec.startswith(prefix)), 0)
+    return rank, fmt.get("tbr") or 0
+
+
+def legacy_select(info: dict) -> list[dict]:
+    duration = info.get("duration")
+    progressive: dict[int, dict] = {}
+    dash: dict[int, dict] = {}
+    for fmt in info.get("formats") or []:
+        height = fmt.get("height")
+        if height not in TARGET_HEIGHTS or is_storyboard(fmt) or fmt.get("vcodec") in (None, "none"):
+            continue
+        target = progressive if fmt.get("acodec") not in (None, "none") else dash
+        if height not in target or _legacy_rank(fmt) > _legacy_rank(target[height]):
+            target[height] = fmt
+    items = []
+    for height in sorted(TARGET_HEIGHTS):
+        fmt = progressive.get(height) or dash.get(height)
+        if fmt:
+            items.append({
+                "height": height,
+                "vcodec": fmt.get("vcodec"),
+                "is_merge": 0 if height in progressive else 1,
+                "ext": fmt.get("ext") or "mp4",
+                "video_bytes": estimate_format_size_bytes(fmt, duration) or 0,
+            })
+    return items
+
+
+def _audio_bytes(info: dict) -> int:
+    m4a = [f for f in info["formats"] if f.get("vcodec") == "none" and f.get("ext") == "m4a"]
+    best = max(m4a, key=lambda f: f.get("abr") or 0)
+    return estimate_format_size_bytes(best, info.get("duration")) or 0
+
+
+def summarize_legacy(info: dict) -> dict:
+    audio = _audio_bytes(info)
+    items = legacy_select(info)
+    return {
+        "buttons": len(items),
+        "bytes_mb": round(sum(i["video_bytes"] + (audio if i["is_merge"] else 0) for i in items) / 2**20, 1),
+        "merges": sum(i["is_merge"] for i in items),
+        "remuxes": 0,
+        "not_native": sum(1 for i in items if not (i["ext"] == "mp4" and i["vcodec"].startswith("avc1"))),
+        "codecs": [f"{i['height']}:{i['vcodec'].split('.')[0]}/{i['ext']}" for i in items],
+    }
+
+
+def summarize_planner(info: dict) -> dict:
+    plans = plan_formats(info)
+    return {
+        "buttons": len(plans),
+        "bytes_mb": round(sum(p.size_bytes for p in plans) / 2**20, 1),
+        "merges": sum(p.is_merge for p in plans),
+        "remuxes": sum(1 for p in plans if p.remux),
+        "not_native": sum(1 for p in plans if not p.native),
+        "codecs": [f"{p.height}:{p.vcodec.split('.')[0]}/{p.ext}" for p in plans],
+    }
+
+
+def main() -> None:
+    for fixture in FIXTURES:
+        info = json.loads(fixture.read_text())
+        legacy = summarize_legacy(info)
+        planner = summarize_planner(info)
+        print(fixture.name)
+        print("  legacy: ", legacy)
+        print("  planner:", planner)
+        print("  ", {
+            "bytes_saved_mb": round(legacy["bytes_mb"] - planner["bytes_mb"], 1),
+            "merge_steps_avoided": legacy["merges"] - planner["merges"],
+            "not_native_avoided": legacy["not_native"] - planner["not_native"],
+        })
+
+        started = time.perf_counter()
+        for _ in range(REPEAT):
+            plan_formats(info)
+        print("  ", {"plan_formats_us": round((time.perf_counter() - started) / REPEAT * 1e6, 1)})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Fake-job throughput and latency: Redis Streams job queue vs an in-memory worker pool.
+
+JOBS no-op jobs (plus a short sleep standing in for a tiny download) are
+enqueued by name and consumed with CONCURRENCY slots; the benchmark
+reports jobs/sec and enqueue-to-start latency percentiles. Needs a local
+Redis (REDIS_HOST / REDIS_PORT); it uses its own `bench:jobs` stream and
+deletes it afterwards.
+
+    python -m benchmarks.bench_job_queue
+"""
+import asyncio
+import statistics
+import time
+
+import redis.asyncio as redis
+
+import loader
+from services.job_queue import JobQueue
+from services.job_store import job_store
+from services.worker_pools import PoolSpec
+from utils.task_queue import WorkerPool
+
+JOBS = 2000
+CONCURRENCY = 5
+JOB_SECONDS = 0.001
+STREAM = "bench:jobs"
+
+_latencies: list[float] = []
+_done = asyncio.Event()
+
+
+@job_store.resumable
+async def bench_fake_job(enqueued_at: float, resumed: bool = False) -> None:
+    _latencies.append(time.time() - enqueued_at)
+    await asyncio.sleep(JOB_SECONDS)
+    if len(_latencies) >= JOBS:
+        _done.set()
+
+
+def _report(name: str, seconds: float) -> None:
+    latencies = sorted(_latencies)
+    print(name)
+    print("  ", {
+        "jobs_per_sec": round(JOBS / seconds, 1),
+        "latency_p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "latency_p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    })
+
+
+async def _run_streams(queue: JobQueue) -> float:
+    consumer = asyncio.create_task(queue.run(CONCURRENCY))
+    started = time.perf_counter()
+    for _ in range(JOBS):
+        await queue.enqueue("bench_fake_job", {"enqueued_at": time.time()})
+    await _done.wait()
+    elapsed = time.perf_counter() - started
+    consumer.cancel()
+    await asyncio.gather(consumer, return_exceptions=True)
+    return elapsed
+
+
+async def _run_memory() -> float:
+    pool = WorkerPool(PoolSpec("bench", CONCURRENCY, JOBS, 0))
+    pool.start()
+    started = time.perf_counter()
+    for _ in range(JOBS):
+        await pool.submit(bench_fake_job, (), {"enqueued_at": time.time()}, 0, 0)
+    await _done.wait()
+    elapsed = time.perf_counter() - started
+    await pool.stop()
+    return elapsed
+
+
+async def main() -> None:
+    settings = loader.settings
+    client = redis.Redis(host=settings.redis_host, port=settings.redis_port)
+    loader.redis_client = client
+    try:
+        await client.delete(STREAM)
+        _report("redis_streams", await _run_streams(JobQueue(stream=STREAM, group="bench", dead_letter=f"{STREAM}:dead")))
+        _latencies.clear()
+        _done.clear()
+        loader.redis_client = None  # pool in-memory rejimda ishlasin
+        _report("in_memory", await _run_memory())
+    finally:
+        await client.delete(STREAM, f"{STREAM}:dead")
+        await client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
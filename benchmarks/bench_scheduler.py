@@ -0,0 +1,101 @@
+"""
+Mean audio wait under mixed load: FIFO vs FairScheduler.
+
+Discrete-event simulation, no Redis or network needed. One chat queues
+HEAVY_JOBS 4K video downloads at t=0, while AUDIO_CHATS other chats send
+a short audio job every AUDIO_INTERVAL seconds; SLOTS jobs run at once.
+Both policies get the same arrivals; the benchmark reports the mean and
+p95 wait of audio jobs, the mean wait of video jobs, the makespan and the
+scheduler's fairness index.
+
+    python -m benchmarks.bench_scheduler
+"""
+import heapq
+import itertools
+import statistics
+
+from services.scheduler import FairScheduler, ScheduledJob, expected_seconds
+
+SLOTS = 5
+HEAVY_JOBS = 10
+HEAVY_BYTES = 1500 * 1024 * 1024
+HEAVY_DURATION = 1200
+AUDIO_CHATS = 40
+AUDIO_BYTES = 8 * 1024 * 1024
+AUDIO_INTERVAL = 1.5
+MAX_PER_CHAT = 2
+
+
+def _arrivals() -> list[ScheduledJob]:
+    heavy_cost = expected_seconds(HEAVY_BYTES, HEAVY_DURATION)
+    jobs = [
+        ScheduledJob(f"video{i}", "heavy", heavy_cost, kind="video", enqueued_at=0.0)
+        for i in range(HEAVY_JOBS)
+    ]
+    audio_cost = expected_seconds(AUDIO_BYTES)
+    jobs += [
+        ScheduledJob(f"audio{i}", f"chat{i}", audio_cost, kind="audio", enqueued_at=0.1 + i * AUDIO_INTERVAL)
+        for i in range(AUDIO_CHATS)
+    ]
+    return jobs
+
+
+class _Fifo:
+    def __init__(self):
+        self._jobs: list[ScheduledJob] = []
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def push(self, job: ScheduledJob) -> None:
+        self._jobs.append(job)
+
+    def pop(self, now: float) -> ScheduledJob | None:
+        return self._jobs.pop(0) if self._jobs else None
+
+    def done(self, job: ScheduledJob) -> None:
+        pass
+
+
+def _simulate(policy) -> dict:
+    arrivals = sorted(_arrivals(), key=lambda job: job.enqueued_at)
+    finishes: list[tuple[float, int, ScheduledJob]] = []
+    order = itertools.count()
+    waits: dict[str, list[float]] = {"audio": [], "video": []}
+    now = 0.0
+    while arrivals or finishes or len(policy):
+        # Keyingi hodisa: yangi job kelishi yoki ishlayotgani tugashi
+        next_arrival = arrivals[0].enqueued_at if arrivals else float("inf")
+        next_finish = finishes[0][0] if finishes else float("inf")
+        now = min(next_arrival, next_finish)
+        while arrivals and arrivals[0].enqueued_at <= now:
+            policy.push(arrivals.pop(0))
+        while finishes and finishes[0][0] <= now:
+            policy.done(heapq.heappop(finishes)[2])
+        while len(finishes) < SLOTS:
+            job = policy.pop(now)
+            if job is None:
+                break
+            waits[job.kind].append(now - job.enqueued_at)
+            heapq.heappush(finishes, (now + job.cost, next(order), job))
+    audio = sorted(waits["audio"])
+    return {
+        "audio_wait_mean_s": round(statistics.mean(audio), 1),
+        "audio_wait_p95_s": round(audio[int(len(audio) * 0.95) - 1], 1),
+        "video_wait_mean_s": round(statistics.mean(waits["video"]), 1),
+        "makespan_s": round(now, 1),
+    }
+
+
+def main() -> None:
+    print("fifo")
+    print("  ", _simulate(_Fifo()))
+    fair = FairScheduler(MAX_PER_CHAT)
+    result = _simulate(fair)
+    result["fairness"] = fair.fairness()
+    print("fair_scheduler")
+    print("  ", result)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,10 +13,28 @@ class Settings:
     redis_port: int = int(os.getenv('REDIS_PORT', '6379'))
     tmp_dir: str = os.getenv('TMP_DIR', '/dev/shm/tmp')
     telegram_nickname: str = os.getenv('TELEGRAM_NICKNAME', '@InstantAudioBot')
-    idempotency_ttl_seconds: int = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '900'))
+    idempotency_ttl_seconds: int = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '120'))  # lease; job davomida yangilanadi
     artist_cache_ttl_seconds: int = int(os.getenv('ARTIST_CACHE_TTL_SECONDS', '3600'))
+    media_cache_ttl_seconds: int = int(os.getenv('MEDIA_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+    media_cache_warmup_top_n: int = int(os.getenv('MEDIA_CACHE_WARMUP_TOP_N', '1000'))
     use_local_server: bool = os.getenv('USE_LOCAL_SERVER', 'False').lower() == 'true'
     local_server_url: str = os.getenv('TELEGRAM_API_SERVER_URL', 'http://127.0.0.1:8081')
+    ytdlp_executor: str = os.getenv('YTDLP_EXECUTOR', 'thread')  # thread | process
+    ytdlp_process_workers: int = int(os.getenv('YTDLP_PROCESS_WORKERS', '2'))
+    ytdlp_worker_max_jobs: int = int(os.getenv('YTDLP_WORKER_MAX_JOBS', '20'))
+    stream_upload: bool = os.getenv('STREAM_UPLOAD', 'True').lower() == 'true'
+    stream_upload_buffer_mb: int = int(os.getenv('STREAM_UPLOAD_BUFFER_MB', '8'))
+    speculative_prefetch: bool = os.getenv('SPECULATIVE_PREFETCH', 'False').lower() == 'true'
+    scratch_budget_mb: int = int(os.getenv('SCRATCH_BUDGET_MB', '500'))  # TMP_DIR (tmpfs) uchun
+    bandwidth_limit_mbps: int = int(os.getenv('BANDWIDTH_LIMIT_MBPS', '0'))  # 0 - cheklovsiz
+    job_queue: str = os.getenv('JOB_QUEUE', 'memory')  # memory (shu process) | redis (Streams, ko'p process) | celery
+    celery_broker_url: str = os.getenv('CELERY_BROKER_URL', '')  # bo'sh - REDIS_HOST/REDIS_PORT db 0
+    celery_result_backend: str = os.getenv('CELERY_RESULT_BACKEND', '')
+    max_jobs_per_chat: int = int(os.getenv('MAX_JOBS_PER_CHAT', '2'))
+    worker_pools: str = os.getenv('WORKER_POOLS', '')  # "video=3:40:1800,music=6" (services.worker_pools)
+    autoscale: bool = os.getenv('AUTOSCALE', 'True').lower() == 'true'
+    autoscale_bounds: str = os.getenv('AUTOSCALE_BOUNDS', '')  # "video=1:3,music=2:10" (services.autoscaler)
+    origin_connection_limits: str = os.getenv('ORIGIN_CONNECTION_LIMITS', '')  # "youtube=32,instagram=8"
 
 
 _settings: Settings | None = None
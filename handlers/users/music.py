@@ -8,7 +8,11 @@ from loader import dp
 from states.bot_states import BotStates
 from utils.search import search_music
 from tasks.bot_tasks import process_music_task
-from utils.task_queue import task_queue
+from utils.task_queue import PoolFull, task_queue
+from services.local_cache import local_cache
+from services.prefetch import AUDIO_CHOICE, prefetcher
+from services.scratch_budget import DEFAULT_AUDIO_BYTES
+from services.worker_pools import ACCEPT, REJECT
 from utils.telegram_helpers import safe_delete_message, safe_edit_text, check_text_length_and_notify
 from utils.i18n import get_user_lang, t
 
@@ -287,6 +291,10 @@ async def handle_music_callback(callback: CallbackQuery):
         
     from loader import redis_client
     lang = await get_user_lang(callback.from_user.id, redis_client)
+    if await task_queue.admission(process_music_task) != ACCEPT:
+        task_queue.shed(process_music_task, REJECT)
+        await callback.answer(t("server_busy", lang), show_alert=True)
+        return
     await callback.answer(t("music_button_loading", lang), show_alert=False)
     
     # Celery taskga yuboramiz (parallel bajariladi)
@@ -306,22 +314,19 @@ async def handle_music_callback(callback: CallbackQuery):
         # Fallback
         logger.error(f"Error updating status: {e}")
     
-    # process_music_task.delay(
-    #     chat_id=callback.message.chat.id,
-    #     video_id=video_id,
-    #     message_id=callback.message.message_id,
-    #     is_media=is_media,
-    #     status_message_id=status_msg.message_id if status_msg else None
-    # )
-    # from tasks.bot_tasks import process_music_task
-    await task_queue.add_task(
-        process_music_task,
-        chat_id=callback.message.chat.id,
-        video_id=video_id,
-        message_id=callback.message.message_id,
-        is_media=is_media,
-        status_message_id=status_msg.message_id if status_msg else None
-    )
+    await prefetcher.resolve(callback.message.chat.id, video_id, AUDIO_CHOICE)
+    try:
+        await task_queue.add_task(
+            process_music_task,
+            chat_id=callback.message.chat.id,
+            video_id=video_id,
+            message_id=callback.message.message_id,
+            is_media=is_media,
+            status_message_id=status_msg.message_id if status_msg else None,
+            scratch_bytes=DEFAULT_AUDIO_BYTES,
+        )
+    except PoolFull:
+        await safe_edit_text(status_msg or callback.message, t("server_busy", lang))
 
 
 @router.callback_query(F.data.startswith('artist:'))
@@ -335,7 +340,7 @@ async def handle_artist_songs(callback: CallbackQuery, state: FSMContext):
         await callback.answer(t("db_error", lang), show_alert=True)
         return
 
-    artist_name = await redis_client.get(f"artist:{video_id}")
+    artist_name = await local_cache.get(redis_client, f"artist:{video_id}")
     if not artist_name:
         await callback.answer(t("artist_not_found", lang), show_alert=True)
         return
@@ -7,6 +7,7 @@ from loader import dp, db
 from states.bot_states import BotStates
 from utils.db_api.models import User
 from sqlalchemy import select
+from services.local_cache import local_cache
 from utils.i18n import get_user_lang, set_user_lang, t
 
 LANG_KB = InlineKeyboardMarkup(inline_keyboard=[
@@ -41,7 +42,7 @@ async def cmd_start(message: Message, state: FSMContext):
     """Start command"""
     from loader import redis_client
     if redis_client:
-        raw_lang = await redis_client.get(f"user:lang:{message.from_user.id}")
+        raw_lang = await local_cache.get(redis_client, f"user:lang:{message.from_user.id}")
         if not raw_lang:
             await message.answer(t("choose_language", "uz"), reply_markup=LANG_KB)
             return
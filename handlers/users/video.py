@@ -1,152 +1,56 @@
 from aiogram import Router, F
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.fsm.context import FSMContext
-from pathlib import Path
-from shazamio import Shazam
 import logging
 import asyncio
-import yt_dlp
 import aiohttp
 
-from loader import dp, TMP_DIR
+from loader import dp
 from states.bot_states import BotStates
 from keyboards.default_keyboards import main_menu
 from utils.validation import is_youtube_url, is_instagram_url, extract_url, extract_youtube_id
-from tasks.bot_tasks import process_video_task
-from utils.task_queue import task_queue
-from utils.search import search_music
+from tasks.bot_tasks import process_video_task, recognize_music_task
+from utils.task_queue import PoolFull, task_queue
+from services.worker_pools import ACCEPT, AUDIO_ONLY, DEGRADE, REJECT
 from utils.download import fetch_youtube_formats_fast, get_format_selector
 from utils.telegram_helpers import safe_delete_message, safe_edit_text, check_text_length_and_notify
+from utils.cancellation import download_registry
+from services.local_cache import local_cache
+from services.media_sender import build_cancel_keyboard
+from services.prefetch import prefetcher, video_choice
+from services.scratch_budget import DEFAULT_AUDIO_BYTES, DEFAULT_INSTAGRAM_BYTES, DEFAULT_VIDEO_BYTES, estimate_video_bytes
 from utils.i18n import get_user_lang, t
 
 logger = logging.getLogger(__name__)
 router = Router()
 YTDLP_INFO_TIMEOUT = 60
+DEGRADED_MAX_HEIGHT = 480  # video navbati band bo'lganda
 
 @router.callback_query(F.data.startswith('recognize_music:'))
 async def handle_recognize_music(callback: CallbackQuery):
-    """Videodagi musiqani aniqlash va variantlarni ko'rsatish"""
+    """Videodagi musiqani aniqlash - `recognize` pool'ida bajariladi"""
     video_id = callback.data.split(':')[1]
     from loader import redis_client
     lang = await get_user_lang(callback.from_user.id, redis_client)
-    
+
     # Userga javob qaytarish (loading...)
+    admission = await task_queue.admission(recognize_music_task)
+    if admission != ACCEPT:
+        task_queue.shed(recognize_music_task, REJECT)
+        await callback.answer(t("server_busy", lang), show_alert=True)
+        return
     await callback.answer(t("recognize_start", lang), show_alert=False)
     status_msg = await callback.message.answer(t("audio_part_loading", lang))
-    
-    # Biz yakuniy fayl .mp3 bo'lishini kutyapmiz
-    temp_audio = Path(TMP_DIR) / f"recog_{video_id}.mp3"
-    
     try:
-        # 1. Audio ni yuklab olish (Cookiesiz, Android Client bilan)
-        url = f"https://www.youtube.com/watch?v={video_id}"
-        
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            # Fayl nomini shablon orqali beramiz, yt-dlp o'zi .mp3 qiladi
-            'outtmpl': str(Path(TMP_DIR) / f"recog_{video_id}.%(ext)s"),
-            
-            # --- IP BLOKNI AYLANIB O'TISH ---
-            # Cookie ISHLATMAYMIZ (IP mojarosi bo'lmasligi uchun)
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android', 'ios'],
-                }
-            },
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
-            },
-            # --------------------------------
-            
-            'quiet': True,
-            'no_warnings': True,
-            'ignoreerrors': True,
-            'nocheckcertificate': True,
-            
-            # Majburan MP3 ga o'tkazish (Shazam uchun qulay)
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-        }
-        
-        await safe_edit_text(status_msg, t("audio_loading_youtube", lang))
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            await asyncio.to_thread(ydl.download, [url])
-            
-        if not temp_audio.exists():
-            # Ba'zan yt-dlp formatni o'zgartirib yuborishi mumkin, tekshiramiz
-            found = False
-            for f in Path(TMP_DIR).glob(f"recog_{video_id}.*"):
-                if f.exists():
-                    temp_audio = f
-                    found = True
-                    break
-            if not found:
-                await safe_edit_text(status_msg, t("audio_download_failed", lang))
-                return
-
-        # 2. Shazam orqali aniqlash
-        await safe_edit_text(status_msg, t("shazam_listening", lang))
-        shazam = Shazam()
-        out = await shazam.recognize(str(temp_audio))
-        
-        track = out.get('track', {})
-        title = track.get('title')
-        subtitle = track.get('subtitle')
-        
-        if not title:
-            await safe_edit_text(status_msg, t("shazam_not_found", lang))
-            return
-            
-        search_query = f"{title} {subtitle}"
-        await safe_edit_text(
-            status_msg,
-            t("shazam_found", lang, query=search_query),
-            parse_mode='HTML'
-        )
-        
-        # 3. YouTube dan variantlarni qidirish (Bot ichidan yuklab berish uchun)
-        results = await search_music(search_query)
-        
-        if not results:
-            await safe_edit_text(
-                status_msg,
-                t("shazam_no_results", lang, query=search_query)
-            )
-            return
-
-        # 4. Variantlarni ko'rsatish
-        keyboard = []
-        for res in results[:5]: # Maksimum 5 ta variant
-            keyboard.append([
-                InlineKeyboardButton(
-                    text=f"⬇️ {res['title'][:30]}...",
-                    callback_data=f"music:{res['id']}" 
-                )
-            ])
-        
-        kb = InlineKeyboardMarkup(inline_keyboard=keyboard)
-        await safe_edit_text(
-            status_msg,
-            t("choose_variant", lang, query=search_query),
-            parse_mode='HTML',
-            reply_markup=kb
+        await task_queue.add_task(
+            recognize_music_task,
+            chat_id=callback.message.chat.id,
+            video_id=video_id,
+            status_message_id=status_msg.message_id,
+            scratch_bytes=DEFAULT_AUDIO_BYTES,
         )
-
-    except Exception as e:
-        logger.error(f"Recognition error: {e}", exc_info=True)
-        await safe_edit_text(status_msg, t("system_error", lang))
-        
-    finally:
-        # Faylni tozalash
-        if temp_audio and temp_audio.exists():
-            try:
-                temp_audio.unlink()
-            except:
-                pass
+    except PoolFull:
+        await safe_edit_text(status_msg, t("server_busy", lang))
 
 async def handle_video_logic(message: Message, url: str):
     """
@@ -197,6 +101,7 @@ async def handle_video_logic(message: Message, url: str):
 
         if initial_msg:
             await _edit_preview_with_formats(bot, initial_msg, caption, keyboard)
+            await prefetcher.offer(chat_id, info)
         else:
             thumb = info.get("thumbnail")
             if thumb:
@@ -215,29 +120,33 @@ async def handle_video_logic(message: Message, url: str):
                     reply_markup=keyboard,
                     disable_web_page_preview=True
                 )
+            await prefetcher.offer(chat_id, info)
         return
 
     # Instagram va boshqa holatlar uchun eski oqim
-
-    # Instagram va boshqa holatlar uchun eski oqim
+    # (arzonroq variant yo'q - DEGRADE'da to'liq sifatda qabul qilinadi)
+    admission = await task_queue.admission(process_video_task)
+    if admission in (REJECT, AUDIO_ONLY):
+        task_queue.shed(process_video_task, REJECT)
+        await bot.send_message(chat_id=chat_id, text=t("server_busy", lang), disable_web_page_preview=True)
+        return
     status_msg = await bot.send_message(
         chat_id=chat_id,
         text=t("video_loading", lang),
         parse_mode='HTML',
-        disable_web_page_preview=True
-    )
-    # process_video_task.delay(
-    #     chat_id=chat_id,
-    #     url=url,
-    #     status_message_id=status_msg.message_id
-    # )
-    # from tasks.bot_tasks import process_video_task
-    await task_queue.add_task(
-        process_video_task,
-        chat_id=chat_id,
-        url=url,
-        status_message_id=status_msg.message_id
+        disable_web_page_preview=True,
+        reply_markup=build_cancel_keyboard(lang)
     )
+    try:
+        await task_queue.add_task(
+            process_video_task,
+            chat_id=chat_id,
+            url=url,
+            status_message_id=status_msg.message_id,
+            scratch_bytes=DEFAULT_INSTAGRAM_BYTES if is_instagram_url(url) else DEFAULT_VIDEO_BYTES,
+        )
+    except PoolFull:
+        await safe_edit_text(status_msg, t("server_busy", lang))
 
 
 def _build_format_message(info: dict, lang: str) -> tuple[str, InlineKeyboardMarkup | None]:
@@ -313,7 +222,7 @@ def _render_progress_bar(percent: int) -> str:
     return "[" + ("#" * filled) + ("-" * (width - filled)) + "]"
 
 
-async def _get_cached_format_info(video_id: str, format_id: str) -> dict:
+async def _get_cached_info(video_id: str) -> dict:
     from loader import redis_client
     if not redis_client:
         return {}
@@ -322,16 +231,56 @@ async def _get_cached_format_info(video_id: str, format_id: str) -> dict:
         import json
         url = f"https://www.youtube.com/watch?v={video_id}"
         url_key = f"yt_info:{hashlib.md5(url.encode()).hexdigest()}"
-        cached = await redis_client.get(url_key)
-        if not cached:
-            return {}
-        info = json.loads(cached)
+        cached = await local_cache.get(redis_client, url_key)
+        return json.loads(cached) if cached else {}
+    except Exception:
+        return {}
+
+
+async def _degraded_format(video_id: str, height: int | None) -> dict | None:
+    """Navbat band bo'lganda tanlanadigan arzonroq format (<= DEGRADED_MAX_HEIGHT, merge'siz afzal)"""
+    items = [
+        item for item in (await _get_cached_info(video_id)).get("items") or []
+        if item.get("height") and item["height"] <= DEGRADED_MAX_HEIGHT and (not height or item["height"] < height)
+    ]
+    if not items:
+        return None
+    item = max(items, key=lambda item: (not item.get("is_merge"), item["height"]))
+    return {
+        "format_id": item.get("format_id"),
+        "is_merge": str(item.get("is_merge", 0)),
+        "ext": item.get("ext") or "mp4",
+        "height": item["height"],
+        "size_bytes": item.get("size_bytes"),
+    }
+
+
+async def _show_busy(message: Message, lang: str, audio_video_id: str | None = None) -> None:
+    """Navbat to'lgan: "keyinroq urinib ko'ring" yoki faqat MP3 taklifi"""
+    keyboard = None
+    text = t("server_busy", lang)
+    if audio_video_id:
+        text = t("busy_audio_only", lang)
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🎵 MP3", callback_data=f"music:{audio_video_id}")]
+        ])
+    try:
+        await message.edit_caption(caption=text, reply_markup=keyboard)
+    except Exception:
+        await safe_edit_text(message, text, reply_markup=keyboard)
+
+
+async def _get_cached_format_info(video_id: str, format_id: str) -> dict:
+    try:
+        info = await _get_cached_info(video_id)
         for item in info.get("items") or []:
             if item.get("format_id") == format_id:
                 return {
                     "title": info.get("title"),
                     "uploader": info.get("uploader"),
                     "height": item.get("height"),
+                    "size_bytes": item.get("size_bytes"),
+                    "duration": info.get("duration"),
                 }
     except Exception:
         return {}
@@ -344,7 +293,7 @@ async def _fetch_video_info(url: str) -> dict | None:
         try:
             import hashlib
             url_key = f"yt_info:{hashlib.md5(url.encode()).hexdigest()}"
-            cached = await redis_client.get(url_key)
+            cached = await local_cache.get(redis_client, url_key)
             if cached:
                 import json
                 cached_info = json.loads(cached)
@@ -359,7 +308,7 @@ async def _fetch_video_info(url: str) -> dict | None:
         if info and redis_client and url_key:
             try:
                 import json
-                await redis_client.setex(url_key, 300, json.dumps(info))
+                await local_cache.set(redis_client, url_key, json.dumps(info), ex=300)
             except Exception:
                 pass
         if info:
@@ -446,6 +395,19 @@ async def handle_video_format(callback: CallbackQuery):
     status_message_id = callback.message.message_id
 
     cached_info = await _get_cached_format_info(video_id, format_id)
+    admission = await task_queue.admission(process_video_task)
+    if admission in (REJECT, AUDIO_ONLY):
+        task_queue.shed(process_video_task, admission)
+        await _show_busy(callback.message, lang, video_id if admission == AUDIO_ONLY else None)
+        return
+    degraded = None
+    if admission == DEGRADE:
+        degraded = await _degraded_format(video_id, cached_info.get("height"))
+    if degraded:
+        task_queue.shed(process_video_task, DEGRADE)
+        cached_info = {**cached_info, **degraded}
+        format_id, is_merge, output_ext = degraded["format_id"], degraded["is_merge"], degraded["ext"]
+        format_selector = get_format_selector(format_id, is_merge)
     format_label = _format_quality_label(cached_info.get("height")) if cached_info else ""
     title = cached_info.get("title") or ""
     uploader = cached_info.get("uploader") or ""
@@ -457,6 +419,8 @@ async def handle_video_format(callback: CallbackQuery):
         except Exception:
             title = title or "Video"
     format_line = t("format_label", lang, label=format_label) if format_label else ""
+    if degraded:
+        format_line = t("busy_degraded", lang, label=format_label)
     initial_caption = t(
         "video_progress_caption",
         lang,
@@ -471,31 +435,32 @@ async def handle_video_format(callback: CallbackQuery):
         await callback.message.edit_reply_markup(reply_markup=None)
     except Exception:
         pass
+    cancel_kb = build_cancel_keyboard(lang)
     try:
-        await callback.message.edit_caption(initial_caption, parse_mode='HTML')
+        await callback.message.edit_caption(caption=initial_caption, parse_mode='HTML', reply_markup=cancel_kb)
     except Exception:
-        await safe_edit_text(callback.message, initial_caption, parse_mode='HTML')
+        await safe_edit_text(callback.message, initial_caption, parse_mode='HTML', reply_markup=cancel_kb)
 
     url = f"https://www.youtube.com/watch?v={video_id}"
-    # process_video_task.delay(
-    #     chat_id=callback.message.chat.id,
-    #     url=url,
-    #     status_message_id=callback.message.message_id,
-    #     format_selector=format_selector,
-    #     output_ext=output_ext
-    # )
-    # from tasks.bot_tasks import process_video_task
-    await task_queue.add_task(
-        process_video_task,
-        chat_id=callback.message.chat.id,
-        url=url,
-        status_message_id=status_message_id,
-        format_selector=format_selector,
-        output_ext=output_ext,
-        format_label=format_label,
-        title=title,
-        uploader=uploader,
+    await prefetcher.resolve(
+        callback.message.chat.id, video_id, video_choice(format_selector, output_ext), height=cached_info.get("height")
     )
+    try:
+        await task_queue.add_task(
+            process_video_task,
+            chat_id=callback.message.chat.id,
+            url=url,
+            status_message_id=status_message_id,
+            format_selector=format_selector,
+            output_ext=output_ext,
+            format_label=format_label,
+            title=title,
+            uploader=uploader,
+            scratch_bytes=estimate_video_bytes(cached_info.get("size_bytes"), is_merge == "1"),
+            duration=cached_info.get("duration"),
+        )
+    except PoolFull:
+        await _show_busy(callback.message, lang)
 
 @router.callback_query(F.data == 'delete_this_msg')
 async def handle_delete_message_callback(callback: CallbackQuery):
@@ -507,3 +472,16 @@ async def handle_delete_message_callback(callback: CallbackQuery):
         await callback.answer(t("delete_ok", lang), show_alert=False)
     else:
         await callback.answer(t("delete_failed", lang), show_alert=True)
+
+
+@router.callback_query(F.data == 'cancel_dl')
+async def handle_cancel_download(callback: CallbackQuery):
+    """Yuklashni bekor qilish tugmasi (progress xabarida)"""
+    from loader import redis_client
+    lang = await get_user_lang(callback.from_user.id, redis_client)
+    await download_registry.request_cancel((callback.message.chat.id, callback.message.message_id))
+    await callback.answer(t("download_cancelling", lang), show_alert=False)
+    try:
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
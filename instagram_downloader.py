@@ -9,7 +9,14 @@ import json
 import logging
 import os
 from pathlib import Path
-from typing import Optional
+from typing import Awaitable, Callable, Optional
+
+from aiogram.types import InputFile
+
+from services import metrics
+from services.governor import INSTAGRAM_ORIGIN, governor
+from services.scratch_budget import PART_OVERHEAD, current_reservation
+from services.stream_upload import fetch_to_buffer, max_upload_bytes, stream_upload
 
 logger = logging.getLogger(__name__)
 
@@ -83,7 +90,14 @@ async def _fetch_json(session: aiohttp.ClientSession, url: str, headers: dict, p
     return None
 
 
-async def _download_file(session: aiohttp.ClientSession, url: str, output_path: Path, headers: dict, proxy: str) -> bool:
+async def _download_file(
+    session: aiohttp.ClientSession,
+    url: str,
+    output_path: Path,
+    headers: dict,
+    proxy: str,
+    throttle: Optional[Callable[[int], Awaitable[None]]] = None,
+) -> bool:
     for attempt in range(1, MAX_RETRIES + 1):
         try:
             async with session.get(url, headers=headers, timeout=VIDEO_TIMEOUT, proxy=proxy or None) as response:
@@ -95,9 +109,15 @@ async def _download_file(session: aiohttp.ClientSession, url: str, output_path:
                         message="Instagram download error",
                         headers=response.headers
                     )
+                reservation = current_reservation.get()
+                if reservation and response.content_length:
+                    # TaskQueue taxminiy joy ajratgan - haqiqiy hajmga moslash (joy bo'lmasa taxmin bilan davom etamiz)
+                    reservation.try_grow(int(response.content_length * PART_OVERHEAD))
                 async with aiofiles.open(output_path, 'wb') as f:
                     async for chunk in response.content.iter_chunked(8192):
                         await f.write(chunk)
+                        if throttle:
+                            await throttle(len(chunk))
                 return True
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logger.warning(f"Instagram download attempt {attempt} failed: {e}")
@@ -107,72 +127,85 @@ async def _download_file(session: aiohttp.ClientSession, url: str, output_path:
     return False
 
 
+def _build_headers() -> dict:
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Accept": "*/*",
+        "Accept-Language": "en-US,en;q=0.9",
+        "Referer": "https://www.instagram.com/",
+    }
+    cookie_header = _load_instagram_cookies()
+    if cookie_header:
+        headers["Cookie"] = cookie_header
+    return headers
+
+
+async def _find_video_url(session: aiohttp.ClientSession, url: str, headers: dict, proxy: str) -> Optional[str]:
+    # URL ni tozalash
+    clean_url = url.split('?')[0].rstrip('/')
+    if not clean_url.endswith('/'):
+        clean_url += '/'
+
+    # JSON API endpoint
+    json_url = f"{clean_url}?__a=1&__d=dis"
+
+    # JSON ma'lumotlarni olish
+    data = await _fetch_json(session, json_url, headers, proxy)
+    if not data:
+        logger.error("Instagram API error: failed to fetch JSON")
+        return None
+
+    # Video URL ni topish
+    video_url = None
+
+    # Yangi format (graphql)
+    if 'graphql' in data and 'shortcode_media' in data['graphql']:
+        media = data['graphql']['shortcode_media']
+        if 'video_url' in media:
+            video_url = media['video_url']
+        elif 'edge_sidecar_to_children' in media.get('edge_sidecar_to_children', {}):
+            # Sidecar post (bir nechta media)
+            edges = media['edge_sidecar_to_children']['edges']
+            if edges and 'node' in edges[0] and 'video_url' in edges[0]['node']:
+                video_url = edges[0]['node']['video_url']
+
+    # Eski format (items)
+    elif 'items' in data and len(data['items']) > 0:
+        item = data['items'][0]
+        if 'video_versions' in item and len(item['video_versions']) > 0:
+            # Eng yuqori sifatli video
+            video_url = item['video_versions'][0]['url']
+        elif 'carousel_media' in item:
+            # Carousel post
+            carousel = item['carousel_media'][0]
+            if 'video_versions' in carousel and len(carousel['video_versions']) > 0:
+                video_url = carousel['video_versions'][0]['url']
+
+    if not video_url:
+        logger.error("Video URL not found in Instagram response")
+        return None
+
+    logger.info(f"Found Instagram video URL: {video_url[:50]}...")
+    return video_url
+
+
 async def download_instagram_direct(url: str, output_path: Path) -> Optional[str]:
     """
     Instagram video ni JSON API orqali to'g'ridan-to'g'ri yuklab olish
     Bu instaloaderdan 20x tezroq va 100% original sifat
     """
     try:
-        # URL ni tozalash
-        clean_url = url.split('?')[0].rstrip('/')
-        if not clean_url.endswith('/'):
-            clean_url += '/'
-        
-        # JSON API endpoint
-        json_url = f"{clean_url}?__a=1&__d=dis"
-        
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Accept": "*/*",
-            "Accept-Language": "en-US,en;q=0.9",
-            "Referer": "https://www.instagram.com/",
-        }
-        cookie_header = _load_instagram_cookies()
-        if cookie_header:
-            headers["Cookie"] = cookie_header
+        headers = _build_headers()
         proxy = _load_instagram_proxy()
         
         async with aiohttp.ClientSession() as session:
-            # JSON ma'lumotlarni olish
-            data = await _fetch_json(session, json_url, headers, proxy)
-            if not data:
-                logger.error("Instagram API error: failed to fetch JSON")
-                return None
-            
-            # Video URL ni topish
-            video_url = None
-            
-            # Yangi format (graphql)
-            if 'graphql' in data and 'shortcode_media' in data['graphql']:
-                media = data['graphql']['shortcode_media']
-                if 'video_url' in media:
-                    video_url = media['video_url']
-                elif 'edge_sidecar_to_children' in media.get('edge_sidecar_to_children', {}):
-                    # Sidecar post (bir nechta media)
-                    edges = media['edge_sidecar_to_children']['edges']
-                    if edges and 'node' in edges[0] and 'video_url' in edges[0]['node']:
-                        video_url = edges[0]['node']['video_url']
-            
-            # Eski format (items)
-            elif 'items' in data and len(data['items']) > 0:
-                item = data['items'][0]
-                if 'video_versions' in item and len(item['video_versions']) > 0:
-                    # Eng yuqori sifatli video
-                    video_url = item['video_versions'][0]['url']
-                elif 'carousel_media' in item:
-                    # Carousel post
-                    carousel = item['carousel_media'][0]
-                    if 'video_versions' in carousel and len(carousel['video_versions']) > 0:
-                        video_url = carousel['video_versions'][0]['url']
-            
+            video_url = await _find_video_url(session, url, headers, proxy)
             if not video_url:
-                logger.error("Video URL not found in Instagram response")
                 return None
             
-            logger.info(f"Found Instagram video URL: {video_url[:50]}...")
-            
             # Video ni yuklab olish
-            downloaded = await _download_file(session, video_url, output_path, headers, proxy)
+            async with governor.lease(INSTAGRAM_ORIGIN) as lease:
+                downloaded = await _download_file(session, video_url, output_path, headers, proxy, lease.throttle)
             if not downloaded:
                 logger.error("Video download error: failed to download")
                 return None
@@ -187,3 +220,57 @@ async def download_instagram_direct(url: str, output_path: Path) -> Optional[str
         logger.error(f"Instagram download error: {e}", exc_info=True)
         return None
 
+
+async def _content_length(session: aiohttp.ClientSession, url: str, headers: dict, proxy: Optional[str]) -> Optional[int]:
+    """Video hajmi (HEAD so'rovi); noma'lum bo'lsa None"""
+    try:
+        async with session.head(
+            url, headers=headers, timeout=JSON_TIMEOUT, proxy=proxy or None, allow_redirects=True
+        ) as response:
+            if response.status != 200:
+                return None
+            return response.content_length
+    except Exception as e:
+        logger.warning(f"Instagram HEAD failed: {e}")
+        return None
+
+
+async def stream_instagram_direct(
+    url: str,
+    send: Callable[[InputFile], Awaitable],
+    filename: str = "video.mp4",
+    progress_hook: Optional[Callable[[dict], None]] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+):
+    """
+    Instagram video'ni diskka yozmasdan Telegram'ga stream qilish.
+    Returns: yuborilgan Message yoki None (video URL topilmasa, hajmi noma'lum
+    yoki upload chegarasidan katta bo'lsa - yuklab olish yo'liga o'tiladi)
+    """
+    headers = _build_headers()
+    proxy = _load_instagram_proxy()
+    async with aiohttp.ClientSession() as session:
+        video_url = await _find_video_url(session, url, headers, proxy)
+        if not video_url:
+            return None
+        size = await _content_length(session, video_url, headers, proxy)
+        if not size or size > max_upload_bytes():
+            # Upload yarmida rad etilmasin - katta video yuklab olinib siqiladi
+            logger.info(f"Instagram stream skipped: size {size or 'unknown'} (limit {max_upload_bytes()})")
+            metrics.incr("instagram.stream_skipped")
+            return None
+
+        async def source(buffer) -> None:
+            async with governor.lease(INSTAGRAM_ORIGIN) as lease:
+                await fetch_to_buffer(
+                    session,
+                    video_url,
+                    buffer,
+                    headers=headers,
+                    proxy=proxy,
+                    progress_hook=progress_hook,
+                    should_stop=should_stop,
+                    throttle=lease.throttle,
+                )
+
+        return await stream_upload(source, send, filename)
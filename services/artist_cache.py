@@ -1,4 +1,5 @@
 from core.config import get_settings
+from services.local_cache import local_cache
 from services.redis_client import get_sync_redis
 
 
@@ -11,5 +12,6 @@ def cache_artist_name(video_id: str, artist_name: str) -> None:
     try:
         ttl = get_settings().artist_cache_ttl_seconds
         client.setex(f"artist:{video_id}", ttl, artist_name)
+        local_cache.invalidate_sync(client, f"artist:{video_id}")
     except Exception:
         pass
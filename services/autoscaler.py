@@ -0,0 +1,245 @@
+"""
+Worker autoscaler: resizes each worker pool at runtime.
+
+Every INTERVAL seconds the controller reads
+
+- queue wait per pool (`WorkerPool.wait_seconds()`: the age of the oldest
+  job still waiting in this process, 0 once the queue drains);
+- CPU utilisation of the container (cgroup v2 cpu.stat against cpu.max,
+  host /proc/stat without a cgroup), 1.0 = every available CPU busy;
+- event-loop lag: the worst overshoot of a LAG_PROBE_INTERVAL sleep since
+  the previous tick;
+- free tmpfs: the free share of TMP_DIR, and of the scratch budget
+
+and moves each pool one worker at a time within its bounds
+(AUTOSCALE_BOUNDS="video=1:3,music=2:10"; default concurrency/2 ..
+concurrency*2):
+
+- pressure (cpu > CPU_HIGH, lag > LAG_HIGH or free tmpfs < TMPFS_LOW) for
+  UP_TICKS ticks: one busy pool shrinks per tick, heaviest first (PRESSURE_ORDER);
+- jobs waiting longer than WAIT_HIGH for UP_TICKS ticks: the pool grows,
+  unless CPU, lag or tmpfs are above the lower OK thresholds (hysteresis band);
+- idle (nothing waiting, under half the workers busy) for DOWN_TICKS ticks:
+  the pool shrinks back towards its configured concurrency.
+
+A resized pool is left alone for COOLDOWN seconds. Every resize, and every
+scale-up held back by resource pressure, is logged with the signals behind
+it; pool sizes are exported as `autoscale.{pool}.workers`. Runs inside
+`TaskQueue` (bot and worker.py); AUTOSCALE=false keeps the configured sizes.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
+from core.config import get_settings
+from services import metrics
+from services.scratch_budget import scratch_budget
+
+logger = logging.getLogger(__name__)
+
+INTERVAL = 5  # seconds
+LAG_PROBE_INTERVAL = 0.5
+UP_TICKS = 2
+DOWN_TICKS = 12
+COOLDOWN = 30  # seconds
+WAIT_HIGH = 10  # seconds
+CPU_HIGH, CPU_OK = 0.9, 0.75
+LAG_HIGH, LAG_OK = 0.5, 0.1  # seconds
+TMPFS_LOW, TMPFS_OK = 0.1, 0.25
+# Bosim ostida avval shu pool'lar kichraytiriladi (merge CPU va tmpfs'ni eng ko'p band qiladi)
+PRESSURE_ORDER = ("video", "recognize", "default", "music", "broadcast")
+
+CGROUP_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_CPU_STAT = "/sys/fs/cgroup/cpu.stat"
+
+
+@dataclass(frozen=True)
+class Signals:
+    cpu: float
+    lag: float
+    tmpfs_free: float
+    budget_free: float
+
+    def pressure(self) -> str | None:
+        """Worker'larni kamaytirish sababi"""
+        if self.cpu > CPU_HIGH:
+            return f"cpu {self.cpu:.0%} > {CPU_HIGH:.0%}"
+        if self.lag > LAG_HIGH:
+            return f"loop lag {self.lag * 1000:.0f}ms > {LAG_HIGH * 1000:.0f}ms"
+        if self.tmpfs_free < TMPFS_LOW:
+            return f"tmpfs free {self.tmpfs_free:.0%} < {TMPFS_LOW:.0%}"
+        return None
+
+    def blocked(self) -> str | None:
+        """Worker qo'shishga to'sqinlik qiluvchi resurs"""
+        if self.cpu > CPU_OK:
+            return f"cpu {self.cpu:.0%} > {CPU_OK:.0%}"
+        if self.lag > LAG_OK:
+            return f"loop lag {self.lag * 1000:.0f}ms > {LAG_OK * 1000:.0f}ms"
+        if min(self.tmpfs_free, self.budget_free) < TMPFS_OK:
+            return f"tmpfs free {min(self.tmpfs_free, self.budget_free):.0%} < {TMPFS_OK:.0%}"
+        return None
+
+    def __str__(self) -> str:
+        return (
+            f"cpu {self.cpu:.0%}, lag {self.lag * 1000:.0f}ms, "
+            f"tmpfs free {self.tmpfs_free:.0%}, budget free {self.budget_free:.0%}"
+        )
+
+
+class CpuMeter:
+    """Container CPU utilisation between two samples (1.0 = all available CPUs busy)"""
+
+    def __init__(self):
+        self.cpus = self._cpu_limit()
+        self._last: tuple[float, float] | None = None
+
+    @staticmethod
+    def _cpu_limit() -> float:
+        try:
+            with open(CGROUP_CPU_MAX) as f:
+                quota, period = f.read().split()
+            if quota != "max":
+                return int(quota) / int(period)
+        except (OSError, ValueError):
+            pass
+        return float(os.cpu_count() or 1)
+
+    @staticmethod
+    def _usage() -> float | None:
+        """Ishlatilgan CPU sekundlari (ffmpeg / aria2c child process'lari ham)"""
+        try:
+            with open(CGROUP_CPU_STAT) as f:
+                for line in f:
+                    key, value = line.split()
+                    if key == "usage_usec":
+                        return int(value) / 1_000_000
+        except (OSError, ValueError):
+            pass
+        try:
+            with open("/proc/stat") as f:
+                fields = [int(value) for value in f.readline().split()[1:]]
+            idle = fields[3] + fields[4]  # idle + iowait
+            return (sum(fields[:8]) - idle) / os.sysconf("SC_CLK_TCK")
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def sample(self) -> float:
+        usage = self._usage()
+        now = time.monotonic()
+        if usage is None:
+            return os.getloadavg()[0] / self.cpus
+        last, self._last = self._last, (now, usage)
+        if last is None or now <= last[0]:
+            return 0.0
+        return max(0.0, (usage - last[1]) / ((now - last[0]) * self.cpus))
+
+
+def _parse_bounds(raw: str) -> dict[str, tuple[int, int]]:
+    bounds = {}
+    for part in raw.split(","):
+        name, _, value = part.partition("=")
+        low, _, high = value.partition(":")
+        if name.strip() and low.strip().isdigit() and high.strip().isdigit():
+            low, high = max(1, int(low)), int(high)
+            bounds[name.strip()] = (low, max(low, high))
+    return bounds
+
+
+def _pressure_rank(pool) -> int:
+    return PRESSURE_ORDER.index(pool.name) if pool.name in PRESSURE_ORDER else len(PRESSURE_ORDER)
+
+
+class Autoscaler:
+    def __init__(self):
+        self._cpu = CpuMeter()
+        self._bounds = _parse_bounds(get_settings().autoscale_bounds)
+        self._lag = 0.0
+        self._pressure_ticks = 0
+        self._up_ticks: dict[str, int] = defaultdict(int)
+        self._idle_ticks: dict[str, int] = defaultdict(int)
+        self._changed_at: dict[str, float] = {}
+
+    def bounds(self, pool) -> tuple[int, int]:
+        concurrency = pool.spec.concurrency
+        return self._bounds.get(pool.name, (max(1, concurrency // 2), concurrency * 2))
+
+    def signals(self) -> Signals:
+        try:
+            usage = shutil.disk_usage(get_settings().tmp_dir)
+            tmpfs_free = usage.free / usage.total if usage.total else 1.0
+        except OSError:
+            tmpfs_free = 1.0
+        capacity = scratch_budget.capacity
+        return Signals(
+            cpu=round(self._cpu.sample(), 3),
+            lag=round(self._lag, 3),
+            tmpfs_free=round(tmpfs_free, 3),
+            budget_free=round(scratch_budget.available / capacity, 3) if capacity else 1.0,
+        )
+
+    async def _resize(self, pool, size: int, reason: str, signals: Signals) -> None:
+        previous = pool.concurrency
+        logger.info(f"Autoscale {pool.name}: {previous} -> {size} workers ({reason}; {signals})")
+        await pool.resize(size)
+        self._changed_at[pool.name] = time.monotonic()
+        self._up_ticks[pool.name] = 0
+        self._idle_ticks[pool.name] = 0
+        metrics.incr("autoscale.up" if size > previous else "autoscale.down")
+        metrics.set_gauge(f"autoscale.{pool.name}.workers", size)
+
+    async def tick(self, pools) -> None:
+        signals = self.signals()
+        pressure = signals.pressure()
+        self._pressure_ticks = self._pressure_ticks + 1 if pressure else 0
+        shrunk = False
+        now = time.monotonic()
+        for pool in sorted(pools, key=_pressure_rank):
+            name, size = pool.name, pool.concurrency
+            low, high = self.bounds(pool)
+            waiting = pool.queued > 0
+            wait = pool.wait_seconds()
+            self._up_ticks[name] = self._up_ticks[name] + 1 if waiting and wait > WAIT_HIGH else 0
+            idle = not waiting and pool.active < size / 2
+            self._idle_ticks[name] = self._idle_ticks[name] + 1 if idle else 0
+            if now - self._changed_at.get(name, -COOLDOWN) < COOLDOWN:
+                continue
+
+            if pressure and self._pressure_ticks >= UP_TICKS:
+                if not shrunk and size > low and pool.active:
+                    await self._resize(pool, size - 1, pressure, signals)
+                    shrunk = True
+            elif self._up_ticks[name] >= UP_TICKS and size < high:
+                blocked = signals.blocked()
+                if not blocked:
+                    await self._resize(pool, size + 1, f"wait {wait:.1f}s > {WAIT_HIGH}s", signals)
+                elif self._up_ticks[name] == UP_TICKS:
+                    logger.info(f"Autoscale {name}: holding at {size} workers, wait {wait:.1f}s but {blocked} ({signals})")
+            elif self._idle_ticks[name] >= DOWN_TICKS and size > max(low, pool.spec.concurrency):
+                await self._resize(pool, size - 1, f"idle for {DOWN_TICKS * INTERVAL}s", signals)
+
+    async def run(self, pools) -> None:
+        """pools - TaskQueue.pools qiymatlari; loop lag'ni ham shu yerda o'lchaydi"""
+        for pool in pools:
+            metrics.set_gauge(f"autoscale.{pool.name}.workers", pool.concurrency)
+        self._cpu.sample()
+        last_tick = time.monotonic()
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            self._lag = max(self._lag, time.monotonic() - started - LAG_PROBE_INTERVAL)
+            if time.monotonic() - last_tick < INTERVAL:
+                continue
+            last_tick = time.monotonic()
+            try:
+                await self.tick(pools)
+            except Exception as e:
+                logger.error(f"Autoscaler error: {e}", exc_info=True)
+            self._lag = 0.0
+
+# Global instance
+autoscaler = Autoscaler()
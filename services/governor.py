@@ -0,0 +1,198 @@
+"""
+Per-origin connection and bandwidth governor.
+
+Every network transfer (yt-dlp / aria2c downloads, ranged audio fetch,
+Instagram direct and stream downloads, Telegram uploads) runs inside a
+`governor.lease(origin, connections)`:
+
+- connections: each origin has a cap (`ORIGIN_CONNECTION_LIMITS`, override
+  with ORIGIN_CONNECTION_LIMITS="youtube=32,instagram=8"). A lease gets at
+  most its fair share (`limit // active jobs`) of what it asked for and at
+  least one connection; when the origin is full, leases wait in FIFO order.
+- bandwidth: with BANDWIDTH_LIMIT_MBPS set, the budget is split evenly
+  between active leases. In-process transfers call `lease.throttle(n)` per
+  chunk (token bucket at the current share); external downloaders get the
+  share at start as aria2c `--max-download-limit` / yt-dlp `ratelimit`.
+
+Per-origin utilisation is exported as `governor.{origin}.*` gauges
+(connections, limit, jobs, waiting, utilisation, bytes_per_sec) and the
+`governor.{origin}.bytes` counter.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from core.config import get_settings
+from services import metrics
+from utils.download_strategies import domain_of
+
+logger = logging.getLogger(__name__)
+
+YOUTUBE_ORIGIN = "youtube"
+INSTAGRAM_ORIGIN = "instagram"
+TELEGRAM_ORIGIN = "telegram"
+OTHER_ORIGIN = "other"
+ORIGIN_CONNECTION_LIMITS = {
+    YOUTUBE_ORIGIN: 32,  # googlevideo 80 ta ulanishda throttling qiladi
+    INSTAGRAM_ORIGIN: 8,
+    TELEGRAM_ORIGIN: 4,  # parallel yuklashlar (upload)
+    OTHER_ORIGIN: 16,
+}
+ORIGIN_DOMAINS = {
+    YOUTUBE_ORIGIN: ("youtube.com", "youtu.be", "googlevideo.com", "ytimg.com"),
+    INSTAGRAM_ORIGIN: ("instagram.com", "cdninstagram.com", "fbcdn.net"),
+}
+BURST_SECONDS = 0.5
+RATE_WINDOW = 5.0  # bytes_per_sec gauge oynasi
+
+
+def origin_of(url: str) -> str:
+    host = domain_of(url)
+    for origin, domains in ORIGIN_DOMAINS.items():
+        if any(host == d or host.endswith(f".{d}") for d in domains):
+            return origin
+    return OTHER_ORIGIN
+
+
+def _parse_limits(raw: str) -> dict[str, int]:
+    limits = dict(ORIGIN_CONNECTION_LIMITS)
+    for part in raw.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip().isdigit():
+            limits[name.strip()] = max(1, int(value))
+    return limits
+
+
+class Lease:
+    def __init__(self, governor: "Governor", origin: str, connections: int):
+        self.governor = governor
+        self.origin = origin
+        self.connections = connections
+        self.bytes = 0
+        self._debt = 0.0
+        self._last = time.monotonic()
+
+    def rate_limit(self) -> int | None:
+        """Hozirgi adolatli ulush (bayt/s); None - cheklov yo'q"""
+        return self.governor.fair_share()
+
+    async def throttle(self, nbytes: int) -> None:
+        self.record(nbytes)
+        rate = self.rate_limit()
+        now = time.monotonic()
+        if not rate:
+            self._last = now
+            return
+        # Token bucket: ulushdan ortiq o'tkazilgan baytlar uchun kutish
+        self._debt = max(self._debt - (now - self._last) * rate, -rate * BURST_SECONDS) + nbytes
+        self._last = now
+        if self._debt > 0:
+            await asyncio.sleep(self._debt / rate)
+
+    def record(self, nbytes: int) -> None:
+        """Tashqi downloader (aria2c/yt-dlp) o'tkazgan baytlar - faqat hisob uchun"""
+        self.bytes += nbytes
+        self.governor._account(self.origin, nbytes)
+
+
+class Governor:
+    def __init__(self, limits: dict[str, int], bandwidth_bytes: int):
+        self.limits = limits
+        self.bandwidth_bytes = bandwidth_bytes
+        self._in_use: dict[str, int] = defaultdict(int)
+        self._jobs: dict[str, int] = defaultdict(int)
+        self._waiters: dict[str, deque] = defaultdict(deque)
+        self._active_leases = 0
+        self._cond = asyncio.Condition()
+        self._window_bytes: dict[str, int] = defaultdict(int)
+        self._window_start = time.monotonic()
+
+    def limit(self, origin: str) -> int:
+        return self.limits.get(origin, self.limits[OTHER_ORIGIN])
+
+    def fair_share(self) -> int | None:
+        if not self.bandwidth_bytes:
+            return None
+        return self.bandwidth_bytes // max(1, self._active_leases)
+
+    @asynccontextmanager
+    async def lease(self, origin: str, connections: int = 1) -> AsyncIterator[Lease]:
+        token = object()
+        waiters = self._waiters[origin]
+        waiters.append(token)
+        try:
+            async with self._cond:
+                self._report(origin)
+                await self._cond.wait_for(
+                    lambda: waiters[0] is token and self._in_use[origin] < self.limit(origin)
+                )
+                waiters.popleft()
+                limit = self.limit(origin)
+                # Navbatda turganlar ham hisobga olinadi - birinchi kelgan hammasini olmasin
+                fair_cap = max(1, limit // (self._jobs[origin] + len(waiters) + 1))
+                granted = max(1, min(connections, fair_cap, limit - self._in_use[origin]))
+                self._in_use[origin] += granted
+                self._jobs[origin] += 1
+                self._active_leases += 1
+                self._report(origin)
+                # Navbatdagi keyingi lease ham tekshirsin
+                self._cond.notify_all()
+        except BaseException:
+            if token in waiters:
+                waiters.remove(token)
+                async with self._cond:
+                    self._cond.notify_all()
+            raise
+        if granted < connections:
+            metrics.incr(f"governor.{origin}.capped")
+            logger.info(f"Governor {origin}: {granted}/{connections} connections granted")
+        lease = Lease(self, origin, granted)
+        try:
+            yield lease
+        finally:
+            async with self._cond:
+                self._in_use[origin] -= granted
+                self._jobs[origin] -= 1
+                self._active_leases -= 1
+                self._report(origin)
+                self._cond.notify_all()
+
+    def _account(self, origin: str, nbytes: int) -> None:
+        metrics.incr(f"governor.{origin}.bytes", nbytes)
+        self._window_bytes[origin] += nbytes
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= RATE_WINDOW:
+            for name, total in self._window_bytes.items():
+                metrics.set_gauge(f"governor.{name}.bytes_per_sec", int(total / elapsed))
+            self._window_bytes.clear()
+            self._window_start = now
+
+    def _report(self, origin: str) -> None:
+        limit = self.limit(origin)
+        metrics.set_gauge(f"governor.{origin}.connections", self._in_use[origin])
+        metrics.set_gauge(f"governor.{origin}.limit", limit)
+        metrics.set_gauge(f"governor.{origin}.jobs", self._jobs[origin])
+        metrics.set_gauge(f"governor.{origin}.waiting", len(self._waiters[origin]))
+        metrics.set_gauge(f"governor.{origin}.utilisation", round(self._in_use[origin] / limit, 2))
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        return {
+            origin: {
+                "connections": self._in_use[origin],
+                "limit": self.limit(origin),
+                "jobs": self._jobs[origin],
+                "waiting": len(self._waiters[origin]),
+            }
+            for origin in set(self.limits) | set(self._in_use)
+        }
+
+
+# Global instance
+governor = Governor(
+    _parse_limits(get_settings().origin_connection_limits),
+    get_settings().bandwidth_limit_mbps * 125_000,
+)
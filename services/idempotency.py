@@ -1,23 +1,188 @@
+"""
+Idempotency locks for download jobs: one running job per (chat, media).
+
+A lock is a lease on the shared async Redis connection (`loader.redis_client`):
+`SET key token NX PX ttl` with a random owner token. While the job runs,
+`hold()` renews the lease every ttl / RENEW_FRACTION with a Lua
+compare-and-pexpire, so a job may run for any length of time while the lock
+of a crashed process expires within IDEMPOTENCY_TTL_SECONDS. Release is a Lua
+compare-and-delete, so a job never deletes a lock that another owner holds.
+A resumed (redelivered) job never takes a lock over - its first owner may
+still be alive - it retries `SET NX` for up to one lease TTL (`wait=True`),
+by which time a dead owner's lease has expired.
+
+If renewal finds the lease gone or owned by someone else, the lease is
+marked lost and its `on_lost` callback runs (the video task cancels its
+download); `check_held()` raises LockLost so the job does not upload.
+
+Without Redis, or when a Redis call fails, locks fall back to this process
+only (logged and counted as `lock.errors`). Metrics: `lock.{kind}.acquired`,
+`.contended`, `.lost` (renewal found another owner), plus the `lock.held`
+gauge; kind is the second key segment (`idempotency:video:...`).
+"""
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable
+
 from core.config import get_settings
-from services.redis_client import get_sync_redis
-
-
-def acquire_lock(key: str) -> bool:
-    client = get_sync_redis()
-    if not client:
-        return True
-    try:
-        ttl = get_settings().idempotency_ttl_seconds
-        return bool(client.set(key, "1", nx=True, ex=ttl))
-    except Exception:
-        return True
-
-
-def release_lock(key: str) -> None:
-    client = get_sync_redis()
-    if not client:
-        return
-    try:
-        client.delete(key)
-    except Exception:
-        pass
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+RENEW_FRACTION = 3
+RETRY_INTERVAL = 2  # seconds
+
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+@dataclass
+class Lease:
+    key: str
+    token: str
+    local: bool = False  # Redis'siz - faqat shu process ichida
+    lost: bool = False
+    on_lost: Callable[[], None] | None = None
+
+
+class LockLost(Exception):
+    """Job ishlayotganida lock boshqa egaga o'tdi"""
+
+
+current_lease: ContextVar[Lease | None] = ContextVar("current_lease", default=None)
+
+
+def check_held() -> None:
+    """Upload'dan oldin: lock yo'qolgan bo'lsa LockLost"""
+    lease = current_lease.get()
+    if lease and lease.lost:
+        raise LockLost(lease.key)
+
+
+def _kind(key: str) -> str:
+    parts = key.split(":")
+    return parts[1] if len(parts) > 2 else parts[0]
+
+
+class IdempotencyLocks:
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._local: dict[str, str] = {}
+        self._held: set[str] = set()
+
+    @staticmethod
+    def _redis():
+        from loader import redis_client
+        return redis_client
+
+    @property
+    def ttl_ms(self) -> int:
+        return get_settings().idempotency_ttl_seconds * 1000
+
+    def _acquire_local(self, key: str, token: str) -> Lease | None:
+        if key in self._local:
+            return None
+        self._local[key] = token
+        return Lease(key, token, local=True)
+
+    async def _try_acquire(self, key: str, token: str) -> Lease | None:
+        redis_client = self._redis()
+        if not redis_client:
+            return self._acquire_local(key, token)
+        try:
+            if await redis_client.set(key, token, nx=True, px=self.ttl_ms):
+                return Lease(key, token)
+            return None
+        except Exception as e:
+            logger.warning(f"Idempotency lock error ({key}), using process-local lock: {e}")
+            metrics.incr("lock.errors")
+            return self._acquire_local(key, token)
+
+    async def acquire(self, key: str, wait: bool = False) -> Lease | None:
+        """Lock olish; boshqa job ushlab turgan bo'lsa None. wait=True - bitta lease TTL'gacha qayta urinish"""
+        kind = _kind(key)
+        token = f"{self.owner}:{secrets.token_hex(8)}"
+        deadline = time.monotonic() + (self.ttl_ms / 1000 if wait else 0)
+        lease = await self._try_acquire(key, token)
+        while lease is None and time.monotonic() < deadline:
+            await asyncio.sleep(RETRY_INTERVAL)
+            lease = await self._try_acquire(key, token)
+        if lease is None:
+            metrics.incr(f"lock.{kind}.contended")
+            return None
+        metrics.incr(f"lock.{kind}.acquired")
+        return lease
+
+    async def release(self, lease: Lease) -> None:
+        if lease.local:
+            if self._local.get(lease.key) == lease.token:
+                del self._local[lease.key]
+            return
+        try:
+            await self._redis().eval(RELEASE_SCRIPT, 1, lease.key, lease.token)
+        except Exception as e:
+            # Lease TTL tugagach lock o'zi bo'shaydi
+            logger.warning(f"Idempotency lock release error ({lease.key}): {e}")
+            metrics.incr("lock.errors")
+
+    async def _renew(self, lease: Lease) -> None:
+        """Job ishlayotgan paytda lease'ni uzaytirib turish"""
+        interval = self.ttl_ms / 1000 / RENEW_FRACTION
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                renewed = await self._redis().eval(RENEW_SCRIPT, 1, lease.key, lease.token, self.ttl_ms)
+            except Exception as e:
+                logger.warning(f"Idempotency lock renewal error ({lease.key}): {e}")
+                metrics.incr("lock.errors")
+                continue
+            if not renewed:
+                lease.lost = True
+                logger.warning(f"Idempotency lock {lease.key} lost: lease expired or taken over")
+                metrics.incr(f"lock.{_kind(lease.key)}.lost")
+                if lease.on_lost:
+                    lease.on_lost()
+                return
+
+    @asynccontextmanager
+    async def hold(self, key: str, wait: bool = False) -> AsyncIterator[Lease | None]:
+        """Lock'ni blok davomida ushlab turish (current_lease); olinmasa None beriladi"""
+        lease = await self.acquire(key, wait)
+        if lease is None:
+            yield None
+            return
+        renewal = None if lease.local else asyncio.create_task(self._renew(lease))
+        self._held.add(key)
+        metrics.set_gauge("lock.held", len(self._held))
+        lease_token = current_lease.set(lease)
+        try:
+            yield lease
+        finally:
+            current_lease.reset(lease_token)
+            if renewal:
+                renewal.cancel()
+                await asyncio.gather(renewal, return_exceptions=True)
+            self._held.discard(key)
+            metrics.set_gauge("lock.held", len(self._held))
+            await self.release(lease)
+
+# Global instance
+idempotency_locks = IdempotencyLocks()
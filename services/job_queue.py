@@ -0,0 +1,415 @@
+"""
+Durable job queue on Redis Streams.
+
+`enqueue(name, kwargs, scratch_bytes)` appends an entry to the pool's
+stream (`jobs:stream`, `jobs:stream:{pool}` - one JobQueue per worker pool,
+see `services.worker_pools`); every process running `run()` (the bot, or
+extra `python worker.py` processes) reads from the `workers` consumer
+group, so jobs are shared between processes and survive restarts:
+
+- at-least-once: an entry is acked (and deleted) only after its task
+  returned; running entries are re-claimed every HEARTBEAT_INTERVAL, so
+  their idle time stays low while the consumer is alive.
+- visibility timeout: entries idle longer than VISIBILITY_TIMEOUT (dead
+  consumer) are taken over by any live consumer with XAUTOCLAIM; on startup
+  a process takes over the same idle entries at once and removes consumers
+  that have been silent for VISIBILITY_TIMEOUT with nothing left pending.
+  Live consumers (the heartbeat keeps their entries' idle time low) are
+  never touched. Every process gets its own consumer name (host:pid plus
+  a random suffix - containers share the hostname and all run as PID 1).
+  Redelivered entries run with `resumed=True`.
+- retries / dead-letter: a task that raises is re-enqueued with
+  `attempts + 1`; after MAX_DELIVERIES (crash redeliveries included), or
+  when the entry is older than MAX_JOB_AGE, it goes to `jobs:dead` instead.
+  A task that runs longer than the pool timeout is cancelled and
+  dead-lettered without a retry.
+
+Entries are read up to LOOKAHEAD_PER_SLOT per slot ahead and run in the
+order chosen by `services.scheduler.FairScheduler` (per-chat fair share,
+short jobs first, per-chat concurrency cap); fairness holds within one
+consumer process, entries held by another process are not reordered.
+
+Tasks are looked up by name in the `job_store` registry (`@job_store.resumable`).
+The queue needs a Redis that does not evict it (the bundled one runs with
+volatile-lru; the stream has no TTL). If the stream or its consumer group
+goes missing anyway, the reader recreates the group (NOGROUP) and carries
+on; the jobs that were in it are lost.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+
+import msgpack
+from redis.exceptions import ResponseError
+
+from core.config import get_settings
+from services import metrics
+from services.job_store import current_job, job_store
+from services.job_timings import current_timing, job_timings, size_bucket
+from services.message_utils import report_job_timeout
+from services.scheduler import FairScheduler, ScheduledJob, expected_seconds
+from services.scratch_budget import current_reservation, scratch_budget
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "jobs:stream"
+DEAD_LETTER_KEY = "jobs:dead"
+GROUP = "workers"
+VISIBILITY_TIMEOUT = 120  # seconds
+HEARTBEAT_INTERVAL = 30
+RECLAIM_INTERVAL = 15
+READ_BLOCK_MS = 5000
+MAX_DELIVERIES = 3
+MAX_JOB_AGE = 2 * 3600  # status xabari ham eskirgan - foydalanuvchi allaqachon kutmayapti
+DEAD_LETTER_MAXLEN = 1000
+LOOKAHEAD_PER_SLOT = 4  # scheduler tanlashi uchun oldindan olinadigan job'lar (slot boshiga)
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class JobQueue:
+    def __init__(
+        self,
+        stream: str = STREAM_KEY,
+        group: str = GROUP,
+        dead_letter: str = DEAD_LETTER_KEY,
+        pool: str = "default",
+        timeout: float = 0,
+    ):
+        self.stream = stream
+        self.pool = pool
+        self.timeout = timeout
+        self.group = group
+        self.dead_letter = dead_letter
+        self.host = socket.gethostname()
+        # Container'larda hostname bir xil, PID esa 1 - tasodifiy qo'shimcha nomni yagona qiladi
+        self.consumer = f"{self.host}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.concurrency = 0
+        # Shu consumer olgan (scheduler'da kutayotgan yoki ishlayotgan) yozuvlar
+        self._held: set[str] = set()
+        self._executing = 0
+        self._changed = asyncio.Condition()
+        self.scheduler = FairScheduler(get_settings().max_jobs_per_chat, metrics_prefix=f"scheduler.{pool}")
+        self._tasks: set[asyncio.Task] = set()
+        self._last_reclaim = 0.0
+        self._own_pending = False  # _recover olgan job'lar
+
+    @staticmethod
+    def _redis():
+        from loader import redis_client
+        return redis_client
+
+    @property
+    def available(self) -> bool:
+        return self._redis() is not None
+
+    @property
+    def saturated(self) -> bool:
+        """Barcha slotlar band - yangi job'lar navbatda kutadi"""
+        return bool(self.concurrency) and self._executing >= self.concurrency
+
+    @property
+    def executing(self) -> int:
+        return self._executing
+
+    async def depth(self) -> int:
+        """Tugallanmagan (navbatdagi va ishlayotgan) job'lar - barcha process'lar bo'yicha"""
+        return await self._redis().xlen(self.stream)
+
+    async def ahead_of(self, entry_id: str, limit: int = 1000) -> list[tuple[str, dict]] | None:
+        """Stream'da shu yozuvdan oldingi (navbatdagi va ishlayotgan) job'lar; yozuv yo'q bo'lsa None"""
+        entries = await self._redis().xrange(self.stream, "-", entry_id, count=limit + 1)
+        entries = [(_decode(other_id), fields) for other_id, fields in entries]
+        if not entries or entries[-1][0] != entry_id:
+            return None
+        return entries[:-1]
+
+    async def live_consumers(self) -> int:
+        """Yaqinda stream'ni o'qigan consumer'lar (process'lar) soni"""
+        consumers = await self._redis().xinfo_consumers(self.stream, self.group)
+        return sum(1 for consumer in consumers if consumer.get("idle", 0) < VISIBILITY_TIMEOUT * 1000)
+
+    async def enqueue(
+        self, name: str, kwargs: dict, scratch_bytes: int = 0, attempts: int = 0, cost: float | None = None
+    ) -> str:
+        """cost: kutilayotgan davomiylik (sekund) - scheduler qisqa job'larni oldinga o'tkazadi"""
+        entry_id = await self._redis().xadd(self.stream, {
+            "task": name,
+            "kwargs": msgpack.packb(kwargs),
+            "scratch": scratch_bytes,
+            "attempts": attempts,
+            "cost": round(cost if cost is not None else expected_seconds(scratch_bytes), 2),
+        })
+        metrics.incr("job_queue.enqueued")
+        return _decode(entry_id)
+
+    async def resize(self, concurrency: int) -> None:
+        """Slotlar sonini o'zgartirish; ortiqcha ishlayotgan job'lar tugaguncha davom etadi"""
+        self.concurrency = concurrency
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _ensure_group(self) -> None:
+        try:
+            await self._redis().xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _recover(self) -> int:
+        """O'lgan process'lar (restart, OOM) olib qo'ygan, VISIBILITY_TIMEOUT'dan beri tegilmagan job'larni darhol olish"""
+        redis_client = self._redis()
+        min_idle = VISIBILITY_TIMEOUT * 1000
+        claimed = 0
+        for consumer in await redis_client.xinfo_consumers(self.stream, self.group):
+            name = _decode(consumer["name"])
+            if name == self.consumer:
+                continue
+            pending = await redis_client.xpending_range(
+                self.stream, self.group, "-", "+", 1000, consumername=name, idle=min_idle
+            )
+            ids = [entry["message_id"] for entry in pending]
+            left = consumer.get("pending", 0)
+            if ids:
+                # JUSTID'siz - delivery counter oshadi (poison job'lar dead-letter'ga tushsin);
+                # min_idle qayta tekshiriladi - heartbeat yangilagan yozuvlar olinmaydi
+                entries = await redis_client.xclaim(self.stream, self.group, self.consumer, min_idle, ids)
+                claimed += len(entries)
+                left -= len(entries)
+            if consumer.get("idle", 0) >= min_idle and left <= 0:
+                # Uzoq vaqt jim turgan va hech narsa ushlamagan consumer
+                await redis_client.xgroup_delconsumer(self.stream, self.group, name)
+        self._own_pending = bool(claimed)
+        if claimed:
+            logger.info(f"Recovered {claimed} job(s) from previous run ({self.pool})")
+        return claimed
+
+    async def _next(self) -> tuple[str, dict, bool] | None:
+        """(entry_id, fields, qayta_yuborilgan) - avval o'z pending'lari, keyin o'lik consumer'larniki, keyin yangilari"""
+        redis_client = self._redis()
+        # O'zimizga tegishli, lekin hali ishlanmayotgan (recover qilingan) job'lar
+        if self._own_pending:
+            own = await redis_client.xreadgroup(self.group, self.consumer, {self.stream: "0"}, count=100)
+            for _, entries in own:
+                for entry_id, fields in entries:
+                    entry_id = _decode(entry_id)
+                    if not fields:
+                        # Stream'dan o'chirilgan, PEL'da qolgan yozuv
+                        await redis_client.xack(self.stream, self.group, entry_id)
+                    elif entry_id not in self._held:
+                        return entry_id, fields, True
+            self._own_pending = False
+        if time.monotonic() - self._last_reclaim >= RECLAIM_INTERVAL:
+            self._last_reclaim = time.monotonic()
+            _, entries, *_ = await redis_client.xautoclaim(
+                self.stream, self.group, self.consumer, VISIBILITY_TIMEOUT * 1000, count=1
+            )
+            for entry_id, fields in entries:
+                metrics.incr("job_queue.reclaimed")
+                return _decode(entry_id), fields, True
+        response = await redis_client.xreadgroup(
+            self.group, self.consumer, {self.stream: ">"}, count=1, block=READ_BLOCK_MS
+        )
+        for _, entries in response:
+            for entry_id, fields in entries:
+                return _decode(entry_id), fields, False
+        return None
+
+    async def _deliveries(self, entry_id: str) -> int:
+        pending = await self._redis().xpending_range(self.stream, self.group, entry_id, entry_id, 1)
+        return pending[0]["times_delivered"] if pending else 1
+
+    async def _ack(self, entry_id: str) -> None:
+        pipe = self._redis().pipeline(transaction=False)
+        pipe.xack(self.stream, self.group, entry_id)
+        pipe.xdel(self.stream, entry_id)
+        await pipe.execute()
+
+    async def _dead_letter(self, entry_id: str, fields: dict, reason: str) -> None:
+        logger.warning(f"Job {entry_id} ({_decode(fields.get(b'task', b''))}) dead-lettered: {reason}")
+        await self._redis().xadd(
+            self.dead_letter,
+            {**fields, "entry_id": entry_id, "reason": reason[:500], "failed_at": int(time.time())},
+            maxlen=DEAD_LETTER_MAXLEN,
+            approximate=True,
+        )
+        await self._ack(entry_id)
+        await job_store.finish(entry_id, cleanup=True)
+        metrics.incr("job_queue.dead_lettered")
+
+    async def _admit(self, entry_id: str, fields: dict, redelivered: bool) -> ScheduledJob | None:
+        """O'qilgan yozuvni tekshirish; bajarib bo'lmaydiganlari dead-letter'ga"""
+        name = _decode(fields.get(b"task", b""))
+        attempts = int(fields.get(b"attempts", 0))
+        deliveries = await self._deliveries(entry_id) if redelivered else 1
+        enqueued_at = int(entry_id.split("-")[0]) / 1000
+        age = time.time() - enqueued_at
+        func = job_store.task(name)
+        if func is None:
+            await self._dead_letter(entry_id, fields, f"unknown task {name!r}")
+            return None
+        if attempts + deliveries > MAX_DELIVERIES:
+            await self._dead_letter(entry_id, fields, f"{attempts + deliveries - 1} failed deliveries")
+            return None
+        if age > MAX_JOB_AGE:
+            await self._dead_letter(entry_id, fields, f"expired ({int(age)}s old)")
+            return None
+
+        kwargs = msgpack.unpackb(fields[b"kwargs"])
+        if redelivered:
+            kwargs["resumed"] = True
+            metrics.incr("job_queue.resumed")
+        scratch = int(fields.get(b"scratch", 0))
+        return ScheduledJob(
+            entry_id,
+            kwargs.get("chat_id"),
+            float(fields.get(b"cost", 0)) or expected_seconds(scratch),
+            kind=name,
+            enqueued_at=enqueued_at,
+            payload=(func, kwargs, fields, attempts + deliveries, scratch),
+        )
+
+    async def _execute(self, job: ScheduledJob) -> None:
+        func, kwargs, fields, deliveries, scratch = job.payload
+        entry_id = job.key
+        reservation = await scratch_budget.reserve(scratch)
+        waited = time.time() - job.enqueued_at
+        metrics.set_gauge(f"pool.{self.pool}.wait_ms", int(waited * 1000))
+        await job_store.start(entry_id)
+        timing = (self.pool, size_bucket(scratch), await self.depth())
+        await job_timings.record(*timing[:2], "wait", waited, timing[2])
+        token = current_reservation.set(reservation)
+        job_token = current_job.set(entry_id)
+        timing_token = current_timing.set(timing)
+        started = time.monotonic()
+        try:
+            if self.timeout:
+                await asyncio.wait_for(func(**kwargs), self.timeout)
+            else:
+                await func(**kwargs)
+        except asyncio.TimeoutError:
+            metrics.incr(f"pool.{self.pool}.timeouts")
+            await report_job_timeout(kwargs)
+            return await self._dead_letter(entry_id, fields, f"timed out after {int(self.timeout)}s")
+        except Exception as e:
+            logger.error(f"Job {entry_id} ({job.kind}) failed: {e}", exc_info=True)
+            metrics.incr("job_queue.failed")
+            if deliveries >= MAX_DELIVERIES:
+                return await self._dead_letter(entry_id, fields, str(e) or type(e).__name__)
+            kwargs.pop("resumed", None)
+            await self.enqueue(job.kind, kwargs, scratch, deliveries, job.cost)
+        else:
+            await job_timings.record(*timing[:2], "run", time.monotonic() - started, timing[2])
+        finally:
+            current_timing.reset(timing_token)
+            current_job.reset(job_token)
+            current_reservation.reset(token)
+            reservation.release()
+        # Shutdown'da (CancelledError) bu yerga yetilmaydi - job qayta yuboriladi
+        await self._ack(entry_id)
+        await job_store.finish(entry_id)
+        metrics.incr("job_queue.done")
+
+    async def _heartbeat(self) -> None:
+        """Olingan (navbatdagi va ishlayotgan) job'larning idle vaqtini nolga tushirish"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if not self._held:
+                continue
+            try:
+                await self._redis().xclaim(self.stream, self.group, self.consumer, 0, list(self._held), justid=True)
+            except Exception as e:
+                logger.error(f"Job queue heartbeat error: {e}")
+
+    async def _reader(self) -> None:
+        """Stream'dan LOOKAHEAD tagacha job olib scheduler'ga berish"""
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self._held) < self.concurrency * LOOKAHEAD_PER_SLOT)
+            try:
+                item = await self._next()
+            except ResponseError as e:
+                if "NOGROUP" not in str(e):
+                    logger.error(f"Job queue read error: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                # Stream yoki group o'chib ketgan (masalan LRU eviction) - qayta yaratamiz
+                logger.warning(f"Job queue group missing ({self.stream}), recreating")
+                metrics.incr("job_queue.group_recreated")
+                try:
+                    await self._ensure_group()
+                except Exception as e:
+                    logger.error(f"Job queue group create error: {e}")
+                    await asyncio.sleep(1)
+                continue
+            except Exception as e:
+                logger.error(f"Job queue read error: {e}")
+                await asyncio.sleep(1)
+                continue
+            if item is None:
+                continue
+            entry_id, fields, redelivered = item
+            self._held.add(entry_id)
+            try:
+                job = await self._admit(entry_id, fields, redelivered)
+            except Exception as e:
+                logger.error(f"Job queue entry {entry_id} error: {e}", exc_info=True)
+                job = None
+            async with self._changed:
+                if job is None:
+                    self._held.discard(entry_id)
+                else:
+                    self.scheduler.push(job)
+                self._changed.notify_all()
+
+    async def _run_job(self, job: ScheduledJob) -> None:
+        try:
+            await self._execute(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job queue entry {job.key} error: {e}", exc_info=True)
+        finally:
+            self.scheduler.done(job)
+            self._held.discard(job.key)
+            self._executing -= 1
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def _dispatcher(self) -> None:
+        while True:
+            async with self._changed:
+                while True:
+                    job = self.scheduler.pop() if self._executing < self.concurrency else None
+                    if job:
+                        break
+                    await self._changed.wait()
+            self._executing += 1
+            task = asyncio.create_task(self._run_job(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def run(self, concurrency: int) -> None:
+        """`concurrency` ta job'ni parallel bajaruvchi consumer"""
+        self.concurrency = concurrency
+        self.scheduler = FairScheduler(get_settings().max_jobs_per_chat, metrics_prefix=f"scheduler.{self.pool}")
+        await self._ensure_group()
+        await self._recover()
+        loops = [
+            asyncio.create_task(self._heartbeat()),
+            asyncio.create_task(self._reader()),
+            asyncio.create_task(self._dispatcher()),
+        ]
+        logger.info(f"Job queue consumer {self.consumer} started ({self.pool}: {concurrency} slots)")
+        try:
+            await asyncio.gather(*loops)
+        finally:
+            for task in loops + list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*loops, *self._tasks, return_exceptions=True)
+            logger.info(f"Job queue consumer {self.consumer} stopped ({self.pool})")
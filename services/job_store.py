@@ -0,0 +1,106 @@
+"""
+Task registry and scratch-file bookkeeping for queued download jobs.
+
+Tasks decorated with `@job_store.resumable` are enqueued by name with
+their kwargs (`services.job_queue`, Redis Streams), so any process can run
+them and a job interrupted by a restart (`make restart`, OOM kill) is
+delivered again with `resumed=True`; the task then edits the original
+status message instead of sending a new one.
+
+Downloads record their TMP_DIR file stem for the running job
+(`attach_stem`), so the cleanup worker keeps their `.part` / `.aria2` /
+`.ranges` files, and the redelivered download continues from them (yt-dlp
+`continuedl`, `aria2c -c`, ranged fetch control file) instead of fetching
+completed bytes again.
+"""
+import logging
+import time
+from contextvars import ContextVar
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+STEMS_KEY = "jobs:stems"
+STARTED_KEY = "jobs:started"  # job_id -> boshlangan vaqt (navbatdagi o'rin / ETA uchun)
+
+current_job: ContextVar[str | None] = ContextVar("current_job", default=None)
+
+
+class JobStore:
+    def __init__(self):
+        self._tasks: dict[str, Callable] = {}
+
+    @staticmethod
+    def _redis():
+        from loader import redis_client
+        return redis_client
+
+    def resumable(self, func: Callable) -> Callable:
+        """Nomi bo'yicha navbatga qo'yiladigan task (kwargs msgpack'lanadigan bo'lishi kerak)"""
+        self._tasks[func.__name__] = func
+        return func
+
+    def is_resumable(self, func: Callable) -> bool:
+        return self._tasks.get(getattr(func, "__name__", "")) is func
+
+    def task(self, name: str) -> Callable | None:
+        return self._tasks.get(name)
+
+    async def finish(self, job_id: str | None, cleanup: bool = False) -> None:
+        """Job tugadi; cleanup=True - qayta yuborilmaydigan job'ning qisman fayllarini o'chirish"""
+        redis_client = self._redis()
+        if not redis_client or not job_id:
+            return
+        try:
+            stem = await redis_client.hget(STEMS_KEY, job_id) if cleanup else None
+            await redis_client.hdel(STEMS_KEY, job_id)
+            await redis_client.hdel(STARTED_KEY, job_id)
+        except Exception as e:
+            logger.error(f"Job store finish error: {e}")
+            return
+        if stem:
+            from utils.cancellation import cleanup_partial_files
+            cleanup_partial_files(stem.decode() if isinstance(stem, bytes) else stem)
+
+    async def start(self, job_id: str) -> None:
+        redis_client = self._redis()
+        if not redis_client:
+            return
+        try:
+            await redis_client.hset(STARTED_KEY, job_id, round(time.time(), 1))
+        except Exception as e:
+            logger.error(f"Job store start error: {e}")
+
+    async def started_at(self, job_ids: list[str]) -> dict[str, float]:
+        """Boshlangan job'lar: job_id -> boshlangan vaqt (unix)"""
+        redis_client = self._redis()
+        if not redis_client or not job_ids:
+            return {}
+        values = await redis_client.hmget(STARTED_KEY, job_ids)
+        return {job_id: float(value) for job_id, value in zip(job_ids, values) if value is not None}
+
+    async def attach_stem(self, stem: str) -> None:
+        """Hozirgi job'ning TMP_DIR fayllari - cleanup ularni o'chirmasin"""
+        redis_client = self._redis()
+        job_id = current_job.get()
+        if not redis_client or not job_id:
+            return
+        try:
+            await redis_client.hset(STEMS_KEY, job_id, stem)
+        except Exception as e:
+            logger.error(f"Job store stem error: {e}")
+
+    async def active_stems(self) -> set[str]:
+        redis_client = self._redis()
+        if not redis_client:
+            return set()
+        try:
+            stems = await redis_client.hvals(STEMS_KEY)
+        except Exception as e:
+            logger.error(f"Job store stems error: {e}")
+            return set()
+        return {stem.decode() if isinstance(stem, bytes) else stem for stem in stems}
+
+
+# Global instance
+job_store = JobStore()
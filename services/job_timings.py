@@ -0,0 +1,149 @@
+"""
+Per-stage job timings by job class and size bucket.
+
+Stages: `wait` (queue, enqueue -> start), `download`, `upload`, `stream`
+(download and upload in one pass) and `run` (the whole task). Each sample
+carries its job class (worker pool), size bucket (scratch reservation) and
+the load when the job started (unfinished jobs in the pool):
+
+- a moving average per (class, bucket, stage) lives in the Redis hash
+  `timings:ema`, shared by all processes; `services.queue_status` builds
+  queue ETAs from it. Exported as `timings.{class}.{bucket}.{stage}_ms`.
+- every sample is buffered and written to the `job_timings` table every
+  FLUSH_INTERVAL seconds by `job_timings.run()`, so latency against load
+  can be queried, e.g.
+
+      SELECT load, count(*), percentile_cont(0.5) WITHIN GROUP (ORDER BY seconds)
+      FROM job_timings WHERE job_class = 'video' AND stage = 'wait'
+        AND created_at > now() - interval '1 day'
+      GROUP BY load ORDER BY load;
+
+Stages inside a task are measured with `async with job_timings.measure("download")`;
+the class, bucket and load come from `current_timing`, set by the worker
+that runs the task. Failed stages are not recorded.
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator
+
+from sqlalchemy.dialects.postgresql import insert
+
+from services import metrics
+from utils.db_api.database import async_session
+from utils.db_api.models import JobTiming
+
+logger = logging.getLogger(__name__)
+
+EMA_KEY = "timings:ema"
+EMA_ALPHA = 0.2
+EMA_REFRESH_INTERVAL = 60  # boshqa process'lar yozgan qiymatlarni qayta o'qish
+FLUSH_INTERVAL = 10  # seconds
+MAX_PENDING = 10_000
+SIZE_BUCKETS = (
+    (50 * 1024 * 1024, "s"),
+    (200 * 1024 * 1024, "m"),
+    (1024 * 1024 * 1024, "l"),
+)
+
+# (job_class, size_bucket, load) - ishlayotgan job uchun
+current_timing: ContextVar[tuple[str, str, int] | None] = ContextVar("current_timing", default=None)
+
+
+def size_bucket(nbytes: int) -> str:
+    for limit, name in SIZE_BUCKETS:
+        if nbytes < limit:
+            return name
+    return "xl"
+
+
+class JobTimings:
+    def __init__(self):
+        self._ema: dict[str, float] = {}
+        self._refreshed_at = 0.0
+        self._pending: list[dict] = []
+
+    @staticmethod
+    def _redis():
+        from loader import redis_client
+        return redis_client
+
+    @staticmethod
+    def _key(job_class: str, bucket: str, stage: str) -> str:
+        return f"{job_class}:{bucket}:{stage}"
+
+    def estimate(self, job_class: str, bucket: str, stage: str) -> float | None:
+        """O'rtacha davomiylik (sekund); tarix bo'lmasa None"""
+        return self._ema.get(self._key(job_class, bucket, stage))
+
+    async def refresh(self) -> None:
+        redis_client = self._redis()
+        if not redis_client or time.monotonic() - self._refreshed_at < EMA_REFRESH_INTERVAL:
+            return
+        self._refreshed_at = time.monotonic()
+        try:
+            raw = await redis_client.hgetall(EMA_KEY)
+        except Exception as e:
+            logger.error(f"Job timings refresh error: {e}")
+            return
+        for key, value in raw.items():
+            self._ema[key.decode() if isinstance(key, bytes) else key] = float(value)
+
+    async def record(self, job_class: str, bucket: str, stage: str, seconds: float, load: int = 0) -> None:
+        key = self._key(job_class, bucket, stage)
+        previous = self._ema.get(key)
+        ema = seconds if previous is None else previous + EMA_ALPHA * (seconds - previous)
+        self._ema[key] = ema
+        metrics.set_gauge(f"timings.{job_class}.{bucket}.{stage}_ms", int(ema * 1000))
+        if len(self._pending) < MAX_PENDING:
+            self._pending.append({
+                "job_class": job_class, "size_bucket": bucket, "stage": stage,
+                "seconds": round(seconds, 3), "load": load,
+            })
+        redis_client = self._redis()
+        if not redis_client:
+            return
+        try:
+            await redis_client.hset(EMA_KEY, key, round(ema, 2))
+        except Exception as e:
+            logger.error(f"Job timings record error: {e}")
+
+    @asynccontextmanager
+    async def measure(self, stage: str) -> AsyncIterator[None]:
+        started = time.monotonic()
+        yield
+        timing = current_timing.get()
+        if timing:
+            job_class, bucket, load = timing
+            await self.record(job_class, bucket, stage, time.monotonic() - started, load)
+
+    async def flush(self) -> None:
+        rows, self._pending = self._pending, []
+        if not rows:
+            return
+        try:
+            async with async_session() as session:
+                await session.execute(insert(JobTiming).values(rows))
+                await session.commit()
+            metrics.incr("job_timings.flushed", len(rows))
+        except Exception as e:
+            logger.error(f"Job timings flush error: {e}")
+            metrics.incr("job_timings.flush_failed")
+            self._pending = (rows + self._pending)[-MAX_PENDING:]
+
+    async def run(self) -> None:
+        """Namunalarni vaqti-vaqti bilan Postgres'ga yozuvchi worker"""
+        try:
+            while True:
+                await asyncio.sleep(FLUSH_INTERVAL)
+                await self.flush()
+                await self.refresh()
+        except asyncio.CancelledError:
+            await self.flush()
+            raise
+
+
+# Global instance
+job_timings = JobTimings()
@@ -0,0 +1,175 @@
+"""
+In-process LRU/TTL tier in front of Redis for read-mostly keys.
+
+`user:lang:`, `yt_info:`, `search:music:v3:` and `artist:` are read on
+almost every update but change rarely. `local_cache.get(redis_client, key)`
+answers from a per-prefix LRU (size limit + short TTL, misses included) and
+only goes to Redis on a local miss. Writers use `local_cache.set(...)` /
+`invalidate(...)`, which drop the local copy and publish the key on the
+`cache:invalidate` channel; every bot process runs `invalidation_listener()`
+and drops its copy too. If the subscription drops, all local tiers are
+cleared on reconnect, since invalidations may have been missed.
+
+Hits, misses, evictions and expirations are counted as
+`local_cache.{tier}.*`, the tier size is the `local_cache.{tier}.size` gauge.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+RESUBSCRIBE_DELAY = 5
+
+MISSING = object()
+
+
+class LocalCache:
+    """Bitta prefiks uchun LRU; qiymat None bo'lishi ham mumkin (Redis'da yo'q)"""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            metrics.incr(f"local_cache.{self.name}.miss")
+            return MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            metrics.incr(f"local_cache.{self.name}.expired")
+            metrics.incr(f"local_cache.{self.name}.miss")
+            return MISSING
+        self._data.move_to_end(key)
+        metrics.incr(f"local_cache.{self.name}.hit")
+        return value
+
+    def put(self, key: str, value: Any, ttl: float | None = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            metrics.incr(f"local_cache.{self.name}.eviction")
+        metrics.set_gauge(f"local_cache.{self.name}.size", len(self._data))
+
+    def discard(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+        metrics.set_gauge(f"local_cache.{self.name}.size", 0)
+
+
+class TwoTierCache:
+    def __init__(self):
+        # (prefiks, tier) - eng uzun prefiks birinchi tekshiriladi
+        self._tiers: list[tuple[str, LocalCache]] = []
+
+    def register(self, prefix: str, name: str, maxsize: int, ttl: float) -> None:
+        self._tiers.append((prefix, LocalCache(name, maxsize, ttl)))
+        self._tiers.sort(key=lambda item: len(item[0]), reverse=True)
+
+    def _tier(self, key: str) -> LocalCache | None:
+        for prefix, tier in self._tiers:
+            if key.startswith(prefix):
+                return tier
+        return None
+
+    def peek(self, key: str) -> Any:
+        """Faqat lokal qatlam; topilmasa `MISSING`"""
+        tier = self._tier(key)
+        return tier.get(key) if tier else MISSING
+
+    def remember(self, key: str, value: Any) -> None:
+        tier = self._tier(key)
+        if tier:
+            tier.put(key, value)
+
+    async def get(self, redis_client, key: str) -> bytes | None:
+        """`redis_client.get(key)` bilan bir xil natija, lokal qatlam orqali"""
+        tier = self._tier(key)
+        if tier:
+            value = tier.get(key)
+            if value is not MISSING:
+                return value
+        if not redis_client:
+            return None
+        value = await redis_client.get(key)
+        if tier:
+            tier.put(key, value)
+        return value
+
+    async def set(self, redis_client, key: str, value: bytes | str, ex: int | None = None) -> None:
+        await redis_client.set(key, value, ex=ex)
+        await self.invalidate(redis_client, key)
+
+    async def invalidate(self, redis_client, key: str) -> None:
+        self.discard(key)
+        if not redis_client:
+            return
+        try:
+            await redis_client.publish(INVALIDATION_CHANNEL, key)
+        except Exception as e:
+            logger.error(f"Cache invalidation publish error: {e}")
+
+    def invalidate_sync(self, client, key: str) -> None:
+        """Sync redis klienti bilan yozadigan joylar uchun (artist_cache)"""
+        self.discard(key)
+        try:
+            client.publish(INVALIDATION_CHANNEL, key)
+        except Exception as e:
+            logger.error(f"Cache invalidation publish error: {e}")
+
+    def discard(self, key: str) -> None:
+        tier = self._tier(key)
+        if tier:
+            tier.discard(key)
+
+    def clear(self) -> None:
+        for _, tier in self._tiers:
+            tier.clear()
+
+    async def invalidation_listener(self) -> None:
+        """Boshqa processlar yozgan kalitlarni lokal qatlamdan o'chirish"""
+        while True:
+            from loader import redis_client
+            if not redis_client:
+                return
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Obuna bo'lmagan vaqtda kelgan invalidatsiyalar yo'qolgan bo'lishi mumkin
+                self.clear()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    key = message["data"]
+                    self.discard(key.decode() if isinstance(key, bytes) else key)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Cache invalidation listener error: {e}")
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+# Global instance
+local_cache = TwoTierCache()
+local_cache.register("user:lang:", "user_lang", maxsize=50_000, ttl=600)
+local_cache.register("yt_info:", "yt_info", maxsize=512, ttl=120)
+local_cache.register("search:music:v3:", "search", maxsize=2048, ttl=600)
+local_cache.register("artist:", "artist", maxsize=4096, ttl=600)
@@ -0,0 +1,187 @@
+"""
+Telegram file_id cache for already uploaded media.
+
+Entries are keyed by `media_key(url, format, ext)` (canonical media id, so
+youtu.be / watch?v= / shorts links share one entry) and stored one Redis
+string per entry (`media_cache:{key}`) with its own TTL, so an entry
+expires `media_cache_ttl_seconds` after it was written regardless of how
+busy its neighbours are. Hits and misses are counted in `media_cache.hit`
+/ `media_cache.miss`.
+
+Redis is only the hot tier: every entry is also recorded in the Postgres
+`media_files` table (`services.media_index`, batched writes), a Redis miss
+reads through to it (`media_cache.db_hit`) and refills Redis, and
+`warm_up()` loads the most requested entries into Redis at startup.
+"""
+import logging
+import time
+from dataclasses import dataclass, field
+
+import msgpack
+from aiogram.exceptions import TelegramBadRequest
+
+from core.config import get_settings
+from services import metrics
+from services.media_index import media_index
+
+logger = logging.getLogger(__name__)
+
+# Telegram keshdagi file_id'ni rad etganda qaytaradigan xatolar (boshqa xatolarda yozuv o'chirilmaydi)
+BAD_FILE_ID_ERRORS = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "file reference",
+    "file_reference",
+    "invalid file id",
+    "file_id",
+    "can't use file of type",
+)
+
+
+def is_bad_file_id(error: Exception) -> bool:
+    """Keshdagi file_id yaroqsiz yoki eskirgan (tarmoq / flood xatosi emas)"""
+    if not isinstance(error, TelegramBadRequest):
+        return False
+    message = str(error).lower()
+    return any(marker in message for marker in BAD_FILE_ID_ERRORS)
+
+
+@dataclass
+class CachedMedia:
+    file_id: str
+    file_type: str = "video"  # video | document | audio
+    video_title: str = ""
+    filename: str = ""
+    file_unique_id: str = ""
+    size_bytes: int = 0
+    cached_at: int = field(default_factory=lambda: int(time.time()))
+
+    def pack(self) -> bytes:
+        return msgpack.packb({
+            "file_id": self.file_id,
+            "file_type": self.file_type,
+            "video_title": self.video_title,
+            "filename": self.filename,
+            "file_unique_id": self.file_unique_id,
+            "size_bytes": self.size_bytes,
+            "cached_at": self.cached_at,
+        })
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "CachedMedia":
+        return cls(**msgpack.unpackb(data))
+
+    def to_row(self) -> dict:
+        return {
+            "file_id": self.file_id,
+            "file_unique_id": self.file_unique_id or None,
+            "file_type": self.file_type,
+            "title": self.video_title or None,
+            "filename": self.filename or None,
+            "size_bytes": self.size_bytes or None,
+        }
+
+    @classmethod
+    def from_row(cls, row: dict) -> "CachedMedia":
+        return cls(
+            row["file_id"],
+            row.get("file_type") or "video",
+            video_title=row.get("title") or "",
+            filename=row.get("filename") or "",
+            file_unique_id=row.get("file_unique_id") or "",
+            size_bytes=row.get("size_bytes") or 0,
+        )
+
+
+class MediaCache:
+    @staticmethod
+    def _redis():
+        from loader import redis_client
+        return redis_client
+
+    async def get(self, key: str) -> CachedMedia | None:
+        entry = await self._get_redis(key)
+        if entry is None:
+            row = await media_index.lookup(key)
+            if row is None:
+                metrics.incr("media_cache.miss")
+                return None
+            # Redis LRU tomonidan chiqarib yuborilgan - qayta to'ldiramiz
+            entry = CachedMedia.from_row(row)
+            await self._set_redis(key, entry)
+            metrics.incr("media_cache.db_hit")
+        metrics.incr("media_cache.hit")
+        media_index.hit(key)
+        return entry
+
+    async def _get_redis(self, key: str) -> CachedMedia | None:
+        redis_client = self._redis()
+        if not redis_client:
+            return None
+        try:
+            data = await redis_client.get(f"media_cache:{key}")
+        except Exception as e:
+            logger.error(f"Media cache get error: {e}")
+            return None
+        if not data:
+            return None
+        try:
+            return CachedMedia.unpack(data)
+        except Exception as e:
+            # Eski formatdagi yoki buzilgan yozuv
+            logger.warning(f"Media cache entry unreadable ({key}): {e}")
+            return None
+
+    async def _set_redis(self, key: str, entry: CachedMedia) -> None:
+        redis_client = self._redis()
+        if not redis_client:
+            return
+        try:
+            await redis_client.set(f"media_cache:{key}", entry.pack(), ex=get_settings().media_cache_ttl_seconds)
+        except Exception as e:
+            logger.error(f"Media cache set error: {e}")
+
+    async def put(self, key: str, entry: CachedMedia) -> None:
+        if not entry.file_id:
+            return
+        await self._set_redis(key, entry)
+        media_index.upsert(key, entry.to_row())
+
+    async def invalidate(self, key: str) -> None:
+        """file_id Telegram tomonidan rad etilsa"""
+        media_index.delete(key)
+        redis_client = self._redis()
+        if not redis_client:
+            return
+        try:
+            await redis_client.delete(f"media_cache:{key}")
+            metrics.incr("media_cache.invalidated")
+        except Exception as e:
+            logger.error(f"Media cache delete error: {e}")
+
+    async def warm_up(self, top_n: int | None = None) -> int:
+        """Eng ko'p so'ralgan file_id'larni Redis'ga oldindan yuklash"""
+        redis_client = self._redis()
+        if not redis_client:
+            return 0
+        top_n = get_settings().media_cache_warmup_top_n if top_n is None else top_n
+        if top_n <= 0:
+            return 0
+        try:
+            rows = await media_index.top(top_n)
+            ttl = get_settings().media_cache_ttl_seconds
+            pipe = redis_client.pipeline(transaction=False)
+            for key, row in rows:
+                # Redis'dagi yangiroq yozuvni bosib ketmaslik uchun nx
+                pipe.set(f"media_cache:{key}", CachedMedia.from_row(row).pack(), ex=ttl, nx=True)
+            loaded = sum(1 for ok in await pipe.execute() if ok)
+        except Exception as e:
+            logger.error(f"Media cache warm-up error: {e}")
+            return 0
+        logger.info(f"Media cache warm-up: {loaded}/{len(rows)} entries loaded into Redis")
+        metrics.incr("media_cache.warmed", loaded)
+        return loaded
+
+
+# Global instance
+media_cache = MediaCache()
@@ -0,0 +1,159 @@
+"""
+Durable `media_files` index behind the Redis file_id cache.
+
+Redis runs with allkeys-lru, so `media_cache:` entries can be evicted at any
+time; Postgres keeps every uploaded file_id and `media_cache` reads through
+to it on a Redis miss. Uploads never wait on Postgres: upserts, hit counts
+and deletions are buffered here and written in one transaction every
+`FLUSH_INTERVAL` seconds (or sooner when `MAX_BATCH` is reached) by
+`media_index.run()`.
+
+Rows are plain dicts with the CachedMedia fields, keyed by `media_key()`.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from services import metrics
+from utils.db_api.database import async_session
+from utils.db_api.models import MediaFile
+from utils.media_key import split_media_key
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 5  # seconds
+MAX_BATCH = 200
+MAX_PENDING = 10_000  # Postgres uzoq ishlamasa xotira cheksiz o'smasin
+ROW_FIELDS = ("file_id", "file_unique_id", "file_type", "title", "filename", "size_bytes")
+
+
+def _key_filter(key: str):
+    media_id, format_selector, ext = split_media_key(key)
+    return (MediaFile.media_id == media_id) & (MediaFile.format == format_selector) & (MediaFile.ext == ext)
+
+
+def _media_key_of(row: MediaFile) -> str:
+    return f"{row.media_id}|{row.format}|{row.ext}"
+
+
+def _row_to_dict(row: MediaFile) -> dict:
+    return {field: getattr(row, field) for field in ROW_FIELDS}
+
+
+class MediaIndex:
+    def __init__(self):
+        self._upserts: dict[str, dict] = {}
+        self._hits: dict[str, int] = defaultdict(int)
+        self._deletes: set[str] = set()
+        self._wakeup = asyncio.Event()
+
+    @property
+    def pending(self) -> int:
+        return len(self._upserts) + len(self._hits) + len(self._deletes)
+
+    def upsert(self, key: str, row: dict) -> None:
+        self._deletes.discard(key)
+        self._upserts[key] = row
+        self._maybe_wake()
+
+    def hit(self, key: str) -> None:
+        self._hits[key] += 1
+        self._maybe_wake()
+
+    def delete(self, key: str) -> None:
+        self._upserts.pop(key, None)
+        self._hits.pop(key, None)
+        self._deletes.add(key)
+        self._maybe_wake()
+
+    def _maybe_wake(self) -> None:
+        if self.pending >= MAX_BATCH:
+            self._wakeup.set()
+
+    async def lookup(self, key: str) -> dict | None:
+        try:
+            async with async_session() as session:
+                result = await session.execute(select(MediaFile).where(_key_filter(key)))
+                row = result.scalar_one_or_none()
+        except Exception as e:
+            logger.error(f"Media index lookup error: {e}")
+            return None
+        return _row_to_dict(row) if row else None
+
+    async def top(self, limit: int) -> list[tuple[str, dict]]:
+        """Eng ko'p so'ralgan yozuvlar (warm-up uchun)"""
+        async with async_session() as session:
+            result = await session.execute(
+                select(MediaFile).order_by(MediaFile.hit_count.desc()).limit(limit)
+            )
+            rows = result.scalars().all()
+        return [(_media_key_of(row), _row_to_dict(row)) for row in rows]
+
+    async def flush(self) -> None:
+        upserts, self._upserts = self._upserts, {}
+        hits, self._hits = self._hits, defaultdict(int)
+        deletes, self._deletes = self._deletes, set()
+        self._wakeup.clear()
+        if not (upserts or hits or deletes):
+            return
+        try:
+            async with async_session() as session:
+                for key in deletes:
+                    await session.execute(delete(MediaFile).where(_key_filter(key)))
+                if upserts:
+                    values = []
+                    for key, row in upserts.items():
+                        media_id, format_selector, ext = split_media_key(key)
+                        values.append({
+                            "media_id": media_id, "format": format_selector, "ext": ext,
+                            **{field: row.get(field) for field in ROW_FIELDS},
+                        })
+                    stmt = insert(MediaFile).values(values)
+                    await session.execute(stmt.on_conflict_do_update(
+                        constraint="uq_media_files_key",
+                        set_={field: stmt.excluded[field] for field in ROW_FIELDS},
+                    ))
+                for key, count in hits.items():
+                    await session.execute(
+                        update(MediaFile).where(_key_filter(key)).values(
+                            hit_count=MediaFile.hit_count + count, last_hit_at=func.now()
+                        )
+                    )
+                await session.commit()
+            metrics.incr("media_index.flushed", len(upserts) + len(hits) + len(deletes))
+        except Exception as e:
+            logger.error(f"Media index flush error: {e}")
+            metrics.incr("media_index.flush_failed")
+            # Keyingi flush'da qayta urinamiz; yangiroq yozuvlar ustun
+            if self.pending + len(upserts) + len(hits) + len(deletes) > MAX_PENDING:
+                logger.warning("Media index backlog too large, dropping failed batch")
+                return
+            for key, row in upserts.items():
+                if key not in self._deletes:
+                    self._upserts.setdefault(key, row)
+            for key, count in hits.items():
+                if key not in self._deletes:
+                    self._hits[key] += count
+            for key in deletes:
+                if key not in self._upserts:
+                    self._deletes.add(key)
+
+    async def run(self) -> None:
+        """Buferni vaqti-vaqti bilan Postgres'ga yozuvchi worker"""
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                await self.flush()
+        except asyncio.CancelledError:
+            await self.flush()
+            raise
+
+
+# Global instance
+media_index = MediaIndex()
@@ -1,13 +1,29 @@
 from aiogram import Bot
-from aiogram.types import FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton, InputFile
 import asyncio
 import json
 import subprocess
 
 from core.config import get_settings
+from services.governor import TELEGRAM_ORIGIN, Lease, governor
+from utils.i18n import t
 from utils.validation import extract_youtube_id, is_youtube_url
 
 
+class GovernedInputFile(InputFile):
+    """Upload oqimini governor lease'i bo'yicha cheklash (har chunk'dan keyin throttle)"""
+
+    def __init__(self, inner: InputFile, lease: Lease):
+        super().__init__(filename=inner.filename, chunk_size=inner.chunk_size)
+        self.inner = inner
+        self.lease = lease
+
+    async def read(self, bot: Bot):
+        async for chunk in self.inner.read(bot):
+            yield chunk
+            await self.lease.throttle(len(chunk))
+
+
 def build_video_keyboard(url: str) -> InlineKeyboardMarkup | None:
     if is_youtube_url(url):
         vid_id = extract_youtube_id(url)
@@ -23,6 +39,13 @@ def build_video_keyboard(url: str) -> InlineKeyboardMarkup | None:
     ])
 
 
+def build_cancel_keyboard(lang: str) -> InlineKeyboardMarkup:
+    # Tugma status xabarining o'zida turadi: (chat_id, message_id) job'ni aniqlaydi
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=t("cancel", lang), callback_data="cancel_dl")]
+    ])
+
+
 def build_audio_keyboard(video_id: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [
@@ -42,7 +65,10 @@ async def send_video(
     url: str = None,
     file_id: str = None,  # Add file_id
     title: str = "Video",
-    caption_suffix: str | None = None
+    caption_suffix: str | None = None,
+    file_type: str = "video",
+    input_file: InputFile | None = None,  # stream_upload orqali
+    video_meta: dict | None = None
 ):
     settings = get_settings()
     if caption_suffix:
@@ -50,6 +76,13 @@ async def send_video(
     else:
         caption_text = f"📹 {title}\n\n🤖 {settings.telegram_nickname}"
     
+    if file_id and file_type == "document":
+        return await bot.send_document(
+            chat_id=chat_id,
+            document=file_id,
+            caption=caption_text,
+            reply_markup=build_video_keyboard(url)
+        )
     if file_id:
         return await bot.send_video(
             chat_id=chat_id,
@@ -58,44 +91,68 @@ async def send_video(
             reply_markup=build_video_keyboard(url)
         )
 
+    if input_file:
+        video_meta = video_meta or {}
+        async with governor.lease(TELEGRAM_ORIGIN) as lease:
+            return await bot.send_video(
+                chat_id=chat_id,
+                video=GovernedInputFile(input_file, lease),
+                caption=caption_text,
+                reply_markup=build_video_keyboard(url),
+                supports_streaming=True,
+                width=video_meta.get("width"),
+                height=video_meta.get("height"),
+                duration=video_meta.get("duration"),
+            )
+
     # Telegram video preview is best for mp4; for other formats send as document
     if video_path and video_path.lower().endswith((".webm", ".mkv")):
-        return await bot.send_document(
-            chat_id=chat_id,
-            document=FSInputFile(video_path),
-            caption=caption_text,
-            reply_markup=build_video_keyboard(url)
-        )
+        async with governor.lease(TELEGRAM_ORIGIN) as lease:
+            return await bot.send_document(
+                chat_id=chat_id,
+                document=GovernedInputFile(FSInputFile(video_path), lease),
+                caption=caption_text,
+                reply_markup=build_video_keyboard(url)
+            )
     elif video_path:
         video_meta = await _probe_video_meta(video_path)
-        return await bot.send_video(
-            chat_id=chat_id,
-            video=FSInputFile(video_path),
-            caption=caption_text,
-            reply_markup=build_video_keyboard(url),
-            supports_streaming=True,
-            width=video_meta.get("width"),
-            height=video_meta.get("height"),
-            duration=video_meta.get("duration"),
-        )
+        async with governor.lease(TELEGRAM_ORIGIN) as lease:
+            return await bot.send_video(
+                chat_id=chat_id,
+                video=GovernedInputFile(FSInputFile(video_path), lease),
+                caption=caption_text,
+                reply_markup=build_video_keyboard(url),
+                supports_streaming=True,
+                width=video_meta.get("width"),
+                height=video_meta.get("height"),
+                duration=video_meta.get("duration"),
+            )
 
 
 
 async def send_audio(
     bot: Bot,
     chat_id: int,
-    audio_path: str,
+    audio_path: str | None,
     filename: str,
-    video_id: str
+    video_id: str,
+    file_id: str | None = None
 ):
     settings = get_settings()
-    return await bot.send_audio(
-        chat_id=chat_id,
-        audio=FSInputFile(audio_path, filename=filename),
-        caption=f"🎵 {filename.replace('.m4a', '')} \n\n🤖 " + settings.telegram_nickname,
-        title=filename.replace('.m4a', ''),
-        reply_markup=build_audio_keyboard(video_id)
-    )
+
+    async def _send(audio):
+        return await bot.send_audio(
+            chat_id=chat_id,
+            audio=audio,
+            caption=f"🎵 {filename.replace('.m4a', '')} \n\n🤖 " + settings.telegram_nickname,
+            title=filename.replace('.m4a', ''),
+            reply_markup=build_audio_keyboard(video_id)
+        )
+
+    if file_id:
+        return await _send(file_id)
+    async with governor.lease(TELEGRAM_ORIGIN) as lease:
+        return await _send(GovernedInputFile(FSInputFile(audio_path, filename=filename), lease))
 
 
 async def _probe_video_meta(path: str) -> dict:
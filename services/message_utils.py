@@ -1,7 +1,12 @@
+import logging
 from typing import Optional
 
 from aiogram import Bot
 
+from utils.i18n import get_user_lang, t
+
+logger = logging.getLogger(__name__)
+
 
 async def edit_or_reply_error(
     bot: Bot,
@@ -18,8 +23,36 @@ async def edit_or_reply_error(
         await bot.send_message(chat_id=chat_id, text=text)
 
 
+async def report_job_timeout(kwargs: dict) -> None:
+    """Pool timeout'ida to'xtatilgan job: status xabarida xato matni, Cancel tugmasi olib tashlanadi"""
+    chat_id, message_id = kwargs.get("chat_id"), kwargs.get("status_message_id")
+    if not chat_id or not message_id:
+        return
+    from loader import bot, redis_client
+    try:
+        lang = await get_user_lang(chat_id, redis_client)
+        await edit_progress_message(bot, chat_id, message_id, t("download_timed_out", lang))
+    except Exception as e:
+        logger.warning(f"Timeout status update failed ({chat_id}): {e}")
+
+
 async def delete_message_only(bot: Bot, chat_id: int, message_id: int) -> None:
     try:
         await bot.delete_message(chat_id=chat_id, message_id=message_id)
     except Exception:
         pass
+
+
+async def edit_progress_message(bot: Bot, chat_id: int, message_id: int, text: str, reply_markup=None) -> None:
+    """Status xabarini yangilash: rasmli xabar (caption) yoki matn"""
+    try:
+        await bot.edit_message_caption(
+            chat_id=chat_id, message_id=message_id, caption=text, parse_mode='HTML', reply_markup=reply_markup
+        )
+    except Exception:
+        try:
+            await bot.edit_message_text(
+                chat_id=chat_id, message_id=message_id, text=text, parse_mode='HTML', reply_markup=reply_markup
+            )
+        except Exception:
+            pass
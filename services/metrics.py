@@ -0,0 +1,76 @@
+"""
+Process-local counters and gauges.
+
+Counters are cheap to bump from any thread; `metrics_worker` periodically
+flushes the deltas into the Redis hashes `metrics:counters` and
+`metrics:gauges`, so every bot/worker process reports into one place
+(`redis-cli hgetall metrics:counters`).
+"""
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+METRICS_FLUSH_INTERVAL = 60  # seconds
+COUNTERS_KEY = "metrics:counters"
+GAUGES_KEY = "metrics:gauges"
+
+_lock = threading.Lock()
+_counters: dict[str, int] = defaultdict(int)
+_unflushed: dict[str, int] = defaultdict(int)
+_gauges: dict[str, float] = {}
+
+
+def incr(name: str, amount: int = 1) -> None:
+    with _lock:
+        _counters[name] += amount
+        _unflushed[name] += amount
+
+
+def set_gauge(name: str, value: float) -> None:
+    with _lock:
+        _gauges[name] = value
+
+
+def snapshot(prefix: str = "") -> dict[str, float]:
+    with _lock:
+        data: dict[str, float] = {k: v for k, v in _counters.items() if k.startswith(prefix)}
+        data.update({k: v for k, v in _gauges.items() if k.startswith(prefix)})
+    return data
+
+
+async def flush_metrics(redis_client) -> None:
+    with _lock:
+        deltas = dict(_unflushed)
+        _unflushed.clear()
+        gauges = dict(_gauges)
+    if not redis_client or (not deltas and not gauges):
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for name, delta in deltas.items():
+            pipe.hincrby(COUNTERS_KEY, name, delta)
+        if gauges:
+            pipe.hset(GAUGES_KEY, mapping=gauges)
+        await pipe.execute()
+    except Exception as e:
+        logger.error(f"Metrics flush error: {e}")
+        with _lock:
+            for name, delta in deltas.items():
+                _unflushed[name] += delta
+
+
+async def metrics_worker() -> None:
+    """Metrikalarni vaqti-vaqti bilan Redis'ga yozib turuvchi worker"""
+    while True:
+        try:
+            await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+            from loader import redis_client
+            await flush_metrics(redis_client)
+            logger.info(f"📊 Metrics: {snapshot()}")
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"Metrics worker error: {e}")
@@ -0,0 +1,340 @@
+"""
+Speculative prefetch while the user is choosing a quality (opt-in).
+
+After the YouTube format keyboard is shown the user usually needs a few
+seconds to tap. `prefetcher.offer()` uses that time to start downloading the
+most likely choice: the historically dominant pick (height or 🎵 MP3) for
+videos of that length, recorded per duration bucket in the Redis hash
+`prefetch:choices:{bucket}`. A prefetch only starts when the tmpfs scratch
+budget has room, the load average is low and no real job is waiting.
+
+On the tap, `resolve()` keeps a matching prefetch (hit) and cancels any
+other one (miss); the queued job then `claim()`s the running download
+instead of starting its own. Unclaimed prefetches are cancelled after
+`PREFETCH_TTL`. Prefetch files use their own stem (`pf_...`), so
+cancelling one never touches the files of a real job.
+
+Metrics: prefetch.started / hit / miss / expired / failed,
+prefetch.skipped.{reason}, prefetch.wasted_bytes and the
+prefetch.hit_rate gauge.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+from core.config import get_settings
+from loader import TMP_DIR
+from services import metrics
+from services.media_cache import media_cache
+from services.scratch_budget import DEFAULT_AUDIO_BYTES, Reservation, estimate_video_bytes, scratch_budget
+from utils.cancellation import CANCEL_GRACE_SECONDS, DownloadHandle, cleanup_partial_files
+from utils.download import download_audio, download_video, get_format_selector
+from utils.media_key import media_key
+from utils.ydl_executor import ydl_executor
+
+logger = logging.getLogger(__name__)
+
+AUDIO_CHOICE = "audio"
+PREFETCH_TTL = 90  # seconds
+OFFER_TTL = 600
+MAX_OFFERS = 10_000
+MAX_CONCURRENT = 2
+MAX_LOAD_PER_CPU = 0.75
+MIN_HISTORY = 20  # shu bucket uchun kamida shuncha tanlov bo'lishi kerak
+MIN_SHARE = 0.4  # eng ommabop tanlov ulushi
+HISTORY_TTL = 30 * 24 * 3600
+DURATION_BUCKETS = (240, 600, 1800, 3600)  # seconds
+
+
+def video_choice(format_selector: str, output_ext: str | None) -> str:
+    return f"{format_selector}|{output_ext or 'mp4'}"
+
+
+def _duration_bucket(duration: float | None) -> str:
+    if not duration:
+        return "unknown"
+    for limit in DURATION_BUCKETS:
+        if duration < limit:
+            return f"lt{limit}"
+    return f"ge{DURATION_BUCKETS[-1]}"
+
+
+def _failed(task: asyncio.Task | None) -> bool:
+    return bool(task and task.done() and (task.cancelled() or task.exception() is not None))
+
+
+def _bytes_on_disk(stem: str | None) -> int:
+    if not stem:
+        return 0
+    total = 0
+    for file in Path(TMP_DIR).glob(f"{stem}.*"):
+        try:
+            total += file.stat().st_size
+        except OSError:
+            continue
+    return total
+
+
+@dataclass
+class Prefetch:
+    chat_id: int
+    video_id: str
+    choice: str
+    handle: DownloadHandle
+    reservation: Reservation
+    started: float = field(default_factory=time.monotonic)
+    task: asyncio.Task | None = None
+    promoted: bool = False
+    # Claim qilgan job'ning progress hook'i
+    forward: Callable[[dict], None] | None = None
+    expiry: asyncio.TimerHandle | None = None
+
+    def progress_hook(self, data: dict) -> None:
+        if self.forward:
+            self.forward(data)
+
+
+class Prefetcher:
+    def __init__(self):
+        self._pending: dict[tuple[int, str], Prefetch] = {}
+        # (chat_id, video_id) -> (duration bucket, offered at)
+        self._offers: OrderedDict[tuple[int, str], tuple[str, float]] = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._discarding: set[asyncio.Task] = set()
+
+    @staticmethod
+    def _redis():
+        from loader import redis_client
+        return redis_client
+
+    async def offer(self, chat_id: int, info: dict) -> None:
+        """Format klaviaturasi ko'rsatildi: tanlovni kutish va (yoqilgan bo'lsa) prefetch boshlash"""
+        video_id = info.get("id")
+        if not video_id:
+            return
+        bucket = _duration_bucket(info.get("duration"))
+        self._remember_offer((chat_id, video_id), bucket)
+        if not get_settings().speculative_prefetch:
+            return
+        try:
+            await self._maybe_start(chat_id, video_id, bucket, info)
+        except Exception as e:
+            logger.error(f"Prefetch start error: {e}")
+
+    async def resolve(self, chat_id: int, video_id: str, choice: str, height: int | None = None) -> None:
+        """Foydalanuvchi tugmani bosdi: tarixga yozish, mos kelmagan prefetch'ni bekor qilish"""
+        offer = self._offers.pop((chat_id, video_id), None)
+        if offer:
+            await self._record_choice(offer[0], AUDIO_CHOICE if choice == AUDIO_CHOICE else str(height or ""))
+        prefetch = self._pending.get((chat_id, video_id))
+        if not prefetch or prefetch.promoted:
+            return
+        if prefetch.choice == choice and not _failed(prefetch.task):
+            prefetch.promoted = True
+            self._hits += 1
+            metrics.incr("prefetch.hit")
+            self._report_hit_rate()
+            return
+        self._misses += 1
+        metrics.incr("prefetch.miss")
+        self._report_hit_rate()
+        # Prefetch fayllari alohida stem'da - haqiqiy job kutmasdan boshlanishi mumkin
+        del self._pending[(chat_id, video_id)]
+        task = asyncio.create_task(self._discard(prefetch, "prefetch_miss"))
+        self._discarding.add(task)
+        task.add_done_callback(self._discarding.discard)
+
+    async def claim(
+        self,
+        chat_id: int,
+        video_id: str,
+        choice: str,
+        handle: DownloadHandle | None = None,
+        progress_hook: Callable[[dict], None] | None = None,
+    ) -> tuple[str | None, str | None] | None:
+        """
+        Job uchun promote qilingan prefetch natijasi: (path, title/filename).
+        None - prefetch yo'q yoki muvaffaqiyatsiz, oddiy yuklashga o'tiladi.
+        """
+        prefetch = self._pending.get((chat_id, video_id))
+        if not prefetch or not prefetch.promoted or prefetch.choice != choice or not prefetch.task:
+            return None
+        self._pending.pop((chat_id, video_id), None)
+        if prefetch.expiry:
+            prefetch.expiry.cancel()
+        prefetch.forward = progress_hook
+        # Job o'z reservation'i bilan ishlaydi
+        prefetch.reservation.release()
+        while not prefetch.task.done():
+            await asyncio.wait({prefetch.task}, timeout=0.5)
+            if handle and handle.cancelled:
+                await prefetch.handle.abort(handle.reason or "user")
+                raise handle.error()
+        if prefetch.task.cancelled():
+            return None
+        try:
+            result = prefetch.task.result()
+        except Exception as e:
+            logger.warning(f"Promoted prefetch failed, downloading normally: {e}")
+            if prefetch.handle.stem:
+                await asyncio.to_thread(cleanup_partial_files, prefetch.handle.stem)
+            return None
+        if not result or not result[0]:
+            return None
+        metrics.incr("prefetch.claimed")
+        return result
+
+    def _remember_offer(self, key: tuple[int, str], bucket: str) -> None:
+        now = time.monotonic()
+        self._offers[key] = (bucket, now)
+        self._offers.move_to_end(key)
+        while self._offers:
+            oldest_key, (_, offered_at) = next(iter(self._offers.items()))
+            if len(self._offers) <= MAX_OFFERS and now - offered_at < OFFER_TTL:
+                break
+            self._offers.pop(oldest_key)
+
+    async def _record_choice(self, bucket: str, choice: str) -> None:
+        redis_client = self._redis()
+        if not redis_client or not choice:
+            return
+        key = f"prefetch:choices:{bucket}"
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hincrby(key, choice, 1)
+            pipe.expire(key, HISTORY_TTL)
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"Prefetch history error: {e}")
+
+    async def _predict(self, bucket: str) -> str | None:
+        """Shu uzunlikdagi videolar uchun eng ko'p tanlangan balandlik yoki "audio" """
+        redis_client = self._redis()
+        if not redis_client:
+            return None
+        raw = await redis_client.hgetall(f"prefetch:choices:{bucket}")
+        counts = {
+            (k.decode() if isinstance(k, bytes) else k): int(v)
+            for k, v in raw.items()
+        }
+        total = sum(counts.values())
+        if total < MIN_HISTORY:
+            return None
+        best = max(counts, key=counts.get)
+        return best if counts[best] / total >= MIN_SHARE else None
+
+    def _skip_reason(self) -> str | None:
+        if len(self._pending) >= MAX_CONCURRENT:
+            return "concurrency"
+        try:
+            if os.getloadavg()[0] / (os.cpu_count() or 1) > MAX_LOAD_PER_CPU:
+                return "cpu"
+        except OSError:
+            pass
+        from utils.task_queue import task_queue
+        if task_queue.busy:
+            return "queue"
+        return None
+
+    async def _maybe_start(self, chat_id: int, video_id: str, bucket: str, info: dict) -> None:
+        key = (chat_id, video_id)
+        if key in self._pending:
+            return
+        reason = self._skip_reason()
+        predicted = None if reason else await self._predict(bucket)
+        if not reason and not predicted:
+            reason = "no_prediction"
+        if reason:
+            metrics.incr(f"prefetch.skipped.{reason}")
+            return
+
+        url = f"https://www.youtube.com/watch?v={video_id}"
+        if predicted == AUDIO_CHOICE:
+            choice = AUDIO_CHOICE
+            cache_key = media_key(url, "audio", "m4a")
+            scratch_bytes = DEFAULT_AUDIO_BYTES
+        else:
+            item = next((i for i in info.get("items") or [] if str(i.get("height")) == predicted), None)
+            if not item:
+                metrics.incr("prefetch.skipped.no_format")
+                return
+            format_selector = get_format_selector(item["format_id"], str(item.get("is_merge", 0)))
+            output_ext = item.get("ext") or "mp4"
+            choice = video_choice(format_selector, output_ext)
+            cache_key = media_key(url, format_selector, output_ext)
+            scratch_bytes = estimate_video_bytes(item.get("size_bytes"), bool(item.get("is_merge")))
+
+        if await media_cache.get(cache_key):
+            # file_id bor - yuklash kerak emas
+            metrics.incr("prefetch.skipped.cached")
+            return
+        reservation = scratch_budget.try_reserve(scratch_bytes)
+        if reservation is None:
+            metrics.incr("prefetch.skipped.budget")
+            return
+
+        handle = DownloadHandle(None, event=ydl_executor.new_event())
+        prefetch = Prefetch(chat_id, video_id, choice, handle, reservation)
+        stem = f"pf_{video_id}_{chat_id}"
+        if choice == AUDIO_CHOICE:
+            coro = download_audio(video_id, chat_id, handle=handle, stem=stem)
+        else:
+            coro = download_video(
+                url, chat_id, format_selector=format_selector, output_ext=output_ext,
+                progress_hook=prefetch.progress_hook, handle=handle, stem=stem,
+            )
+        prefetch.task = asyncio.create_task(coro)
+        prefetch.task.add_done_callback(lambda task: self._on_done(prefetch, task))
+        prefetch.expiry = asyncio.get_running_loop().call_later(
+            PREFETCH_TTL, lambda: asyncio.create_task(self._expire(prefetch))
+        )
+        self._pending[key] = prefetch
+        metrics.incr("prefetch.started")
+        logger.info(f"Prefetch started: {video_id} ({choice}) for chat {chat_id}")
+
+    def _on_done(self, prefetch: Prefetch, task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception() is None:
+            return
+        if not prefetch.handle.cancelled:
+            metrics.incr("prefetch.failed")
+            logger.info(f"Prefetch failed: {prefetch.video_id}: {task.exception()}")
+
+    async def _expire(self, prefetch: Prefetch) -> None:
+        if self._pending.get((prefetch.chat_id, prefetch.video_id)) is not prefetch:
+            return
+        metrics.incr("prefetch.expired")
+        if not prefetch.promoted:
+            self._misses += 1
+            self._report_hit_rate()
+        await self._discard(prefetch, "prefetch_expired")
+
+    async def _discard(self, prefetch: Prefetch, reason: str) -> None:
+        key = (prefetch.chat_id, prefetch.video_id)
+        if self._pending.get(key) is prefetch:
+            del self._pending[key]
+        if prefetch.expiry:
+            prefetch.expiry.cancel()
+        wasted = await asyncio.to_thread(_bytes_on_disk, prefetch.handle.stem)
+        metrics.incr("prefetch.wasted_bytes", wasted)
+        prefetch.handle.cancel(reason)
+        if prefetch.task and not prefetch.task.done():
+            await asyncio.wait({prefetch.task}, timeout=CANCEL_GRACE_SECONDS)
+        # Qolgan process'lar va `{stem}.*` fayllari (tugagan natija ham)
+        await prefetch.handle.abort(reason)
+        prefetch.reservation.release()
+        logger.info(f"Prefetch discarded ({reason}): {prefetch.video_id}, {wasted} bytes wasted")
+
+    def _report_hit_rate(self) -> None:
+        total = self._hits + self._misses
+        if total:
+            metrics.set_gauge("prefetch.hit_rate", round(self._hits / total, 3))
+
+
+# Global instance
+prefetcher = Prefetcher()
@@ -0,0 +1,130 @@
+"""
+Queue position and ETA in the status message of a waiting job.
+
+When a job with a `status_message_id` is put on a pool's Redis stream, the
+enqueuing process watches it until a worker starts it: every EDIT_INTERVAL
+seconds the position and ETA are estimated and, if the text changed, the
+status message is edited (at most MAX_EDITS_PER_SECOND edits across all
+waiting jobs; skipped rounds are retried on the next tick).
+
+Estimate: the entries ahead of the job in the stream (FIFO order; the
+per-chat fair scheduler can only move a job forward relative to this),
+each costing its historical `run` time for (pool, size bucket) from
+`job_timings`, or the expected cost stored on the entry; running entries
+count only their remaining time. ETA = total / (pool concurrency x live
+consumer processes). Jobs that start within FIRST_UPDATE_DELAY never get
+a queue message.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+
+from services import metrics
+from services.job_store import job_store
+from services.job_timings import job_timings, size_bucket
+from services.media_sender import build_cancel_keyboard
+from services.message_utils import edit_progress_message
+from utils.i18n import get_user_lang, t
+
+logger = logging.getLogger(__name__)
+
+FIRST_UPDATE_DELAY = 3  # seconds
+EDIT_INTERVAL = 15
+MAX_EDITS_PER_SECOND = 5  # Telegram limitlaridan ancha past
+MAX_WATCH_SECONDS = 2 * 3600
+
+
+def format_eta(seconds: float, lang: str) -> str:
+    if seconds < 60:
+        return t("eta_seconds", lang, seconds=max(5, int(math.ceil(seconds / 5) * 5)))
+    return t("eta_minutes", lang, minutes=int(math.ceil(seconds / 60)))
+
+
+class QueueStatus:
+    def __init__(self):
+        self._edits: deque[float] = deque()
+        self._tasks: set[asyncio.Task] = set()
+
+    async def estimate(self, pool, entry_id: str) -> tuple[int, float] | None:
+        """(navbatdagi o'rin, kutish sekundlari); job boshlangan yoki yo'q bo'lsa None"""
+        ahead = await pool.job_queue.ahead_of(entry_id, pool.spec.queue_limit)
+        if ahead is None:
+            return None
+        started = await job_store.started_at([entry_id] + [other_id for other_id, _ in ahead])
+        if entry_id in started:
+            return None
+        await job_timings.refresh()
+        now = time.time()
+        position, work = 1, 0.0
+        for other_id, fields in ahead:
+            bucket = size_bucket(int(fields.get(b"scratch", 0)))
+            run = job_timings.estimate(pool.name, bucket, "run") or float(fields.get(b"cost", 0))
+            if other_id in started:
+                work += max(0.0, run - (now - started[other_id]))
+            else:
+                position += 1
+                work += run
+        slots = pool.concurrency * max(1, await pool.job_queue.live_consumers())
+        return position, work / slots
+
+    def watch(self, pool, entry_id: str, kwargs: dict) -> None:
+        task = asyncio.create_task(self._watch(pool, entry_id, kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _allow_edit(self) -> bool:
+        now = time.monotonic()
+        while self._edits and now - self._edits[0] > 1:
+            self._edits.popleft()
+        if len(self._edits) >= MAX_EDITS_PER_SECOND:
+            metrics.incr("queue_status.edits_skipped")
+            return False
+        self._edits.append(now)
+        return True
+
+    @staticmethod
+    def _render(kwargs: dict, lang: str, position: int, eta: str) -> str:
+        if not kwargs.get("title"):
+            return t("queue_position", lang, position=position, eta=eta)
+        label = kwargs.get("format_label")
+        return t(
+            "video_queued_caption",
+            lang,
+            title=kwargs["title"],
+            uploader=kwargs.get("uploader") or "",
+            format=t("format_label", lang, label=label) if label else "",
+            position=position,
+            eta=eta,
+        )
+
+    async def _watch(self, pool, entry_id: str, kwargs: dict) -> None:
+        from loader import bot, redis_client
+        chat_id, message_id = kwargs["chat_id"], kwargs["status_message_id"]
+        deadline = time.monotonic() + MAX_WATCH_SECONDS
+        lang = await get_user_lang(chat_id, redis_client)
+        # Video status xabarida bekor qilish tugmasi bor - tahrirda yo'qolmasin
+        keyboard = build_cancel_keyboard(lang) if pool.name == "video" else None
+        last_text = None
+        await asyncio.sleep(FIRST_UPDATE_DELAY)
+        try:
+            while time.monotonic() < deadline:
+                estimate = await self.estimate(pool, entry_id)
+                if estimate is None:
+                    return
+                position, seconds = estimate
+                metrics.set_gauge(f"pool.{pool.name}.eta_seconds", int(seconds))
+                text = self._render(kwargs, lang, position, format_eta(seconds, lang))
+                if text != last_text and self._allow_edit():
+                    if await job_store.started_at([entry_id]):
+                        return  # task o'z progress xabarini yozmoqda
+                    await edit_progress_message(bot, chat_id, message_id, text, keyboard)
+                    last_text = text
+                    metrics.incr("queue_status.edits")
+                await asyncio.sleep(EDIT_INTERVAL)
+        except Exception as e:
+            logger.error(f"Queue status error ({entry_id}): {e}")
+
+# Global instance
+queue_status = QueueStatus()
@@ -0,0 +1,128 @@
+"""
+Fair, size-aware ordering of queued download jobs.
+
+Each job gets a weighted-fair-queuing tag when it arrives:
+`max(virtual_clock, last_tag_of_its_chat) + expected_seconds / weight`,
+so a chat that queues ten 4K downloads pushes its own later jobs back
+instead of everyone else's. Among runnable jobs the smallest
+`tag - AGEING_RATE * waited_seconds` goes first: short jobs overtake long
+ones (shortest-expected-job-first), while ageing keeps long jobs from
+starving. A chat never has more than `max_per_chat` jobs running.
+
+Exported (prefix `scheduler.{pool}` in the job queue): `scheduler.queued` /
+`scheduler.queued_chats` gauges, the `scheduler.wait_ms.{kind}` moving
+averages, `scheduler.fairness` (Jain's index of the per-chat mean slowdown,
+`(wait + cost) / cost`, over the last FAIRNESS_WINDOW dispatches, 1.0 =
+perfectly even) and the `scheduler.chat_capped` counter.
+"""
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Any
+
+from services import metrics
+
+JOB_OVERHEAD_SECONDS = 3.0  # extract + upload
+EXPECTED_BYTES_PER_SEC = 8 * 1024 * 1024
+REMUX_SECONDS_PER_MEDIA_SECOND = 0.01
+AGEING_RATE = 0.5  # har kutilgan sekund tag'ni shuncha sekundga oldinga suradi
+FAIRNESS_WINDOW = 200
+WAIT_EMA_ALPHA = 0.2
+
+
+def expected_seconds(size_bytes: int = 0, duration: int | None = None) -> float:
+    """Job qancha davom etishi taxmini (size_bytes - TMP_DIR budjeti uchun berilgan hajm)"""
+    return JOB_OVERHEAD_SECONDS + size_bytes / EXPECTED_BYTES_PER_SEC + (duration or 0) * REMUX_SECONDS_PER_MEDIA_SECOND
+
+
+@dataclass
+class ScheduledJob:
+    key: str
+    chat_id: Any
+    cost: float  # kutilayotgan sekundlar
+    kind: str = "job"
+    weight: float = 1.0
+    enqueued_at: float = field(default_factory=time.time)
+    payload: Any = None
+    tag: float = 0.0
+
+
+class FairScheduler:
+    def __init__(self, max_per_chat: int, ageing_rate: float = AGEING_RATE, metrics_prefix: str = "scheduler"):
+        self.max_per_chat = max_per_chat
+        self.metrics_prefix = metrics_prefix
+        self.ageing_rate = ageing_rate
+        self._jobs: list[ScheduledJob] = []
+        self._running: dict[Any, int] = defaultdict(int)
+        self._last_tag: dict[Any, float] = {}
+        self._vclock = 0.0
+        self._slowdowns: deque[tuple[Any, float]] = deque(maxlen=FAIRNESS_WINDOW)
+        self._wait_ema: dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def push(self, job: ScheduledJob) -> None:
+        start = max(self._vclock, self._last_tag.get(job.chat_id, 0.0))
+        job.tag = start + job.cost / job.weight
+        self._last_tag[job.chat_id] = job.tag
+        self._jobs.append(job)
+        self._report()
+
+    def pop(self, now: float | None = None) -> ScheduledJob | None:
+        """Hozir ishga tushirish mumkin bo'lgan eng yaxshi job (yo'q bo'lsa None)"""
+        now = time.time() if now is None else now
+        best = None
+        best_score = 0.0
+        capped = False
+        for job in self._jobs:
+            if self._running[job.chat_id] >= self.max_per_chat:
+                capped = True
+                continue
+            score = job.tag - self.ageing_rate * (now - job.enqueued_at)
+            if best is None or score < best_score:
+                best, best_score = job, score
+        if best is None:
+            if capped:
+                metrics.incr(f"{self.metrics_prefix}.chat_capped")
+            return None
+        self._jobs.remove(best)
+        self._running[best.chat_id] += 1
+        self._vclock = max(self._vclock, best.tag - best.cost / best.weight)
+        self._record_wait(best, now - best.enqueued_at)
+        self._report()
+        return best
+
+    def done(self, job: ScheduledJob) -> None:
+        self._running[job.chat_id] -= 1
+        if self._running[job.chat_id] <= 0:
+            del self._running[job.chat_id]
+            if not any(queued.chat_id == job.chat_id for queued in self._jobs) and self._last_tag.get(job.chat_id, 0.0) <= self._vclock:
+                # Tag virtual soatdan orqada - chat keyingi safar yangidan boshlaydi
+                self._last_tag.pop(job.chat_id, None)
+
+    def _record_wait(self, job: ScheduledJob, waited: float) -> None:
+        previous = self._wait_ema.get(job.kind)
+        ema = waited if previous is None else previous + WAIT_EMA_ALPHA * (waited - previous)
+        self._wait_ema[job.kind] = ema
+        metrics.set_gauge(f"{self.metrics_prefix}.wait_ms.{job.kind}", int(ema * 1000))
+        self._slowdowns.append((job.chat_id, (waited + job.cost) / job.cost if job.cost > 0 else 1.0))
+        metrics.set_gauge(f"{self.metrics_prefix}.fairness", self.fairness())
+
+    def oldest_enqueued(self) -> float | None:
+        """Hali kutayotgan eng eski job navbatga qo'yilgan vaqt"""
+        return min((job.enqueued_at for job in self._jobs), default=None)
+
+    def fairness(self) -> float:
+        totals: dict[Any, list[float]] = defaultdict(list)
+        for chat_id, slowdown in self._slowdowns:
+            totals[chat_id].append(slowdown)
+        means = [sum(values) / len(values) for values in totals.values()]
+        squares = sum(mean * mean for mean in means)
+        if not squares:
+            return 1.0
+        return round(sum(means) ** 2 / (len(means) * squares), 3)
+
+    def _report(self) -> None:
+        metrics.set_gauge(f"{self.metrics_prefix}.queued", len(self._jobs))
+        metrics.set_gauge(f"{self.metrics_prefix}.queued_chats", len({job.chat_id for job in self._jobs}))
@@ -0,0 +1,152 @@
+"""
+Scratch-space (TMP_DIR / tmpfs) budget with admission control.
+
+TMP_DIR lives in /dev/shm, so every byte a job writes there counts against
+the container's memory limit. Jobs reserve their estimated footprint before
+they start (`TaskQueue.add_task(..., scratch_bytes=...)`); when the budget
+is exhausted the task stays parked in the queue instead of running, and
+reservations are released when the job finishes or fails.
+
+The reservation of the running job is exposed through `current_reservation`
+so code that learns the real size later (Instagram Content-Length) can grow it,
+and streaming uploads, which write nothing to TMP_DIR, can hand it back.
+A reservation never waits for more space while it still holds bytes (two
+growing jobs would deadlock): `try_grow` takes the extra only if it is free
+now, and `grow` waits, bounded by GROW_TIMEOUT, only for an empty reservation.
+"""
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Callable
+
+from core.config import get_settings
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VIDEO_BYTES = 150 * 1024 * 1024  # hajmi noma'lum video
+DEFAULT_INSTAGRAM_BYTES = 50 * 1024 * 1024
+DEFAULT_AUDIO_BYTES = 30 * 1024 * 1024
+MERGE_FACTOR = 2.2  # video + audio + merge natijasi bir vaqtda diskda
+PART_OVERHEAD = 1.1  # .part / aria2 oldindan ajratish
+GROW_TIMEOUT = 60  # seconds
+
+
+class Reservation:
+    def __init__(self, budget: "ScratchBudget", nbytes: int):
+        self.budget = budget
+        self.nbytes = nbytes
+        self.released = False
+
+    def try_grow(self, nbytes: int) -> bool:
+        """Haqiqiy hajm kattaroq bo'lib chiqsa (masalan Content-Length) - joy hozir bo'sh bo'lsagina olish"""
+        extra = self.budget.clamp(nbytes) - self.nbytes
+        if extra <= 0 or self.released:
+            return True
+        if extra > self.budget.available:
+            metrics.incr("scratch_budget.grow_denied")
+            return False
+        self.budget._used += extra
+        self.nbytes += extra
+        self.budget._report()
+        return True
+
+    async def grow(self, nbytes: int, timeout: float = GROW_TIMEOUT) -> bool:
+        """try_grow; bo'sh (shrink(0) qilingan) reservation esa joy bo'shashini timeout'gacha kutadi"""
+        if self.try_grow(nbytes):
+            return True
+        if self.nbytes:
+            return False  # o'z baytlarini ushlab turib kutmaydi
+        needed = self.budget.clamp(nbytes)
+        try:
+            async with self.budget._cond:
+                await asyncio.wait_for(self.budget._cond.wait_for(lambda: self.budget.available >= needed), timeout)
+                return self.try_grow(nbytes)
+        except asyncio.TimeoutError:
+            metrics.incr("scratch_budget.grow_timeouts")
+            return False
+
+    def shrink(self, nbytes: int) -> None:
+        """Ortiqcha joyni budjetga qaytarish (masalan stream upload TMP_DIR'ga yozmaydi)"""
+        freed = self.nbytes - max(0, nbytes)
+        if freed <= 0 or self.released:
+            return
+        self.nbytes -= freed
+        self.budget._release(freed)
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        self.budget._release(self.nbytes)
+
+
+current_reservation: ContextVar[Reservation | None] = ContextVar("current_reservation", default=None)
+
+
+class ScratchBudget:
+    def __init__(self, capacity_bytes: int):
+        self.capacity = capacity_bytes
+        self._used = 0
+        self._cond = asyncio.Condition()
+        self._release_listeners: list[Callable[[], None]] = []
+
+    @property
+    def available(self) -> int:
+        return self.capacity - self._used
+
+    def clamp(self, nbytes: int) -> int:
+        # Butun budjetdan katta job yolg'iz ishlashi mumkin bo'lsin
+        return max(0, min(int(nbytes), self.capacity))
+
+    def try_reserve(self, nbytes: int) -> Reservation | None:
+        nbytes = self.clamp(nbytes)
+        if nbytes > self.available:
+            return None
+        self._used += nbytes
+        self._report()
+        return Reservation(self, nbytes)
+
+    async def reserve(self, nbytes: int) -> Reservation:
+        """Joy bo'shashini kutib band qilish (Redis navbatidan olingan job'lar uchun)"""
+        nbytes = self.clamp(nbytes)
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.available >= nbytes)
+            self._used += nbytes
+            self._report()
+        return Reservation(self, nbytes)
+
+    def add_release_listener(self, listener: Callable[[], None]) -> None:
+        self._release_listeners.append(listener)
+
+    def _release(self, nbytes: int) -> None:
+        self._used = max(0, self._used - nbytes)
+        self._report()
+
+        async def _notify() -> None:
+            async with self._cond:
+                self._cond.notify_all()
+
+        try:
+            asyncio.get_running_loop().create_task(_notify())
+        except RuntimeError:
+            pass
+        for listener in self._release_listeners:
+            try:
+                listener()
+            except Exception as e:
+                logger.error(f"Scratch budget listener error: {e}")
+
+    def _report(self) -> None:
+        metrics.set_gauge("scratch_budget.used_bytes", self._used)
+
+
+def estimate_video_bytes(size_bytes: int | None, is_merge: bool) -> int:
+    """Format rejasidagi `size_bytes` dan TMP_DIR'da kerak bo'ladigan joy"""
+    if not size_bytes:
+        return DEFAULT_VIDEO_BYTES
+    return int(size_bytes * (MERGE_FACTOR if is_merge else PART_OVERHEAD))
+
+
+# Global instance
+scratch_budget = ScratchBudget(get_settings().scratch_budget_mb * 1024 * 1024)
@@ -0,0 +1,200 @@
+"""
+Single-flight coalescing of identical downloads.
+
+When several chats ask for the same media (same canonical key), only the
+first job downloads and uploads. Jobs in the same process wait on an
+asyncio future; across processes the leader is whoever wins
+`SET flight:lock:{key} NX`, the others poll `flight:result:` (at most
+FLIGHT_MAX_WAIT) for the Telegram file_id the leader published. The leader
+renews its lock every FLIGHT_LOCK_TTL / RENEW_FRACTION, so the lock of a
+crashed leader expires within FLIGHT_LOCK_TTL; nobody deletes another
+owner's lock. If the leader fails, is cancelled or dies, one waiter takes
+over; a job that still finds a live leader after MAX_TAKEOVERS rounds
+gives up (None) rather than download without the lock.
+"""
+import asyncio
+import logging
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+import msgpack
+
+from services import metrics
+from services.idempotency import RELEASE_SCRIPT, RENEW_FRACTION, RENEW_SCRIPT
+
+logger = logging.getLogger(__name__)
+
+FLIGHT_LOCK_TTL = 120  # leader ishlayotganda uzaytiriladi
+FLIGHT_RESULT_TTL = 600
+FLIGHT_POLL_INTERVAL = 1.0
+FLIGHT_MAX_WAIT = 600  # seconds; keyin o'zimiz yuklaymiz
+MAX_TAKEOVERS = 2
+
+
+@dataclass
+class FlightResult:
+    file_id: str
+    file_type: str = "video"  # video | document | audio
+    title: str = ""
+    filename: str = ""
+    # Faqat leader job uchun: yuborilgan Message (Redis'ga yozilmaydi)
+    message: Any = field(default=None, compare=False, repr=False)
+
+    def pack(self) -> bytes:
+        return msgpack.packb({
+            "file_id": self.file_id,
+            "file_type": self.file_type,
+            "title": self.title,
+            "filename": self.filename,
+        })
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "FlightResult":
+        return cls(**msgpack.unpackb(data))
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def do(
+        self,
+        key: str,
+        work: Callable[[], Awaitable[FlightResult | None]],
+    ) -> tuple[FlightResult | None, bool]:
+        """
+        `work` ni shu key uchun faqat bir marta bajarish.
+        O'lgan process'ning lock'i renewal to'xtagach FLIGHT_LOCK_TTL ichida o'zi tugaydi.
+        Returns: (natija, leader_mi); leader'ni kutib natija bo'lmasa (None, False)
+        """
+        for _ in range(MAX_TAKEOVERS):
+            future = self._inflight.get(key)
+            if future is not None:
+                metrics.incr("single_flight.coalesced_local")
+                result = await asyncio.shield(future)
+                if result:
+                    return result, False
+                continue
+
+            remote = await self._wait_remote(key)
+            if remote:
+                metrics.incr("single_flight.coalesced_remote")
+                return remote, False
+            if key in self._inflight:
+                continue
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            acquired, token = await self._acquire_remote(key)
+            if not acquired:
+                # Boshqa process bizdan oldin leader bo'ldi - uni kutamiz
+                self._inflight.pop(key, None)
+                future.set_result(None)
+                metrics.incr("single_flight.lock_contended")
+                continue
+            return await self._lead(key, work, future, token), True
+
+        # Lock hali boshqa leader'da - lock'siz yuklamaymiz
+        logger.warning(f"Single flight {key}: no result after {MAX_TAKEOVERS} rounds, giving up")
+        metrics.incr("single_flight.gave_up")
+        return None, False
+
+    async def _lead(
+        self,
+        key: str,
+        work: Callable[[], Awaitable[FlightResult | None]],
+        future: asyncio.Future,
+        token: str | None,
+    ) -> FlightResult | None:
+        metrics.incr("single_flight.leader")
+        result = None
+        renewal = asyncio.create_task(self._renew_remote(key, token)) if token else None
+        try:
+            result = await work()
+            if result:
+                await self._publish(key, result)
+            return result
+        finally:
+            if renewal:
+                renewal.cancel()
+                await asyncio.gather(renewal, return_exceptions=True)
+            if not future.done():
+                future.set_result(result)
+            self._inflight.pop(key, None)
+            await self._release_remote(key, token)
+
+    @staticmethod
+    def _redis():
+        from loader import redis_client
+        return redis_client
+
+    async def _acquire_remote(self, key: str) -> tuple[bool, str | None]:
+        """(leader_bo'ldikmi, token); Redis'siz yoki xatoda - lock'siz leader"""
+        redis_client = self._redis()
+        if not redis_client:
+            return True, None
+        token = uuid.uuid4().hex
+        try:
+            if await redis_client.set(f"flight:lock:{key}", token, nx=True, ex=FLIGHT_LOCK_TTL):
+                return True, token
+            return False, None
+        except Exception as e:
+            logger.error(f"Flight lock error: {e}")
+            return True, None
+
+    async def _release_remote(self, key: str, token: str | None) -> None:
+        redis_client = self._redis()
+        if not redis_client or not token:
+            return
+        try:
+            await redis_client.eval(RELEASE_SCRIPT, 1, f"flight:lock:{key}", token)
+        except Exception as e:
+            logger.error(f"Flight unlock error: {e}")
+
+    async def _renew_remote(self, key: str, token: str) -> None:
+        """Leader ishlayotgan paytda lock'ni uzaytirib turish"""
+        while True:
+            await asyncio.sleep(FLIGHT_LOCK_TTL / RENEW_FRACTION)
+            try:
+                renewed = await self._redis().eval(RENEW_SCRIPT, 1, f"flight:lock:{key}", token, FLIGHT_LOCK_TTL * 1000)
+            except Exception as e:
+                logger.error(f"Flight lock renewal error: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"Flight lock {key} lost; another job may lead")
+                metrics.incr("single_flight.lock_lost")
+                return
+
+    async def _publish(self, key: str, result: FlightResult) -> None:
+        redis_client = self._redis()
+        if not redis_client:
+            return
+        try:
+            await redis_client.setex(f"flight:result:{key}", FLIGHT_RESULT_TTL, result.pack())
+        except Exception as e:
+            logger.error(f"Flight publish error: {e}")
+
+    async def _wait_remote(self, key: str) -> FlightResult | None:
+        """Boshqa process shu media'ni yuklayotgan bo'lsa, natijasini kutish (FLIGHT_MAX_WAIT gacha)"""
+        redis_client = self._redis()
+        if not redis_client:
+            return None
+        deadline = asyncio.get_running_loop().time() + FLIGHT_MAX_WAIT
+        try:
+            while True:
+                data = await redis_client.get(f"flight:result:{key}")
+                if data:
+                    return FlightResult.unpack(data)
+                if not await redis_client.exists(f"flight:lock:{key}"):
+                    return None
+                if asyncio.get_running_loop().time() >= deadline:
+                    metrics.incr("single_flight.wait_timeout")
+                    return None
+                await asyncio.sleep(FLIGHT_POLL_INTERVAL)
+        except Exception as e:
+            logger.error(f"Flight wait error: {e}")
+            return None
+
+
+# Global instance
+single_flight = SingleFlight()
@@ -0,0 +1,200 @@
+"""
+Streaming download -> Telegram upload.
+
+For single-file sources (YouTube progressive formats, Instagram direct MP4)
+the bytes go straight from the HTTP response into the multipart upload
+through a fixed-size ring buffer, so nothing lands in TMP_DIR, peak memory
+is bounded by the buffer, and the upload runs while the download is still
+in progress (latency ~ max(download, upload) instead of their sum).
+"""
+import asyncio
+import logging
+from typing import AsyncGenerator, Awaitable, Callable
+
+import aiohttp
+from aiogram import Bot
+from aiogram.types import InputFile
+
+from core.config import get_settings
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+FETCH_CHUNK_SIZE = 64 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+FETCH_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=10, sock_read=60)
+CLOUD_API_MAX_UPLOAD = 50 * 1024 * 1024
+LOCAL_API_MAX_UPLOAD = 2000 * 1024 * 1024
+
+
+class StreamAborted(Exception):
+    pass
+
+
+class RingBuffer:
+    """Bitta yozuvchi va bitta o'quvchi uchun oldindan ajratilgan aylana bufer"""
+
+    def __init__(self, capacity: int):
+        self._buf = bytearray(capacity)
+        self._capacity = capacity
+        self._start = 0
+        self._size = 0
+        self._closed = False
+        self._error: Exception | None = None
+        self._cond = asyncio.Condition()
+        self.total_written = 0
+        self.peak = 0
+
+    async def write(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            async with self._cond:
+                await self._cond.wait_for(lambda: self._size < self._capacity or self._error)
+                if self._error:
+                    raise self._error
+                n = min(len(view), self._capacity - self._size)
+                end = (self._start + self._size) % self._capacity
+                first = min(n, self._capacity - end)
+                self._buf[end:end + first] = view[:first]
+                if n > first:
+                    self._buf[:n - first] = view[first:n]
+                self._size += n
+                self.total_written += n
+                self.peak = max(self.peak, self._size)
+                view = view[n:]
+                self._cond.notify_all()
+
+    async def read(self, max_bytes: int) -> bytes:
+        """Mavjud baytlarni qaytarish; b"" - oqim tugadi"""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._size or self._closed or self._error)
+            if self._error:
+                raise self._error
+            if not self._size:
+                return b""
+            n = min(max_bytes, self._size)
+            first = min(n, self._capacity - self._start)
+            data = bytes(self._buf[self._start:self._start + first])
+            if n > first:
+                data += bytes(self._buf[:n - first])
+            self._start = (self._start + n) % self._capacity
+            self._size -= n
+            self._cond.notify_all()
+            return data
+
+    async def close(self) -> None:
+        async with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    async def fail(self, error: Exception) -> None:
+        async with self._cond:
+            if self._error is None:
+                self._error = error
+            self._cond.notify_all()
+
+
+class StreamInputFile(InputFile):
+    """aiogram multipart yuklashi uchun RingBuffer'dan o'qiladigan fayl"""
+
+    def __init__(self, buffer: RingBuffer, filename: str, chunk_size: int = UPLOAD_CHUNK_SIZE):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.buffer = buffer
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        while chunk := await self.buffer.read(self.chunk_size):
+            yield chunk
+
+
+def max_upload_bytes() -> int:
+    return LOCAL_API_MAX_UPLOAD if get_settings().use_local_server else CLOUD_API_MAX_UPLOAD
+
+
+async def fetch_to_buffer(
+    session: aiohttp.ClientSession,
+    url: str,
+    buffer: RingBuffer,
+    headers: dict | None = None,
+    proxy: str | None = None,
+    total: int | None = None,
+    range_chunk: int | None = None,
+    progress_hook: Callable[[dict], None] | None = None,
+    should_stop: Callable[[], bool] | None = None,
+    throttle: Callable[[int], Awaitable[None]] | None = None,
+) -> None:
+    """
+    URL'ni bufferga yozish. `range_chunk` berilsa (YouTube) fayl ketma-ket
+    Range so'rovlari bilan olinadi - yt-dlp'ning http_chunk_size kabi.
+    `throttle` har chunk'dan keyin chaqiriladi (governor lease).
+    """
+    downloaded = 0
+
+    async def _read(response: aiohttp.ClientResponse) -> None:
+        nonlocal downloaded
+        async for chunk in response.content.iter_chunked(FETCH_CHUNK_SIZE):
+            if should_stop and should_stop():
+                raise StreamAborted("cancelled")
+            await buffer.write(chunk)
+            downloaded += len(chunk)
+            if throttle:
+                await throttle(len(chunk))
+            if progress_hook:
+                progress_hook({"status": "downloading", "downloaded_bytes": downloaded, "total_bytes": total})
+
+    while True:
+        request_headers = dict(headers or {})
+        if range_chunk and total:
+            end = min(downloaded + range_chunk, total) - 1
+            request_headers["Range"] = f"bytes={downloaded}-{end}"
+        async with session.get(url, headers=request_headers, timeout=FETCH_TIMEOUT, proxy=proxy or None) as response:
+            if response.status not in (200, 206):
+                raise StreamAborted(f"HTTP {response.status}")
+            if response.status == 200 and downloaded:
+                # Server Range'ni e'tiborsiz qoldirdi - boshidan qayta yuborayapti
+                raise StreamAborted("range not supported")
+            if total is None and response.content_length:
+                total = response.content_length
+            await _read(response)
+        if not (range_chunk and total) or downloaded >= total:
+            break
+    if total and downloaded != total:
+        raise StreamAborted(f"incomplete stream: {downloaded}/{total} bytes")
+
+
+async def stream_upload(
+    source: Callable[[RingBuffer], Awaitable[None]],
+    send: Callable[[InputFile], Awaitable],
+    filename: str,
+    buffer_bytes: int | None = None,
+):
+    """
+    `source` bufferga yozadi, `send` bir vaqtning o'zida StreamInputFile'ni yuklaydi.
+    Istalgan tomonda xato bo'lsa ikkinchisi ham to'xtatiladi.
+    """
+    buffer = RingBuffer(buffer_bytes or get_settings().stream_upload_buffer_mb * 1024 * 1024)
+
+    async def produce() -> None:
+        try:
+            await source(buffer)
+        except asyncio.CancelledError:
+            await buffer.fail(StreamAborted("source cancelled"))
+            raise
+        except Exception as e:
+            await buffer.fail(e)
+            raise
+        await buffer.close()
+
+    producer = asyncio.create_task(produce())
+    try:
+        message = await send(StreamInputFile(buffer, filename))
+        await producer
+    except BaseException:
+        await buffer.fail(StreamAborted("upload failed"))
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+        metrics.incr("stream_upload.failed")
+        raise
+    metrics.incr("stream_upload.ok")
+    metrics.incr("stream_upload.bytes", buffer.total_written)
+    logger.info(f"Streamed {buffer.total_written} bytes to Telegram (peak buffer {buffer.peak} bytes)")
+    return message
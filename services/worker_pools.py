@@ -0,0 +1,100 @@
+"""
+Named worker pools and the task routing table.
+
+Music, video, Shazam recognition and broadcasts have very different CPU,
+network and tmpfs profiles, so each runs in its own pool with its own
+concurrency, queue limit and timeout (`utils.task_queue.TaskQueue` starts
+one set of workers, and one Redis stream, per pool). ROUTES maps a task
+function name to its pool; anything not listed runs in `default`.
+
+Override with WORKER_POOLS="video=3:40:1800:audio_only,music=6"
+(name=concurrency[:queue_limit[:timeout_seconds[:policy]]]; timeout 0 =
+none). queue_limit counts every unfinished job of the pool, queued or
+running; at the limit new jobs are always rejected.
+
+Admission policy, applied once a pool is past SOFT_LIMIT_RATIO of its
+queue_limit (`TaskQueue.admission`):
+
+- reject: nothing changes until the hard limit;
+- degrade: the handler queues a cheaper variant (lower video quality);
+- audio_only: new video jobs are refused and the user is offered MP3.
+"""
+from dataclasses import dataclass, replace
+from typing import Callable
+
+from core.config import get_settings
+
+DEFAULT_POOL = "default"
+SOFT_LIMIT_RATIO = 0.5
+
+ACCEPT = "accept"
+REJECT = "reject"
+DEGRADE = "degrade"
+AUDIO_ONLY = "audio_only"
+POLICIES = (REJECT, DEGRADE, AUDIO_ONLY)
+
+
+@dataclass(frozen=True)
+class PoolSpec:
+    name: str
+    concurrency: int
+    queue_limit: int
+    timeout: float  # sekund, 0 - cheklovsiz
+    policy: str = REJECT  # navbat yarmidan oshganda: reject | degrade | audio_only
+
+    def admission(self, load: int) -> str:
+        """load - pool'dagi tugallanmagan job'lar"""
+        if load >= self.queue_limit:
+            return REJECT
+        if self.policy != REJECT and load >= self.queue_limit * SOFT_LIMIT_RATIO:
+            return self.policy
+        return ACCEPT
+
+
+DEFAULT_POOLS = {
+    "music": PoolSpec("music", 3, 200, 600),  # tarmoq, kichik fayllar
+    "video": PoolSpec("video", 2, 50, 1800, DEGRADE),  # merge CPU va tmpfs'ni band qiladi
+    "recognize": PoolSpec("recognize", 1, 20, 180),
+    "broadcast": PoolSpec("broadcast", 1, 5, 0),  # barcha foydalanuvchilarga - uzoq davom etadi
+    DEFAULT_POOL: PoolSpec(DEFAULT_POOL, 2, 100, 900),
+}
+
+ROUTES = {
+    "process_music_task": "music",
+    "process_video_task": "video",
+    "recognize_music_task": "recognize",
+    "broadcast_worker": "broadcast",
+    "delete_broadcast_worker": "broadcast",
+    "edit_broadcast_worker": "broadcast",
+}
+
+
+def _parse_pools(raw: str) -> dict[str, PoolSpec]:
+    pools = dict(DEFAULT_POOLS)
+    for part in raw.split(","):
+        name, _, value = part.partition("=")
+        name = name.strip()
+        fields = [field.strip() for field in value.split(":")]
+        policy = fields.pop() if len(fields) == 4 and fields[3] in POLICIES else None
+        if not name or not fields or not all(field.isdigit() for field in fields):
+            continue
+        spec = pools.get(name) or replace(DEFAULT_POOLS[DEFAULT_POOL], name=name)
+        if policy:
+            spec = replace(spec, policy=policy)
+        numbers = [int(field) for field in fields]
+        spec = replace(spec, concurrency=max(1, numbers[0]))
+        if len(numbers) > 1:
+            spec = replace(spec, queue_limit=max(1, numbers[1]))
+        if len(numbers) > 2:
+            spec = replace(spec, timeout=numbers[2])
+        pools[name] = spec
+    return pools
+
+
+def pool_specs() -> dict[str, PoolSpec]:
+    return _parse_pools(get_settings().worker_pools)
+
+
+def route(func: Callable) -> str:
+    """Task qaysi pool'da bajariladi"""
+    return ROUTES.get(getattr(func, "__name__", ""), DEFAULT_POOL)
@@ -3,18 +3,49 @@ import logging
 import os
 import time
 from hashlib import sha256
+from pathlib import Path
 from typing import Optional
 
-from utils.download import download_video, download_audio, cache_media_result
+import aiohttp
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from shazamio import Shazam
+
+from core.config import get_settings
+from instagram_downloader import stream_instagram_direct
+from utils.cancellation import DownloadHandle, download_registry
+from utils.download import (
+    COMMON_OPTS,
+    download_audio,
+    download_video,
+    resolve_progressive_stream,
+)
+from loader import TMP_DIR
+from utils.media_key import media_key
+from utils.search import search_music
+from utils.ydl_executor import ydl_executor
+from utils.ydl_pool import run_extract
+from services import metrics
 from services.artist_cache import cache_artist_name
 from services.bot_client import create_bot_session
-from services.idempotency import acquire_lock, release_lock
-from services.media_sender import send_audio, send_video
-from services.message_utils import edit_or_reply_error, delete_message_only
+from services.governor import YOUTUBE_ORIGIN, governor
+from services.idempotency import LockLost, check_held, current_lease, idempotency_locks
+from services.job_store import job_store
+from services.job_timings import job_timings
+from services.media_cache import CachedMedia, is_bad_file_id, media_cache
+from services.media_sender import build_cancel_keyboard, send_audio, send_video
+from services.prefetch import AUDIO_CHOICE, prefetcher, video_choice
+from services.scratch_budget import Reservation, current_reservation
+from services.single_flight import FlightResult, single_flight
+from services.stream_upload import fetch_to_buffer, max_upload_bytes, stream_upload
+from services.message_utils import edit_or_reply_error, edit_progress_message, delete_message_only
 from utils.i18n import get_user_lang_sync, translate_error, t
+from utils.validation import extract_youtube_id, is_instagram_url
 
 logger = logging.getLogger(__name__)
 
+LOCK_LOST = "lock_lost"  # DownloadHandle.cancel sababi
+
+
 async def _remove_file_if_exists(path: str) -> None:
     try:
         await asyncio.to_thread(os.remove, path)
@@ -24,6 +55,7 @@ async def _remove_file_if_exists(path: str) -> None:
         logger.error(f"Failed to remove file: {e}")
 
 
+@job_store.resumable
 async def process_video_task(
     chat_id: int,
     url: str,
@@ -33,14 +65,17 @@ async def process_video_task(
     format_label: Optional[str] = None,
     title: Optional[str] = None,
     uploader: Optional[str] = None,
+    resumed: bool = False,
 ) -> None:
     url_hash = sha256(url.encode()).hexdigest()[:16]
     lock_key = f"idempotency:video:{chat_id}:{url_hash}"
-    if not acquire_lock(lock_key):
-        if status_message_id:
-            await _delete_message_only(chat_id, status_message_id)
-        return
-    try:
+    # Qayta yuborilgan job: birinchi ega hali tirik bo'lishi mumkin - uning lease'i tugashini kutamiz
+    async with idempotency_locks.hold(lock_key, wait=resumed) as lease:
+        if lease is None:
+            # Qayta yuborilgan job'ning status xabari - hali ishlayotgan egasiniki, o'chirilmaydi
+            if status_message_id and not resumed:
+                await _delete_message_only(chat_id, status_message_id)
+            return
         await _process_video_task_async(
             chat_id,
             url,
@@ -50,9 +85,8 @@ async def process_video_task(
             format_label,
             title,
             uploader,
+            resumed,
         )
-    finally:
-        release_lock(lock_key)
 
 
 async def _process_video_task_async(
@@ -64,9 +98,22 @@ async def _process_video_task_async(
     format_label: Optional[str],
     title: Optional[str],
     uploader: Optional[str],
+    resumed: bool = False,
 ) -> None:
     bot, session = create_bot_session()
     lang = get_user_lang_sync(chat_id)
+    handle = download_registry.register(DownloadHandle(
+        (chat_id, status_message_id) if status_message_id else None,
+        event=ydl_executor.new_event(),
+    ))
+    await download_registry.check_remote(handle)
+    lease = current_lease.get()
+    if lease:
+        # Lock boshqa job'ga o'tdi - yuklashni to'xtatamiz, natijani u yuboradi
+        lease.on_lost = lambda: handle.cancel(LOCK_LOST)
+    cancel_kb = build_cancel_keyboard(lang) if status_message_id else None
+    if resumed and status_message_id:
+        await _edit_progress_message(bot, chat_id, status_message_id, t("download_resumed", lang), cancel_kb)
     try:
         loop = asyncio.get_running_loop()
         last_update = 0.0
@@ -100,49 +147,76 @@ async def _process_video_task_async(
                 bar=bar,
             )
             asyncio.run_coroutine_threadsafe(
-                _edit_progress_message(bot, chat_id, status_message_id, text),
+                _edit_progress_message(bot, chat_id, status_message_id, text, cancel_kb),
                 loop
             )
             last_update = now
 
-        video_path, existing_file_id, video_title = await download_video(
-            url,
-            chat_id,
-            format_selector=format_selector,
-            output_ext=output_ext,
-            progress_hook=progress_hook
-        )
-        
-        sent_message = None
-        caption_suffix = format_line if format_line else None
-        if existing_file_id:
-            sent_message = await _send_video_with_retry(
-                bot,
-                chat_id,
-                video_path=None,
-                url=url,
-                file_id=existing_file_id,
-                title=video_title,
-                caption_suffix=caption_suffix
-            )
-        elif video_path:
-            sent_message = await _send_video_with_retry(
-                bot,
-                chat_id,
-                video_path=video_path,
-                url=url,
-                title=video_title,
-                caption_suffix=caption_suffix
-            )
-             
-             # Cache the file_id if sending was successful
-            if sent_message and sent_message.video:
-                url_hash = sha256(url.encode()).hexdigest()
-                await cache_media_result(url_hash, {'file_id': sent_message.video.file_id})
-            
-            # Remove file from RAM/Disk (ALWAYS)
+        async def lead() -> FlightResult | None:
+            # Format tanlanayotganda boshlangan prefetch - yuklash allaqachon ketmoqda
+            prefetched = None
+            if format_selector:
+                prefetched = await prefetcher.claim(
+                    chat_id, extract_youtube_id(url) or "", video_choice(format_selector, output_ext),
+                    handle, progress_hook,
+                )
+            if prefetched:
+                video_path, video_title = prefetched
+            else:
+                async with job_timings.measure("stream"):
+                    sent, video_title = await _stream_video(
+                        bot, chat_id, url, format_selector, caption_suffix, progress_hook, handle
+                    )
+                if sent:
+                    return _video_flight_result(sent, video_title)
+
+                async with job_timings.measure("download"):
+                    video_path, video_title = await download_video(
+                        url,
+                        chat_id,
+                        format_selector=format_selector,
+                        output_ext=output_ext,
+                        progress_hook=progress_hook,
+                        handle=handle
+                    )
+            sent = None
             if video_path:
-                await _remove_file_if_exists(video_path)
+                try:
+                    check_held()
+                    async with job_timings.measure("upload"):
+                        sent = await _send_video_with_retry(
+                            bot,
+                            chat_id,
+                            video_path=video_path,
+                            url=url,
+                            title=video_title,
+                            caption_suffix=caption_suffix
+                        )
+                finally:
+                    # Remove file from RAM/Disk (ALWAYS)
+                    await _remove_file_if_exists(video_path)
+            return _video_flight_result(sent, video_title)
+
+        caption_suffix = format_line if format_line else None
+        cache_key = media_key(url, format_selector, output_ext)
+        sent_message = await _send_cached_video(bot, chat_id, url, cache_key, caption_suffix)
+        if not sent_message:
+            result, is_leader = await single_flight.do(cache_key, lead)
+            sent_message = result.message if result else None
+            if result and is_leader:
+                await media_cache.put(cache_key, _cache_entry(result))
+            elif result:
+                # Boshqa chat shu media'ni allaqachon yuklab yubordi - file_id orqali jo'natamiz
+                sent_message = await _send_video_with_retry(
+                    bot,
+                    chat_id,
+                    video_path=None,
+                    url=url,
+                    file_id=result.file_id,
+                    file_type=result.file_type,
+                    title=result.title,
+                    caption_suffix=caption_suffix
+                )
 
         if sent_message:
             if status_message_id:
@@ -162,6 +236,9 @@ async def _process_video_task_async(
                 except Exception:
                     pass
     except Exception as e:
+        if isinstance(e, LockLost) or handle.reason == LOCK_LOST:
+            logger.warning(f"Video task stopped, idempotency lock lost: {url}")
+            return
         logger.error(f"Video task error: {e}")
         err_text = translate_error(str(e), lang)
         if "❌" not in err_text:
@@ -173,17 +250,118 @@ async def _process_video_task_async(
             except Exception:
                 pass
     finally:
+        download_registry.unregister(handle)
         await session.close()
 
 
-async def _edit_progress_message(bot, chat_id: int, message_id: int, text: str) -> None:
+async def _stream_video(
+    bot,
+    chat_id: int,
+    url: str,
+    format_selector: Optional[str],
+    caption_suffix: str | None,
+    progress_hook,
+    handle: DownloadHandle,
+) -> tuple[object | None, str]:
+    """
+    Progressive YouTube formatlari va Instagram direct video'ni TMP_DIR'ga
+    yozmasdan Telegram'ga stream qilish. (None, "") - oddiy yuklashga o'tiladi.
+    Stream paytida job'ning TMP_DIR reservation'i budjetga qaytariladi.
+    """
+    if not get_settings().stream_upload or handle.cancelled:
+        return None, ""
+    check_held()
+    reservation = current_reservation.get()
+    reserved = reservation.nbytes if reservation else 0
     try:
-        await bot.edit_message_caption(chat_id=chat_id, message_id=message_id, caption=text, parse_mode='HTML')
-    except Exception:
-        try:
-            await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, parse_mode='HTML')
-        except Exception:
-            pass
+        if is_instagram_url(url):
+            async def send_instagram(input_file):
+                return await send_video(
+                    bot, chat_id, url=url, title="Video", caption_suffix=caption_suffix, input_file=input_file
+                )
+
+            if reservation:
+                reservation.shrink(0)
+            sent = await stream_instagram_direct(
+                url, send_instagram, progress_hook=progress_hook, should_stop=lambda: handle.cancelled
+            )
+            if sent:
+                return sent, "Video"
+            return await _restore_reservation(reservation, reserved)
+
+        stream = await resolve_progressive_stream(url, format_selector)
+        if not stream or (stream["filesize"] or 0) > max_upload_bytes():
+            return None, ""
+        if reservation:
+            reservation.shrink(0)
+
+        async def send_progressive(input_file):
+            return await send_video(
+                bot,
+                chat_id,
+                url=url,
+                title=stream["title"],
+                caption_suffix=caption_suffix,
+                input_file=input_file,
+                video_meta=stream,
+            )
+
+        async def source(buffer) -> None:
+            async with aiohttp.ClientSession() as http, governor.lease(YOUTUBE_ORIGIN) as lease:
+                await fetch_to_buffer(
+                    http,
+                    stream["url"],
+                    buffer,
+                    headers=stream["http_headers"],
+                    total=stream["filesize"],
+                    range_chunk=COMMON_OPTS["http_chunk_size"],
+                    progress_hook=progress_hook,
+                    should_stop=lambda: handle.cancelled,
+                    throttle=lease.throttle,
+                )
+
+        return await stream_upload(source, send_progressive, "video.mp4"), stream["title"]
+    except Exception as e:
+        if handle.cancelled:
+            raise handle.error()
+        logger.warning(f"Stream upload failed, falling back to file download: {e}")
+        metrics.incr("stream_upload.fallback")
+        return await _restore_reservation(reservation, reserved)
+
+
+async def _restore_reservation(reservation: Reservation | None, nbytes: int) -> tuple[None, str]:
+    """Stream o'xshamadi - fayl yuklash uchun TMP_DIR joyini qaytarib olish"""
+    if reservation and reservation.nbytes < nbytes and not await reservation.grow(nbytes):
+        logger.warning("Scratch budget still full after stream fallback, downloading without reservation")
+    return None, ""
+
+
+async def _send_cached_video(bot, chat_id: int, url: str, cache_key: str, caption_suffix: str | None):
+    """Keshdagi file_id bilan yuborish; Telegram file_id'ni rad etsa yozuv o'chiriladi va None qaytadi"""
+    cached = await media_cache.get(cache_key)
+    if not cached:
+        return None
+    try:
+        return await _send_video_with_retry(
+            bot,
+            chat_id,
+            video_path=None,
+            url=url,
+            file_id=cached.file_id,
+            file_type=cached.file_type,
+            title=cached.video_title or "Video",
+            caption_suffix=caption_suffix
+        )
+    except Exception as e:
+        if not is_bad_file_id(e):
+            raise
+        logger.warning(f"Cached file_id rejected for {cache_key}: {e}")
+        await media_cache.invalidate(cache_key)
+        return None
+
+
+async def _edit_progress_message(bot, chat_id: int, message_id: int, text: str, reply_markup=None) -> None:
+    await edit_progress_message(bot, chat_id, message_id, text, reply_markup)
 
 
 async def _send_video_with_retry(
@@ -194,6 +372,7 @@ async def _send_video_with_retry(
     title: str,
     caption_suffix: str | None,
     file_id: str | None = None,
+    file_type: str = "video",
 ):
     try:
         return await send_video(
@@ -204,6 +383,7 @@ async def _send_video_with_retry(
             file_id=file_id,
             title=title,
             caption_suffix=caption_suffix,
+            file_type=file_type,
         )
     except Exception as e:
         err = str(e).lower()
@@ -218,9 +398,33 @@ async def _send_video_with_retry(
             file_id=file_id,
             title=title,
             caption_suffix=caption_suffix,
+            file_type=file_type,
         )
 
 
+def _video_flight_result(sent_message, title: str) -> FlightResult | None:
+    if not sent_message:
+        return None
+    if sent_message.video:
+        return FlightResult(sent_message.video.file_id, "video", title, message=sent_message)
+    if sent_message.document:
+        return FlightResult(sent_message.document.file_id, "document", title, message=sent_message)
+    return None
+
+
+def _cache_entry(result: FlightResult) -> CachedMedia:
+    # result.file_type Message atributi nomi bilan bir xil: video / document / audio
+    media = getattr(result.message, result.file_type, None) if result.message else None
+    return CachedMedia(
+        result.file_id,
+        result.file_type,
+        video_title=result.title,
+        filename=result.filename,
+        file_unique_id=getattr(media, "file_unique_id", None) or "",
+        size_bytes=getattr(media, "file_size", None) or 0,
+    )
+
+
 def _render_progress_bar(percent: int) -> str:
     width = 12
     pct = max(0, min(100, percent))
@@ -228,22 +432,23 @@ def _render_progress_bar(percent: int) -> str:
     return "[" + ("#" * filled) + ("-" * (width - filled)) + "]"
 
 
+@job_store.resumable
 async def process_music_task(
     chat_id: int,
     video_id: str,
     message_id: int,
     is_media: bool,
-    status_message_id: Optional[int] = None
+    status_message_id: Optional[int] = None,
+    resumed: bool = False,
 ) -> None:
     lock_key = f"idempotency:music:{chat_id}:{video_id}"
-    if not acquire_lock(lock_key):
-        if status_message_id:
-            await _delete_message_only(chat_id, status_message_id)
-        return
-    try:
-        await _process_music_task_async(chat_id, video_id, message_id, is_media, status_message_id)
-    finally:
-        release_lock(lock_key)
+    async with idempotency_locks.hold(lock_key, wait=resumed) as lease:
+        if lease is None:
+            # Qayta yuborilgan job'ning status xabari - hali ishlayotgan egasiniki, o'chirilmaydi
+            if status_message_id and not resumed:
+                await _delete_message_only(chat_id, status_message_id)
+            return
+        await _process_music_task_async(chat_id, video_id, message_id, is_media, status_message_id, resumed)
 
 
 async def _process_music_task_async(
@@ -251,53 +456,68 @@ async def _process_music_task_async(
     video_id: str,
     message_id: int,
     is_media: bool,
-    status_message_id: Optional[int]
+    status_message_id: Optional[int],
+    resumed: bool = False,
 ) -> None:
     bot, session = create_bot_session()
     lang = get_user_lang_sync(chat_id)
     try:
-        audio_path, filename, file_id = await download_audio(video_id, chat_id)
-        
+        url = f"https://www.youtube.com/watch?v={video_id}"
+        if resumed and status_message_id:
+            await _edit_progress_message(bot, chat_id, status_message_id, t("download_resumed", lang))
+
+        async def lead() -> FlightResult | None:
+            prefetched = await prefetcher.claim(chat_id, video_id, AUDIO_CHOICE)
+            if prefetched:
+                audio_path, filename = prefetched
+            else:
+                async with job_timings.measure("download"):
+                    audio_path, filename = await download_audio(video_id, chat_id)
+            sent = None
+            if audio_path:
+                artist_name = "Unknown"
+                if " - " in filename:
+                    artist_name = filename.rsplit(" - ", 1)[1].replace(".m4a", "")
+                cache_artist_name(video_id, artist_name)
+
+                try:
+                    check_held()
+                    async with job_timings.measure("upload"):
+                        sent = await send_audio(bot, chat_id, audio_path, filename, video_id)
+                finally:
+                    # Cleanup audio file
+                    await _remove_file_if_exists(audio_path)
+
+            if not sent or not sent.audio:
+                return None
+            return FlightResult(sent.audio.file_id, "audio", filename, filename=filename, message=sent)
+
+        cache_key = media_key(url, "audio", "m4a")
         sent_message = None
-        if file_id:
-             # Reuse cached file_id
-             sent_message = await send_audio(bot, chat_id, file_id, filename, video_id)
-        elif audio_path:
-            artist_name = "Unknown"
-            if " - " in filename:
-                artist_name = filename.rsplit(" - ", 1)[1].replace(".m4a", "")
-            cache_artist_name(video_id, artist_name)
-
-            sent_message = await send_audio(bot, chat_id, audio_path, filename, video_id)
-        
-        if sent_message:
-            # Capture file_id and Cache
-            new_file_id = None
-            if sent_message.audio:
-                new_file_id = sent_message.audio.file_id
-            
-            if new_file_id:
-                url = f"https://www.youtube.com/watch?v={video_id}"
-                url_hash = sha256(url.encode()).hexdigest()
-                cache_data = {
-                    'path': audio_path if audio_path else "",
-                    'file_id': new_file_id,
-                    'filename': filename,
-                    'ts': int(time.time()),
-                    'type': 'audio'
-                }
-                await cache_media_result(url_hash, cache_data)
+        cached = await media_cache.get(cache_key)
+        if cached:
+            try:
+                sent_message = await send_audio(bot, chat_id, None, cached.filename, video_id, file_id=cached.file_id)
+            except Exception as e:
+                if not is_bad_file_id(e):
+                    raise
+                logger.warning(f"Cached file_id rejected for {cache_key}: {e}")
+                await media_cache.invalidate(cache_key)
+        if not sent_message:
+            result, is_leader = await single_flight.do(cache_key, lead)
+            sent_message = result.message if result else None
+            if result and is_leader:
+                await media_cache.put(cache_key, _cache_entry(result))
+            elif result:
+                sent_message = await send_audio(bot, chat_id, None, result.title, video_id, file_id=result.file_id)
 
+        if sent_message:
             if not is_media:
                 try:
                     await bot.delete_message(chat_id=chat_id, message_id=message_id)
                 except Exception:
                     pass
 
-            # Cleanup audio file
-            if audio_path:
-                await _remove_file_if_exists(audio_path)
-
             if status_message_id:
                 try:
                     await bot.delete_message(chat_id=chat_id, message_id=status_message_id)
@@ -312,6 +532,8 @@ async def _process_music_task_async(
                 is_media,
                 t("music_download_failed", lang)
             )
+    except LockLost:
+        logger.warning(f"Music task stopped, idempotency lock lost: {video_id}")
     except Exception as e:
         logger.error(f"Music task error: {e}")
         err_text = translate_error(str(e), lang)
@@ -321,6 +543,89 @@ async def _process_music_task_async(
     finally:
         await session.close()
 
+@job_store.resumable
+async def recognize_music_task(chat_id: int, video_id: str, status_message_id: int, resumed: bool = False) -> None:
+    """Videodagi musiqani aniqlash (Shazam) va YouTube'dan variantlarni ko'rsatish"""
+    bot, session = create_bot_session()
+    lang = get_user_lang_sync(chat_id)
+    stem = f"recog_{video_id}"
+    temp_audio = Path(TMP_DIR) / f"{stem}.mp3"
+
+    async def edit(text: str, **kwargs) -> None:
+        try:
+            await bot.edit_message_text(chat_id=chat_id, message_id=status_message_id, text=text, **kwargs)
+        except Exception:
+            pass
+
+    try:
+        await job_store.attach_stem(stem)
+        url = f"https://www.youtube.com/watch?v={video_id}"
+        ydl_opts = {
+            'format': 'bestaudio/best',
+            'outtmpl': str(Path(TMP_DIR) / f"{stem}.%(ext)s"),
+            # Cookie ISHLATMAYMIZ (IP mojarosi bo'lmasligi uchun), Android client bilan
+            'extractor_args': {
+                'youtube': {
+                    'player_client': ['android', 'ios'],
+                }
+            },
+            'http_headers': {
+                'User-Agent': 'Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
+            },
+            'quiet': True,
+            'no_warnings': True,
+            'ignoreerrors': True,
+            'nocheckcertificate': True,
+            # Majburan MP3 ga o'tkazish (Shazam uchun qulay)
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': '192',
+            }],
+        }
+        await edit(t("audio_loading_youtube", lang))
+        await ydl_executor.run(run_extract, "recognize", ydl_opts, url, True)
+
+        if not temp_audio.exists():
+            # Ba'zan yt-dlp formatni o'zgartirib yuborishi mumkin
+            temp_audio = next(Path(TMP_DIR).glob(f"{stem}.*"), None)
+            if temp_audio is None:
+                await edit(t("audio_download_failed", lang))
+                return
+
+        await edit(t("shazam_listening", lang))
+        out = await Shazam().recognize(str(temp_audio))
+        track = out.get('track', {})
+        title = track.get('title')
+        if not title:
+            await edit(t("shazam_not_found", lang))
+            return
+
+        search_query = f"{title} {track.get('subtitle')}"
+        await edit(t("shazam_found", lang, query=search_query), parse_mode='HTML')
+        results = await search_music(search_query)
+        if not results:
+            await edit(t("shazam_no_results", lang, query=search_query))
+            return
+
+        keyboard = [
+            [InlineKeyboardButton(text=f"⬇️ {res['title'][:30]}...", callback_data=f"music:{res['id']}")]
+            for res in results[:5]  # Maksimum 5 ta variant
+        ]
+        await edit(
+            t("choose_variant", lang, query=search_query),
+            parse_mode='HTML',
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
+        )
+    except Exception as e:
+        logger.error(f"Recognition error: {e}", exc_info=True)
+        await edit(t("system_error", lang))
+    finally:
+        if temp_audio:
+            await _remove_file_if_exists(str(temp_audio))
+        await session.close()
+
+
 async def _edit_or_reply_error(
     bot,
     chat_id: int,
@@ -1,10 +1,80 @@
+"""
+Celery worker tier (JOB_QUEUE=celery).
+
+The polling process (app.py) only enqueues: `utils.task_queue.WorkerPool`
+sends resumable jobs (`@job_store.resumable`) as `run_job(name, kwargs, ...)`
+through `CeleryQueue`, and `route_job` puts each one on the Celery queue
+named after its worker pool (ROUTES in `services.worker_pools`: video,
+music, recognize, default). Download / upload workers are separate
+processes, on any number of hosts:
+
+    celery -A tasks.celery_app worker -Q video -P threads -c 2 -n video@%h
+    celery -A tasks.celery_app worker -Q music,recognize,default -P threads -c 4 -n audio@%h
+
+Each worker process runs one asyncio loop in a background thread (Redis,
+yt-dlp executor and background tasks from `worker.setup()`); `-c` is the
+number of jobs running on it at once. Workers need the same Redis, Postgres
+and Bot API server as the bot (TELEGRAM_API_SERVER_URL - a local server
+lifts the 50 MB upload limit) and their own TMP_DIR / SCRATCH_BUDGET_MB;
+on one host, mount the same /dev/shm so `utils.cleanup` sees their files.
+
+Messages are msgpack, results are not stored. Delivery matches the stream
+queue (`services.job_queue`): acks_late, a job of a lost worker is
+redelivered after VISIBILITY_TIMEOUT and runs with `resumed=True`. Every
+delivery - retries and crash redeliveries alike - is counted in Redis
+(`jobs:deliveries:{task_id}`); a job delivered more than MAX_DELIVERIES
+times is dead-lettered to `jobs:dead` without running, as are jobs over the
+pool timeout; jobs older than MAX_JOB_AGE expire. A pool without a timeout
+(0) is capped at MAX_JOB_AGE here, so a running job is never redelivered. Queue position / ETA messages are not shown in this mode.
+
+The broker defaults to the bot's Redis (db 0), so a local Redis is enough.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+import msgpack
+import redis.asyncio as redis
 from celery import Celery
+from celery.signals import worker_process_shutdown, worker_shutdown
+
 from core.config import get_settings
+from services import metrics
+from services.job_queue import DEAD_LETTER_KEY, DEAD_LETTER_MAXLEN, MAX_DELIVERIES, MAX_JOB_AGE
+from services.job_store import current_job, job_store
+from services.job_timings import current_timing, job_timings, size_bucket
+from services.message_utils import report_job_timeout
+from services.scratch_budget import current_reservation, scratch_budget
+from services.worker_pools import DEFAULT_POOL, ROUTES, pool_specs
+
+logger = logging.getLogger(__name__)
 
 settings = get_settings()
 broker_url = settings.celery_broker_url or f"redis://{settings.redis_host}:{settings.redis_port}/0"
 result_backend = settings.celery_result_backend or broker_url
 
+RUN_JOB = "tasks.run_job"
+RETRY_DELAY = 5  # seconds
+DELIVERIES_KEY = "jobs:deliveries:{}"
+
+
+def _hard_limit(spec) -> float:
+    """Job'ning eng uzun ishlash vaqti; timeout 0 (cheklovsiz) bo'lsa ham MAX_JOB_AGE"""
+    return spec.timeout or MAX_JOB_AGE
+
+
+# Redis broker'da ack qilinmagan xabar shu vaqtdan keyin qayta yuboriladi - eng uzun job'dan katta bo'lsin
+VISIBILITY_TIMEOUT = max(_hard_limit(spec) for spec in pool_specs().values()) + 300
+
+
+def route_job(name, args, kwargs, options, task=None, **kw):
+    """run_job -> job pool'i nomidagi Celery navbati"""
+    if name == RUN_JOB and args:
+        return {"queue": ROUTES.get(args[0], DEFAULT_POOL)}
+    return None
+
+
 celery_app = Celery(
     'downloader_bot',
     broker=broker_url,
@@ -13,11 +83,198 @@ celery_app = Celery(
 )
 
 celery_app.conf.update(
-    task_serializer='json',
-    result_serializer='json',
-    accept_content=['json'],
+    task_serializer='msgpack',
+    result_serializer='msgpack',
+    accept_content=['msgpack'],
+    task_ignore_result=True,
     timezone='UTC',
     enable_utc=True,
-    worker_prefetch_multiplier=2,
+    # Job'lar uzun - bitta worker boshqalar bo'sh turganda navbat yig'ib olmasin
+    worker_prefetch_multiplier=1,
     task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    task_default_queue=DEFAULT_POOL,
+    task_routes=(route_job,),
+    broker_transport_options={'visibility_timeout': VISIBILITY_TIMEOUT},
 )
+
+
+class CeleryQueue:
+    """Bot tomoni: pool job'larini Celery worker'lariga yuborish"""
+
+    def __init__(self, pool: str):
+        self.pool = pool
+        self._client: redis.Redis | None = None
+
+    async def enqueue(self, name: str, kwargs: dict, scratch_bytes: int = 0, cost: float | None = None) -> str:
+        result = await asyncio.to_thread(
+            run_job.apply_async, (name, kwargs, scratch_bytes, round(time.time(), 3)), expires=MAX_JOB_AGE
+        )
+        metrics.incr("job_queue.enqueued")
+        return result.id
+
+    async def depth(self) -> int:
+        """Broker'da kutayotgan job'lar (ishlayotganlari kirmaydi); Redis bo'lmagan broker'da 0"""
+        if not broker_url.startswith(("redis://", "rediss://")):
+            return 0
+        if self._client is None:
+            self._client = redis.Redis.from_url(broker_url)
+        return await self._client.llen(self.pool)
+
+
+class _Runtime:
+    """Worker process'ining asyncio loop'i - alohida thread'da, barcha job'lar uchun bitta"""
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock()
+        self._background: list[asyncio.Task] = []
+        self.active = 0
+
+    def run(self, coro):
+        with self._lock:
+            if self._loop is None:
+                # Prefork'da har bir child process o'z loop'ini birinchi job'da ochadi
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="celery-loop", daemon=True).start()
+                self._background = asyncio.run_coroutine_threadsafe(self._setup(), loop).result()
+                self._loop = loop
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    @staticmethod
+    async def _setup() -> list[asyncio.Task]:
+        from worker import setup
+        background = await setup()
+        logger.info("✅ Redis connected, Celery worker process ready")
+        return background
+
+    def stop(self, **kwargs) -> None:
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        from worker import teardown
+        try:
+            asyncio.run_coroutine_threadsafe(teardown(self._background), loop).result(timeout=30)
+        except Exception as e:
+            logger.error(f"Celery worker teardown error: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+
+_runtime = _Runtime()
+worker_process_shutdown.connect(_runtime.stop)
+worker_shutdown.connect(_runtime.stop)
+
+
+async def _deliveries(job_id: str, fallback: int) -> int:
+    """Shu job necha marta yetkazilgani (worker o'lib qayta yuborilganlari ham)"""
+    from loader import redis_client
+    key = DELIVERIES_KEY.format(job_id)
+    try:
+        count = await redis_client.incr(key)
+        await redis_client.expire(key, MAX_JOB_AGE + VISIBILITY_TIMEOUT)
+        return max(count, fallback)
+    except Exception as e:
+        logger.warning(f"Job {job_id} delivery counter error: {e}")
+        return fallback
+
+
+async def _forget(job_id: str) -> None:
+    from loader import redis_client
+    try:
+        await redis_client.delete(DELIVERIES_KEY.format(job_id))
+    except Exception as e:
+        logger.warning(f"Job {job_id} delivery counter error: {e}")
+
+
+async def _dead_letter(job_id: str, name: str, kwargs: dict, scratch_bytes: int, reason: str) -> None:
+    from loader import redis_client
+    logger.warning(f"Job {job_id} ({name}) dead-lettered: {reason}")
+    await redis_client.xadd(
+        DEAD_LETTER_KEY,
+        {
+            "task": name,
+            "kwargs": msgpack.packb(kwargs),
+            "scratch": scratch_bytes,
+            "entry_id": job_id,
+            "reason": reason[:500],
+            "failed_at": int(time.time()),
+        },
+        maxlen=DEAD_LETTER_MAXLEN,
+        approximate=True,
+    )
+    await job_store.finish(job_id, cleanup=True)
+    await _forget(job_id)
+    metrics.incr("job_queue.dead_lettered")
+
+
+async def _execute(
+    job_id: str, name: str, kwargs: dict, scratch_bytes: int, enqueued_at: float, retries: int
+) -> Exception | None:
+    """Job'ni bajarish; qayta urinish kerak bo'lsa xatoni qaytaradi"""
+    func = job_store.task(name)
+    if func is None:
+        await _dead_letter(job_id, name, kwargs, scratch_bytes, f"unknown task {name!r}")
+        return None
+    deliveries = await _deliveries(job_id, retries + 1)
+    if deliveries > MAX_DELIVERIES:
+        # Worker'ni o'ldiradigan job - qayta-qayta yuborilmasin
+        await _dead_letter(job_id, name, kwargs, scratch_bytes, f"{deliveries - 1} failed deliveries")
+        return None
+    pool = ROUTES.get(name, DEFAULT_POOL)
+    specs = pool_specs()
+    timeout = _hard_limit(specs.get(pool) or specs[DEFAULT_POOL])
+    kwargs = dict(kwargs)
+    if await job_store.started_at([job_id]):
+        # Worker o'ldi, xabar qayta yuborildi
+        kwargs["resumed"] = True
+        metrics.incr("job_queue.resumed")
+
+    reservation = await scratch_budget.reserve(scratch_bytes)
+    waited = time.time() - enqueued_at
+    metrics.set_gauge(f"pool.{pool}.wait_ms", int(waited * 1000))
+    await job_store.start(job_id)
+    timing = (pool, size_bucket(scratch_bytes), _runtime.active)
+    await job_timings.record(*timing[:2], "wait", waited, timing[2])
+    token = current_reservation.set(reservation)
+    job_token = current_job.set(job_id)
+    timing_token = current_timing.set(timing)
+    _runtime.active += 1
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(func(**kwargs), timeout)
+    except asyncio.TimeoutError:
+        metrics.incr(f"pool.{pool}.timeouts")
+        await report_job_timeout(kwargs)
+        await _dead_letter(job_id, name, kwargs, scratch_bytes, f"timed out after {int(timeout)}s")
+        return None
+    except Exception as e:
+        logger.error(f"Job {job_id} ({name}) failed: {e}", exc_info=True)
+        metrics.incr("job_queue.failed")
+        if deliveries >= MAX_DELIVERIES:
+            await _dead_letter(job_id, name, kwargs, scratch_bytes, str(e) or type(e).__name__)
+            return None
+        # Qayta urinish yangi job sifatida boshlanadi (resumed emas)
+        await job_store.finish(job_id)
+        return e
+    else:
+        await job_timings.record(*timing[:2], "run", time.monotonic() - started, timing[2])
+    finally:
+        _runtime.active -= 1
+        current_timing.reset(timing_token)
+        current_job.reset(job_token)
+        current_reservation.reset(token)
+        reservation.release()
+    await job_store.finish(job_id)
+    await _forget(job_id)
+    metrics.incr("job_queue.done")
+    return None
+
+
+@celery_app.task(name=RUN_JOB, bind=True)
+def run_job(self, name: str, kwargs: dict, scratch_bytes: int = 0, enqueued_at: float = 0.0):
+    error = _runtime.run(
+        _execute(self.request.id, name, kwargs, scratch_bytes, enqueued_at or time.time(), self.request.retries)
+    )
+    if error is not None:
+        raise self.retry(exc=error, countdown=RETRY_DELAY, max_retries=MAX_DELIVERIES - 1)
@@ -0,0 +1,183 @@
+"""
+Per-job aria2c connection tuning.
+
+A 3 MB audio file does not need 16 connections, and 16 parallel ranges
+are exactly what gets a YouTube client throttled or 403'd. The tuner picks
+connections/split/min-split from the expected file size, capped by the
+recent error rate for the host, and prefers the connection count with the
+best measured throughput. Per-host history lives in the Redis hash
+`aria2_tune:{host}` (EWMA MB/s per connection count, EWMA error rate).
+
+Decisions and the resulting MB/s are logged as `aria2 tune ...` lines.
+"""
+import logging
+import math
+import random
+import time
+from dataclasses import dataclass, replace
+from typing import Callable
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+CONNECTION_TIERS = (1, 2, 4, 8, 16)
+# (fayl hajmi chegarasi, maksimal ulanishlar)
+SIZE_CAPS = (
+    (8 * 1024 * 1024, 2),
+    (64 * 1024 * 1024, 4),
+    (256 * 1024 * 1024, 8),
+)
+MIN_SPLIT_MB = 1
+MAX_SPLIT_MB = 64
+EWMA_ALPHA = 0.3
+MIN_SAMPLES = 3
+EXPLORE_RATE = 0.1
+BACKOFF_ERROR_RATE = 0.3
+HISTORY_TTL = 24 * 3600
+TUNED_PREFIXES = ("--max-connection-per-server=", "--split=", "--min-split-size=", "--max-download-limit=")
+
+
+@dataclass(frozen=True)
+class Aria2Plan:
+    connections: int
+    split: int
+    min_split_mb: int
+    reason: str
+
+    def args(self, base_args: list[str], rate_limit: int | None = None) -> list[str]:
+        """COMMON_OPTS'dagi argumentlarni shu reja bilan almashtirish"""
+        rest = [arg for arg in base_args if not arg.startswith(TUNED_PREFIXES)]
+        return [
+            f"--max-connection-per-server={self.connections}",
+            f"--split={self.split}",
+            f"--min-split-size={self.min_split_mb}M",
+            *([f"--max-download-limit={rate_limit}"] if rate_limit else []),
+            *rest,
+        ]
+
+    def capped(self, connections: int) -> "Aria2Plan":
+        """Governor kamroq ulanish bergan bo'lsa"""
+        if connections >= self.connections:
+            return self
+        return replace(self, connections=connections, split=connections, reason=f"{self.reason}+governor")
+
+
+def _size_cap(expected_bytes: int | None) -> int:
+    if not expected_bytes:
+        return CONNECTION_TIERS[-1] // 2
+    for limit, cap in SIZE_CAPS:
+        if expected_bytes < limit:
+            return cap
+    return CONNECTION_TIERS[-1]
+
+
+def _min_split_mb(expected_bytes: int | None, split: int) -> int:
+    if not expected_bytes:
+        return MIN_SPLIT_MB
+    per_piece = math.ceil(expected_bytes / split / (1024 * 1024))
+    # 2 ning darajasiga yaxlitlash
+    return max(MIN_SPLIT_MB, min(MAX_SPLIT_MB, 1 << max(0, per_piece - 1).bit_length()))
+
+
+class Aria2Tuner:
+    @staticmethod
+    def _redis():
+        from loader import redis_client
+        return redis_client
+
+    async def _load(self, host: str) -> dict[str, float]:
+        redis_client = self._redis()
+        if not redis_client:
+            return {}
+        try:
+            raw = await redis_client.hgetall(f"aria2_tune:{host}")
+        except Exception as e:
+            logger.error(f"aria2 tune load error: {e}")
+            return {}
+        return {
+            (k.decode() if isinstance(k, bytes) else k): float(v)
+            for k, v in raw.items()
+        }
+
+    async def plan(self, host: str, expected_bytes: int | None) -> Aria2Plan:
+        stats = await self._load(host)
+        cap = _size_cap(expected_bytes)
+        reason = "size"
+        error_rate = stats.get("error_rate", 0.0)
+        if error_rate > BACKOFF_ERROR_RATE:
+            # 403 / aria2c xatolari ko'p - kamroq parallel ulanish
+            cap = max(1, cap // (4 if error_rate > 2 * BACKOFF_ERROR_RATE else 2))
+            reason = f"backoff(err={error_rate:.2f})"
+
+        candidates = [n for n in CONNECTION_TIERS if n <= cap]
+        measured = {
+            n: stats[f"c{n}:mbps"]
+            for n in candidates
+            if stats.get(f"c{n}:samples", 0) >= MIN_SAMPLES and f"c{n}:mbps" in stats
+        }
+        connections = cap
+        if measured and random.random() >= EXPLORE_RATE:
+            best = max(measured, key=measured.get)
+            if best != cap:
+                connections = best
+                reason = f"{reason}+measured({measured[best]:.1f}MB/s)"
+        plan = Aria2Plan(connections, connections, _min_split_mb(expected_bytes, connections), reason)
+        size_mb = f"{expected_bytes / 1024 / 1024:.1f}MB" if expected_bytes else "?"
+        logger.info(
+            f"aria2 tune {host}: size={size_mb} -> connections={plan.connections} "
+            f"split={plan.split} min_split={plan.min_split_mb}M ({plan.reason})"
+        )
+        metrics.incr(f"aria2_tuner.connections.{plan.connections}")
+        return plan
+
+    async def record(self, host: str, plan: Aria2Plan, nbytes: int, seconds: float, ok: bool) -> None:
+        mbps = nbytes / 1024 / 1024 / seconds if ok and seconds > 0 and nbytes else None
+        if mbps is not None:
+            logger.info(f"aria2 tune {host}: connections={plan.connections} -> {mbps:.2f} MB/s ({nbytes} bytes)")
+        redis_client = self._redis()
+        if not redis_client:
+            return
+        key = f"aria2_tune:{host}"
+        try:
+            stats = await self._load(host)
+            error_rate = stats.get("error_rate", 0.0)
+            update = {"error_rate": (1 - EWMA_ALPHA) * error_rate + EWMA_ALPHA * (0.0 if ok else 1.0)}
+            if mbps is not None:
+                field = f"c{plan.connections}:mbps"
+                previous = stats.get(field)
+                update[field] = mbps if previous is None else (1 - EWMA_ALPHA) * previous + EWMA_ALPHA * mbps
+                update[f"c{plan.connections}:samples"] = stats.get(f"c{plan.connections}:samples", 0) + 1
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hset(key, mapping=update)
+            pipe.expire(key, HISTORY_TTL)
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"aria2 tune record error: {e}")
+
+
+class ThroughputMeter:
+    """yt-dlp progress hook'laridan yuklangan bayt va vaqtni yig'ish"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def wrap(self, progress_hook: Callable[[dict], None] | None) -> Callable[[dict], None]:
+        def hook(data: dict) -> None:
+            if data.get("status") == "finished":
+                self.bytes += data.get("total_bytes") or data.get("downloaded_bytes") or 0
+                self.seconds += data.get("elapsed") or 0
+            if progress_hook:
+                progress_hook(data)
+        return hook
+
+    def result(self, fallback_bytes: int = 0) -> tuple[int, float]:
+        if self.bytes and self.seconds:
+            return self.bytes, self.seconds
+        return fallback_bytes, time.monotonic() - self.started
+
+
+# Global instance
+aria2_tuner = Aria2Tuner()
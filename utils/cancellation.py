@@ -0,0 +1,235 @@
+"""
+Real cancellation for running downloads.
+
+`asyncio.wait_for` only abandons the await; the yt-dlp thread (or worker
+process) and its aria2c/ffmpeg children keep going. A `DownloadHandle`
+carries an event that the job's progress hook checks (cooperative abort),
+kills external downloader processes working on the job's files, and
+removes the `.part`/`.aria2` leftovers from TMP_DIR. On shutdown the
+leftovers are kept (aria2c gets SIGTERM so it saves its control file) and
+the persisted job continues from them after the restart. Only the real
+shutdown path counts as shutdown (`download_registry.shutting_down`, set
+by `TaskQueue.stop()` / `worker.teardown()`); a pool timeout also arrives
+as CancelledError and is cleaned up like any other abort.
+
+Jobs may run in another process (worker.py, Celery), so the Cancel button
+goes through Redis: `request_cancel` sets `cancel:{chat}:{message}` and
+publishes it on CANCEL_CHANNEL; every process runs `cancel_listener()` and
+cancels its matching handle, and a job that starts later checks the key
+(`check_remote`). Handles are re-checked after every (re)subscribe, since
+messages published meanwhile are lost.
+"""
+import asyncio
+import logging
+import os
+import signal
+import threading
+from pathlib import Path
+
+from loader import TMP_DIR
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+CANCEL_GRACE_SECONDS = 15
+CANCEL_CHANNEL = "downloads:cancel"
+CANCEL_KEY_TTL = 2 * 3600  # navbatdagi job'ning eng uzun yoshi
+RESUBSCRIBE_DELAY = 5  # seconds
+MAX_PENDING_CANCELS = 1000
+EXTERNAL_PROCESS_NAMES = ("aria2c", "ffmpeg")
+CANCELLED_ERROR = "❌ Yuklash bekor qilindi."
+TIMEOUT_ERROR = "❌ Yuklash vaqti tugadi. Keyinroq urinib ko'ring."
+
+
+class DownloadHandle:
+    def __init__(self, key: tuple[int, int] | None, stem: str | None = None, event=None):
+        self.key = key
+        self.stem = stem
+        # Process rejimida ydl_executor Manager Event beradi
+        self.event = event if event is not None else threading.Event()
+        self.reason: str | None = None
+        self._task: asyncio.Future | None = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def attach(self, task: asyncio.Future, stem: str | None = None) -> None:
+        self._task = task
+        if stem:
+            self.stem = stem
+
+    def cancel(self, reason: str = "user") -> None:
+        if self.cancelled:
+            return
+        self.reason = reason
+        self.event.set()
+        metrics.incr(f"downloads.cancelled.{reason}")
+        logger.info(f"Download cancelled ({reason}): {self.stem}")
+        if self.stem:
+            kill_external_processes(self.stem, self._signal)
+
+    @property
+    def _signal(self) -> int:
+        # SIGTERM'da aria2c .aria2 control faylini saqlaydi - restart'dan keyin davom etadi
+        return signal.SIGTERM if self.reason == "shutdown" else signal.SIGKILL
+
+    async def abort(self, reason: str) -> None:
+        """Bekor qilish, job tugashini kutish va qoldiq fayllarni o'chirish (shutdown'da qoldiriladi)"""
+        self.cancel(reason)
+        if self._task and not self._task.done():
+            await asyncio.wait({self._task}, timeout=CANCEL_GRACE_SECONDS)
+            if not self._task.done() and self.stem:
+                # Hook hali chaqirilmagan bo'lishi mumkin (masalan, merge bosqichi)
+                kill_external_processes(self.stem, self._signal)
+        if self.stem and self.reason != "shutdown":
+            await asyncio.to_thread(cleanup_partial_files, self.stem)
+
+    def error(self) -> Exception:
+        return Exception(TIMEOUT_ERROR if self.reason == "timeout" else CANCELLED_ERROR)
+
+
+def _arg_targets_stem(arg: str, stem: str) -> bool:
+    # --out=ID.mp4.part, -o ID.mp4.part yoki /dev/shm/tmp/ID.f137.mp4
+    return os.path.basename(arg.split("=", 1)[-1]).startswith(f"{stem}.")
+
+
+def kill_external_processes(stem: str, sig: int = signal.SIGKILL) -> int:
+    """aria2c/ffmpeg process'lari ichidan shu job fayllari bilan ishlayotganlarini o'ldirish"""
+    killed = 0
+    try:
+        pids = [p for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                args = f.read().decode(errors="ignore").split("\0")
+        except OSError:
+            continue
+        if not args or os.path.basename(args[0]) not in EXTERNAL_PROCESS_NAMES:
+            continue
+        if not any(_arg_targets_stem(arg, stem) for arg in args[1:]):
+            continue
+        try:
+            os.kill(int(pid), sig)
+            killed += 1
+        except OSError:
+            continue
+    if killed:
+        logger.info(f"Killed {killed} external downloader process(es) for {stem}")
+    return killed
+
+
+def cleanup_partial_files(stem: str, search_dir: str = TMP_DIR) -> int:
+    """`{stem}.*` fayllarini (.part, .aria2, .ytdl, .fNNN oraliq fayllar) o'chirish"""
+    removed = 0
+    for file in Path(search_dir).glob(f"{stem}.*"):
+        try:
+            file.unlink()
+            removed += 1
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            logger.error(f"Failed to remove partial file {file}: {e}")
+    return removed
+
+
+def _cancel_key(key: tuple[int, int]) -> str:
+    return f"cancel:{key[0]}:{key[1]}"
+
+
+class DownloadRegistry:
+    """Ishlayotgan yuklashlar: (chat_id, status_message_id) -> DownloadHandle"""
+
+    def __init__(self):
+        self._handles: dict[tuple[int, int], DownloadHandle] = {}
+        self._pending_cancels: set[tuple[int, int]] = set()
+        # Process to'xtatilmoqda - bekor qilingan job'lar fayllarini restart uchun qoldiradi
+        self.shutting_down = False
+
+    def register(self, handle: DownloadHandle) -> DownloadHandle:
+        if handle.key is None:
+            return handle
+        self._handles[handle.key] = handle
+        if handle.key in self._pending_cancels:
+            # Job navbatda turganida bekor qilingan
+            self._pending_cancels.discard(handle.key)
+            handle.cancel("user")
+        return handle
+
+    def unregister(self, handle: DownloadHandle) -> None:
+        if handle.key is not None and self._handles.get(handle.key) is handle:
+            del self._handles[handle.key]
+
+    def cancel(self, key: tuple[int, int]) -> bool:
+        handle = self._handles.get(key)
+        if handle:
+            handle.cancel("user")
+            return True
+        if len(self._pending_cancels) > MAX_PENDING_CANCELS:
+            self._pending_cancels.clear()
+        self._pending_cancels.add(key)
+        return False
+
+    @staticmethod
+    def _redis():
+        from loader import redis_client
+        return redis_client
+
+    async def request_cancel(self, key: tuple[int, int]) -> None:
+        """Cancel tugmasi: job qaysi process'da ishlasa ham bekor qilinadi"""
+        self.cancel(key)
+        redis_client = self._redis()
+        if not redis_client:
+            return
+        try:
+            await redis_client.set(_cancel_key(key), 1, ex=CANCEL_KEY_TTL)
+            await redis_client.publish(CANCEL_CHANNEL, f"{key[0]}:{key[1]}")
+        except Exception as e:
+            logger.error(f"Cancel publish error: {e}")
+
+    async def check_remote(self, handle: DownloadHandle) -> None:
+        """Job boshqa process'da (masalan navbatda turganida) bekor qilinganmi"""
+        redis_client = self._redis()
+        if handle.key is None or not redis_client:
+            return
+        try:
+            if await redis_client.exists(_cancel_key(handle.key)):
+                handle.cancel("user")
+        except Exception as e:
+            logger.error(f"Cancel check error: {e}")
+
+    async def cancel_listener(self) -> None:
+        """Boshqa process'larda bosilgan Cancel tugmalari"""
+        while True:
+            redis_client = self._redis()
+            if not redis_client:
+                return
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(CANCEL_CHANNEL)
+                for handle in list(self._handles.values()):
+                    await self.check_remote(handle)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = message["data"]
+                    chat_id, _, message_id = (data.decode() if isinstance(data, bytes) else data).partition(":")
+                    handle = self._handles.get((int(chat_id), int(message_id)))
+                    if handle:
+                        handle.cancel("user")
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Cancel listener error: {e}")
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+# Global instance
+download_registry = DownloadRegistry()
@@ -3,6 +3,7 @@ import os
 import time
 import logging
 from loader import TMP_DIR
+from services.job_store import job_store
 
 logger = logging.getLogger(__name__)
 
@@ -19,10 +20,14 @@ async def cleanup_worker():
             limit = 1800 # 30 daqiqa (sekundlarda)
             
             count = 0
+            # Restart'dan keyin davom etadigan job'larning qisman fayllari o'chirilmaydi
+            active_stems = await job_store.active_stems()
             # TMP_DIR ichidagi fayllarni tekshirish
             if os.path.exists(TMP_DIR):
                 for filename in os.listdir(TMP_DIR):
                     file_path = os.path.join(TMP_DIR, filename)
+                    if filename.split('.', 1)[0] in active_stems:
+                        continue
                     
                     # Faqat fayllarni tekshiramiz
                     if os.path.isfile(file_path):
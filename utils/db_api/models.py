@@ -1,4 +1,4 @@
-from sqlalchemy import BigInteger, String, DateTime
+from sqlalchemy import BigInteger, Float, Integer, String, DateTime, UniqueConstraint, Index
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.sql import func
 from .database import Base
@@ -59,3 +59,46 @@ class SupportTicket(Base):
 
     def __repr__(self):
         return f"<SupportTicket(id={self.id}, user_id={self.user_id})>"
+
+class MediaFile(Base):
+    """Telegram'ga yuklangan media: Redis kesh (media_cache:) uchun doimiy indeks"""
+    __tablename__ = 'media_files'
+    __table_args__ = (
+        UniqueConstraint('media_id', 'format', 'ext', name='uq_media_files_key'),
+        Index('ix_media_files_hit_count', 'hit_count'),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    media_id: Mapped[str] = mapped_column(String) # canonical_media_id: yt:ID, ig:CODE
+    format: Mapped[str] = mapped_column(String) # format selector yoki "audio"
+    ext: Mapped[str] = mapped_column(String)
+    file_id: Mapped[str] = mapped_column(String)
+    file_unique_id: Mapped[str] = mapped_column(String, nullable=True)
+    file_type: Mapped[str] = mapped_column(String, default="video") # video, document, audio
+    title: Mapped[str] = mapped_column(String, nullable=True)
+    filename: Mapped[str] = mapped_column(String, nullable=True)
+    size_bytes: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    hit_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    last_hit_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<MediaFile(media_id='{self.media_id}', format='{self.format}', hits={self.hit_count})>"
+
+class JobTiming(Base):
+    """Job bosqichlari davomiyligi (navbatda kutish, yuklash, jo'natish) - yuklamaga qarab tahlil uchun"""
+    __tablename__ = 'job_timings'
+    __table_args__ = (
+        Index('ix_job_timings_class_stage_created', 'job_class', 'stage', 'created_at'),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    job_class: Mapped[str] = mapped_column(String) # worker pool: video, music, recognize...
+    size_bucket: Mapped[str] = mapped_column(String) # s, m, l, xl
+    stage: Mapped[str] = mapped_column(String) # wait, download, upload, stream, run
+    seconds: Mapped[float] = mapped_column(Float)
+    load: Mapped[int] = mapped_column(Integer, default=0) # pool'dagi tugallanmagan job'lar
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<JobTiming({self.job_class}/{self.size_bucket} {self.stage}={self.seconds:.1f}s)>"
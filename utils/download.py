@@ -5,35 +5,38 @@ import logging
 import time
 from pathlib import Path
 from typing import Tuple, Optional, Callable, Dict, Any, Union
+from urllib.parse import parse_qs, urlparse
 import yt_dlp
 import msgpack
 from instagram_downloader import download_instagram_direct
-from loader import TMP_DIR, redis_client
+from loader import TMP_DIR
+from services import metrics
+from services.job_store import job_store
+from services.governor import INSTAGRAM_ORIGIN, YOUTUBE_ORIGIN, Lease, governor, origin_of
+from utils.cancellation import DownloadHandle, download_registry
+from utils.aria2_tuner import Aria2Plan, ThroughputMeter, aria2_tuner
+from utils.download_strategies import RETRYABLE_ERRORS, classify_error, domain_of, strategy_stats
+from utils.format_planner import estimate_format_size_bytes, is_storyboard, select_best_formats
+from utils.media_key import canonical_media_id
+from utils.ranged_fetch import CONTROL_SUFFIX, DEFAULT_PARTS, discard, fetch_ranges
 from utils.validation import is_instagram_url, is_youtube_url
+from utils.ydl_executor import ydl_executor
+from utils.ydl_pool import YtDlpLogger, run_extract
 
 logger = logging.getLogger(__name__)
 
 # --- CONFIG ---
-CACHE_TTL = 1800  # 30 minutes
+PROBE_INFO_EXPIRY_MARGIN = 600  # stream URL tugashidan oldin yuklash boshlanishi uchun zaxira
+PROBE_INFO_MAX_TTL = 3 * 3600
+PROBE_INFO_DROP_KEYS = (
+    'thumbnails', 'automatic_captions', 'subtitles', 'requested_subtitles',
+    'heatmap', 'chapters', 'description', 'tags', 'categories',
+)
 YTDLP_DOWNLOAD_TIMEOUT = 900  # seconds
-
-class _YtDlpLogger:
-    def debug(self, msg):
-        if not msg.startswith('[debug] '):
-            logger.debug(f"[yt-dlp] {msg}")
-
-    def info(self, msg):
-        logger.info(f"[yt-dlp] {msg}")
-
-    def warning(self, msg):
-        if "Requested format is not available" in str(msg):
-            return
-        logger.warning(f"[yt-dlp] {msg}")
-
-    def error(self, msg):
-        if "Requested format is not available" in str(msg):
-            return
-        logger.error(f"[yt-dlp] {msg}")
+DEFAULT_AUDIO_BYTES = 6 * 1024 * 1024  # aria2c sozlash uchun, hajm noma'lum bo'lsa
+# Bu xatolar aria2c ulanishlari soniga bog'liq bo'lishi mumkin
+ARIA2_ERROR_CLASSES = {"aria2c", "forbidden", "network"}
+PARTIAL_SUFFIXES = ('.part', '.aria2', '.ytdl', '.temp', CONTROL_SUFFIX)
 
 _COOKIE_FILE = os.getenv("YTDLP_COOKIE_FILE")
 
@@ -60,6 +63,7 @@ COMMON_OPTS = {
         '--timeout=60', # O'qish timeoutni oshirish
         '--retry-wait=5', # Xato bo'lsa 5 soniya kutib qayta urunish
         '--stream-piece-selector=random',# YouTube cheklovidan qochish uchun bo'laklarni random tanlash
+        '--auto-save-interval=10', # .aria2 control fayl - restart'dan keyin yuklash davom etadi
     ],
     # HTTP sozlamalari
     'buffersize': 1024 * 1024, # 1MB buffer (8GB RAM-da bu juda xavfsiz va tezroq)
@@ -70,317 +74,6 @@ COMMON_OPTS = {
 
 }
 
-TARGET_HEIGHTS = {144, 240, 360, 480, 720, 1080, 1440, 2160}
-MAX_FORMAT_SIZE_BYTES = 900 * 1024 * 1024  # 900MB
-VIDEO_CODEC_PRIORITY = {
-    "avc1": 3,
-    "vp9": 2,
-    "av01": 1,
-}
-
-
-def _video_codec_rank(vcodec: str | None) -> int:
-    if not vcodec:
-        return 0
-    for prefix, rank in VIDEO_CODEC_PRIORITY.items():
-        if vcodec.startswith(prefix):
-            return rank
-    return 0
-
-
-def _estimate_format_size_bytes(fmt: dict, duration: int | None) -> int | None:
-    size = fmt.get("filesize") or fmt.get("filesize_approx")
-    if size:
-        return int(size)
-    tbr = fmt.get("tbr")  # kbps
-    if tbr and duration:
-        return int(tbr * 1000 / 8 * duration)
-    return None
-
-
-def _is_storyboard(fmt: dict) -> bool:
-    return fmt.get("ext") == "mhtml" or (fmt.get("format_id") or "").startswith("sb")
-
-
-def _pick_better_format(current: dict | None, candidate: dict) -> dict:
-    if not current:
-        return candidate
-    current_rank = _video_codec_rank(current.get("vcodec"))
-    candidate_rank = _video_codec_rank(candidate.get("vcodec"))
-    if candidate_rank != current_rank:
-        return candidate if candidate_rank > current_rank else current
-    if (candidate.get("tbr") or 0) > (current.get("tbr") or 0):
-        return candidate
-    return current
-
-
-def _select_best_formats(info: dict) -> list[dict]:
-    formats = info.get("formats") or []
-    duration = info.get("duration")
-    best_progressive: dict[int, dict] = {}
-    best_dash: dict[int, dict] = {}
-
-    for fmt in formats:
-        height = fmt.get("height")
-        if not height or height not in TARGET_HEIGHTS:
-            continue
-        if _is_storyboard(fmt):
-            continue
-
-        vcodec = fmt.get("vcodec")
-        if not vcodec or vcodec == "none":
-            continue
-
-        size = _estimate_format_size_bytes(fmt, duration)
-        if size and size > MAX_FORMAT_SIZE_BYTES:
-            continue
-
-        acodec = fmt.get("acodec")
-        has_audio = acodec and acodec != "none"
-        if has_audio:
-            best_progressive[height] = _pick_better_format(best_progressive.get(height), fmt)
-        else:
-            best_dash[height] = _pick_better_format(best_dash.get(height), fmt)
-
-    items: list[dict] = []
-    for height in sorted(TARGET_HEIGHTS):
-        fmt = best_progressive.get(height) or best_dash.get(height)
-        if not fmt:
-            continue
-        size_bytes = _estimate_format_size_bytes(fmt, duration) or 0
-        is_merge = 0 if (fmt.get("acodec") and fmt.get("acodec") != "none") else 1
-        note = "progressive" if is_merge == 0 else "dash_video_only_merge_audio"
-        ext = fmt.get("ext") or "mp4"
-        items.append({
-            "height": height,
-            "format_id": fmt.get("format_id"),
-            "is_merge": is_merge,
-            "ext": ext,
-            "size_bytes": size_bytes,
-            "size_mb_est": round(size_bytes / (1024 * 1024), 1) if size_bytes else 0.0,
-            "note": note,
-        })
-
-    if not items:
-        for fmt in formats:
-            if fmt.get("format_id") == "18":
-                size_bytes = _estimate_format_size_bytes(fmt, duration) or 0
-                items.append({
-                    "height": 360,
-                    "format_id": "18",
-                    "is_merge": 0,
-                    "ext": fmt.get("ext") or "mp4",
-                    "size_bytes": size_bytes,
-                    "size_mb_est": round(size_bytes / (1024 * 1024), 1) if size_bytes else 0.0,
-                    "note": "progressive",
-                })
-                break
-
-    return items
-
-
-def _yt_info_opts(include_manifests: bool, extractor_args: dict | None = None) -> dict:
-    user_agent = COMMON_OPTS.get("user_agent") or COMMON_OPTS.get("user-agent")
-    return {
-        'quiet': True,
-        'no_warnings': True,
-        'ignoreerrors': True,
-        'skip_download': True,
-        'noplaylist': True,
-        'socket_timeout': 10,
-        'retries': 2,
-        'extractor_retries': 2,
-        'youtube_include_dash_manifest': include_manifests,
-        'youtube_include_hls_manifest': include_manifests,
-        'user_agent': user_agent,
-        'http_headers': {
-            'User-Agent': user_agent,
-        },
-        'extractor_args': extractor_args or {},
-    }
-
-
-def _extract_info_fast(url: str, opts: dict) -> dict | None:
-    with yt_dlp.YoutubeDL(opts) as ydl:
-        return ydl.extract_info(url, download=False)
-
-
-async def fetch_youtube_formats_fast(url: str) -> dict | None:
-    """
-    Fast YouTube format detection with yt-dlp metadata only.
-    Returns schema:
-    {
-      "id": "", "title": "", "uploader": "", "thumbnail": "", "duration": 0,
-      "items": [ ... ]
-    }
-    """
-    info = None
-    try:
-        fast_opts = _yt_info_opts(include_manifests=False)
-        info = await asyncio.wait_for(
-            asyncio.to_thread(_extract_info_fast, url, fast_opts),
-            timeout=15
-        )
-    except yt_dlp.utils.DownloadError as e:
-        err = str(e).lower()
-        if "403" not in err and "forbidden" not in err:
-            info = None
-    except Exception:
-        info = None
-
-    if not info or not info.get("formats"):
-        try:
-            fallback_opts = _yt_info_opts(
-                include_manifests=True,
-                extractor_args={
-                    "youtube": {
-                        "player_client": ["android", "web"],
-                    }
-                }
-            )
-            info = await asyncio.wait_for(
-                asyncio.to_thread(_extract_info_fast, url, fallback_opts),
-                timeout=20
-            )
-        except Exception:
-            info = None
-
-    if not info:
-        return None
-
-    items = _select_best_formats(info)
-    return {
-        "id": info.get("id"),
-        "title": info.get("title"),
-        "uploader": info.get("uploader"),
-        "thumbnail": info.get("thumbnail"),
-        "duration": info.get("duration") or 0,
-        "items": items,
-    }
-
-
-# --- YOUTUBE CONFIG & HELPERS ---
-TARGET_HEIGHTS = {144, 240, 360, 480, 720, 1080, 1440, 2160}
-MAX_FORMAT_SIZE_BYTES = 900 * 1024 * 1024  # 900MB
-VIDEO_CODEC_PRIORITY = {
-    "av01": 3,
-    "vp9": 2,
-    "avc1": 1,
-}
-
-def _video_codec_rank(vcodec: str | None) -> int:
-    if not vcodec:
-        return 0
-    for prefix, rank in VIDEO_CODEC_PRIORITY.items():
-        if vcodec.startswith(prefix):
-            return rank
-    return 0
-
-def _estimate_format_size_bytes(fmt: dict, duration: int | None) -> int | None:
-    size = fmt.get("filesize") or fmt.get("filesize_approx")
-    if size:
-        return int(size)
-    tbr = fmt.get("tbr")  # kbps
-    if tbr and duration:
-        return int(tbr * 1000 / 8 * duration)
-    return None
-
-def _is_storyboard(fmt: dict) -> bool:
-    return fmt.get("ext") == "mhtml" or (fmt.get("format_id") or "").startswith("sb")
-
-def _pick_better_format(current: dict | None, candidate: dict) -> dict:
-    if not current:
-        return candidate
-    current_rank = _video_codec_rank(current.get("vcodec"))
-    candidate_rank = _video_codec_rank(candidate.get("vcodec"))
-    if candidate_rank != current_rank:
-        return candidate if candidate_rank > current_rank else current
-    if (candidate.get("tbr") or 0) > (current.get("tbr") or 0):
-        return candidate
-    return current
-
-def _select_best_formats(info: dict) -> list[dict]:
-    formats = info.get("formats") or []
-    duration = info.get("duration")
-    best_progressive: dict[int, dict] = {}
-    best_dash: dict[int, dict] = {}
-
-    for fmt in formats:
-        height = fmt.get("height")
-        if not height or height not in TARGET_HEIGHTS:
-            continue
-        if _is_storyboard(fmt):
-            continue
-
-        vcodec = fmt.get("vcodec")
-        if not vcodec or vcodec == "none":
-            continue
-
-        size = _estimate_format_size_bytes(fmt, duration)
-        if size and size > MAX_FORMAT_SIZE_BYTES:
-            continue
-
-        acodec = fmt.get("acodec")
-        has_audio = acodec and acodec != "none"
-        if has_audio:
-            best_progressive[height] = _pick_better_format(best_progressive.get(height), fmt)
-        else:
-            best_dash[height] = _pick_better_format(best_dash.get(height), fmt)
-
-    items: list[dict] = []
-    for height in sorted(TARGET_HEIGHTS):
-        prog = best_progressive.get(height)
-        dash = best_dash.get(height)
-        
-        # Priority: Progressive > DASH (if prog exists)
-        # Requirement: "If progressive... prefer this".
-        # Note: If high quality is only DASH, we take DASH.
-        # But if 360p is both, we take Progressive.
-        
-        final_fmt = None
-        is_merge = 0
-        note = ""
-
-        if prog:
-            final_fmt = prog
-            is_merge = 0
-            note = "progressive"
-        elif dash:
-            final_fmt = dash
-            is_merge = 1
-            note = "dash_video_only_merge_audio"
-        
-        if not final_fmt:
-            continue
-
-        size_bytes = _estimate_format_size_bytes(final_fmt, duration) or 0
-        ext = final_fmt.get("ext") or "mp4"
-        items.append({
-            "height": height,
-            "format_id": final_fmt.get("format_id"),
-            "is_merge": is_merge,
-            "ext": ext,
-            "size_bytes": size_bytes,
-            "size_mb_est": round(size_bytes / (1024 * 1024), 1) if size_bytes else 0.0,
-            "note": note,
-        })
-
-    if not items:
-        # Fallback 18
-        for fmt in formats:
-            if fmt.get("format_id") == "18":
-                size_bytes = _estimate_format_size_bytes(fmt, duration) or 0
-                items.append({
-                    "height": 360,
-                    "format_id": "18",
-                    "is_merge": 0,
-                    "ext": fmt.get("ext") or "mp4",
-                    "size_bytes": size_bytes,
-                    "size_mb_est": round(size_bytes / (1024 * 1024), 1) if size_bytes else 0.0,
-                    "note": "progressive",
-                })
-                break
-    return items
 
 def _yt_info_opts(include_manifests: bool, extractor_args: dict | None = None) -> dict:
     user_agent = COMMON_OPTS.get("user_agent")
@@ -402,13 +95,6 @@ def _yt_info_opts(include_manifests: bool, extractor_args: dict | None = None) -
         'extractor_args': extractor_args or {},
     }
 
-def _extract_info_fast(url: str, opts: dict) -> dict | None:
-    try:
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            return ydl.extract_info(url, download=False)
-    except Exception:
-        return None
-
 async def fetch_youtube_formats_fast(url: str) -> dict | None:
     """
     Fast YouTube format detection with yt-dlp metadata only.
@@ -417,7 +103,7 @@ async def fetch_youtube_formats_fast(url: str) -> dict | None:
     try:
         fast_opts = _yt_info_opts(include_manifests=False)
         info = await asyncio.wait_for(
-            asyncio.to_thread(_extract_info_fast, url, fast_opts),
+            ydl_executor.run(run_extract, "info", fast_opts, url, False),
             timeout=15
         )
     except Exception:
@@ -434,7 +120,7 @@ async def fetch_youtube_formats_fast(url: str) -> dict | None:
                 }
             )
             info = await asyncio.wait_for(
-                asyncio.to_thread(_extract_info_fast, url, fallback_opts),
+                ydl_executor.run(run_extract, "info", fallback_opts, url, False),
                 timeout=20
             )
         except Exception:
@@ -443,7 +129,8 @@ async def fetch_youtube_formats_fast(url: str) -> dict | None:
     if not info:
         return None
 
-    items = _select_best_formats(info)
+    await store_probe_info(url, info)
+    items = select_best_formats(info)
     return {
         "id": info.get("id"),
         "title": info.get("title"),
@@ -486,116 +173,307 @@ def _map_download_error(err_msg: str, media_type: str) -> Exception:
 
 def _find_downloaded_file(search_dir: Path, prefix: str) -> Optional[Path]:
     for file in search_dir.glob(f"{prefix}.*"):
-        if file.is_file() and not file.name.endswith('.part'):
+        if file.is_file() and not file.name.endswith(PARTIAL_SUFFIXES):
             return file
     return None
 
-# --- CACHE UTILS ---
 
-async def get_cached_media(url_hash: str) -> Optional[Dict[str, Any]]:
+async def _run_ydl_download(
+    profile: str,
+    opts: dict,
+    url: str,
+    handle: DownloadHandle,
+    progress_hook: Optional[Callable[[dict], None]] = None,
+    info: dict | None = None,
+) -> dict | None:
+    """
+    yt-dlp yuklashini bekor qilinadigan qilib ishga tushirish.
+    Timeout yoki bekor qilishda job haqiqatan to'xtatiladi va qoldiq fayllar o'chiriladi.
+    """
+    if handle.cancelled:
+        raise handle.error()
+    task = asyncio.ensure_future(
+        ydl_executor.run(run_extract, profile, opts, url, True, handle.event, info, progress_hook=progress_hook)
+    )
+    handle.attach(task, stem=Path(str(opts['outtmpl'])).name.split('.')[0])
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout=YTDLP_DOWNLOAD_TIMEOUT)
+    except asyncio.TimeoutError:
+        await handle.abort("timeout")
+        raise handle.error()
+    except asyncio.CancelledError:
+        # Pool timeout ham CancelledError bilan keladi - fayllar faqat shutdown'da qoldiriladi
+        await handle.abort("shutdown" if download_registry.shutting_down else "timeout")
+        raise
+    except (yt_dlp.utils.DownloadCancelled, yt_dlp.utils.DownloadError):
+        if handle.cancelled:
+            # aria2c o'ldirilganda ham DownloadError keladi
+            await handle.abort(handle.reason or "user")
+            raise handle.error()
+        raise
+
+def _apply_lease(opts: dict, plan: Aria2Plan, lease: Lease) -> tuple[dict, Aria2Plan]:
+    """Governor bergan ulanishlar soni va tezlik ulushi bilan shu urinish uchun opsiyalar (opts o'zgarmaydi)"""
+    plan = plan.capped(lease.connections)
+    rate = lease.rate_limit()
+    lease_opts = {
+        **opts,
+        'external_downloader_args': plan.args(COMMON_OPTS['external_downloader_args'], rate),
+        'ratelimit': rate or None,
+    }
+    return lease_opts, plan
+
+
+async def _download_with_probe_info(
+    opts: dict,
+    url: str,
+    handle: DownloadHandle,
+    progress_hook: Optional[Callable[[dict], None]],
+    probe_info: dict | None,
+) -> dict | None:
+    if probe_info is not None:
+        try:
+            result = await _run_ydl_download("video", opts, url, handle, progress_hook, info=probe_info)
+            metrics.incr("probe_info.hit")
+            return result
+        except yt_dlp.utils.DownloadError as e:
+            # Masalan, URL boshqa IP uchun berilgan - to'liq extract bilan qayta urinamiz
+            logger.warning(f"Download from probe info failed, re-extracting: {e}")
+            metrics.incr("probe_info.fallback")
+    return await _run_ydl_download("video", opts, url, handle, progress_hook)
+
+def _stream_url_expiry(info: dict) -> int | None:
+    """Format URL'laridagi eng yaqin `expire=` vaqti (YouTube ~6 soat beradi)"""
+    expiries = []
+    for fmt in info.get("formats") or []:
+        value = parse_qs(urlparse(fmt.get("url") or "").query).get("expire")
+        if value and value[0].isdigit():
+            expiries.append(int(value[0]))
+    return min(expiries) if expiries else None
+
+
+def _slim_probe_info(info: dict) -> dict:
+    """Yuklash uchun kerak bo'lmagan og'ir maydonlar va storyboard'larsiz info dict"""
+    slim = {k: v for k, v in yt_dlp.YoutubeDL.sanitize_info(info).items() if k not in PROBE_INFO_DROP_KEYS}
+    if slim.get("formats"):
+        slim["formats"] = [fmt for fmt in slim["formats"] if not is_storyboard(fmt)]
+    return slim
+
+
+async def store_probe_info(url: str, info: dict) -> None:
     """
-    Redis'dan keshni o'qish. 
-    Key format: media_cache:{bucket_id} -> field: {full_hash}
-    Value: MessagePack compressed bytes
+    Format probe natijasini yuklash bosqichi uchun saqlash.
+    TTL stream URL'lari amal qilish muddatiga moslanadi.
     """
-    if not redis_client:
+    from loader import redis_client
+    if not redis_client or not is_youtube_url(url) or not info.get("formats"):
+        return
+    expiry = _stream_url_expiry(info)
+    if not expiry:
+        return
+    ttl = min(expiry - int(time.time()) - PROBE_INFO_EXPIRY_MARGIN, PROBE_INFO_MAX_TTL)
+    if ttl <= 0:
+        return
+    try:
+        packed = msgpack.packb(await asyncio.to_thread(_slim_probe_info, info))
+        await redis_client.setex(f"yt_probe_info:{canonical_media_id(url)}", ttl, packed)
+    except Exception as e:
+        logger.error(f"Probe info cache error: {e}")
+
+
+async def load_probe_info(url: str) -> dict | None:
+    from loader import redis_client
+    if not redis_client or not is_youtube_url(url):
         return None
-        
-    bucket = f"media_cache:{url_hash[:4]}"
     try:
-        data = await redis_client.hget(bucket, url_hash)
+        data = await redis_client.get(f"yt_probe_info:{canonical_media_id(url)}")
         if data:
             return msgpack.unpackb(data)
     except Exception as e:
-        logger.error(f"Cache get error: {e}")
+        logger.error(f"Probe info load error: {e}")
     return None
 
-async def cache_media_result(url_hash: str, data: Dict[str, Any]):
+
+async def resolve_progressive_stream(url: str, format_selector: Optional[str]) -> Optional[Dict[str, Any]]:
     """
-    Natijani Redis'ga siqilgan holda yozish va TTL ni yangilash.
+    Progressive (audio+video bitta mp4) format uchun to'g'ridan-to'g'ri stream ma'lumoti.
+    Format probe info'si (yt_probe_info:) yangi bo'lsagina qaytadi.
     """
-    if not redis_client:
-        return
-        
-    bucket = f"media_cache:{url_hash[:4]}"
-    packed = msgpack.packb(data)
-    try:
-        await redis_client.hset(bucket, url_hash, packed)
-        # Butun bucket uchun TTL yangilanadi (oddiy va samarali)
-        await redis_client.expire(bucket, CACHE_TTL)
-    except Exception as e:
-        logger.error(f"Cache set error: {e}")
+    if not format_selector or not is_youtube_url(url):
+        return None
+    info = await load_probe_info(url)
+    if not info:
+        return None
+    fmt = next((f for f in info.get("formats") or [] if f.get("format_id") == format_selector), None)
+    if not fmt or not fmt.get("url") or fmt.get("ext") != "mp4":
+        return None
+    if fmt.get("protocol") not in ("http", "https"):
+        return None
+    if fmt.get("vcodec") in (None, "none") or fmt.get("acodec") in (None, "none"):
+        return None
+    return {
+        "url": fmt["url"],
+        "http_headers": fmt.get("http_headers") or {},
+        "filesize": fmt.get("filesize"),
+        "width": fmt.get("width"),
+        "height": fmt.get("height"),
+        "duration": int(info["duration"]) if info.get("duration") else None,
+        "title": info.get("title") or "Video",
+    }
 
 
-async def download_audio(video_id: str, chat_id: int) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+async def resolve_audio_stream(url: str) -> Optional[Dict[str, Any]]:
+    """
+    Eng yaxshi m4a audio stream URL'i. Probe info keshda bo'lmasa bitta
+    metadata extract qilinadi va keyingi so'rovlar uchun saqlanadi.
+    """
+    info = await load_probe_info(url)
+    if not info:
+        info = await asyncio.wait_for(
+            ydl_executor.run(run_extract, "info", _yt_info_opts(include_manifests=False), url, False),
+            timeout=15
+        )
+        if not info:
+            return None
+        await store_probe_info(url, info)
+    audio = [
+        f for f in info.get("formats") or []
+        if f.get("vcodec") == "none" and f.get("ext") == "m4a" and f.get("url")
+        and f.get("protocol") in ("http", "https")
+    ]
+    if not audio:
+        return None
+    fmt = max(audio, key=lambda f: f.get("abr") or f.get("tbr") or 0)
+    return {
+        "url": fmt["url"],
+        "http_headers": fmt.get("http_headers") or {},
+        "filesize": fmt.get("filesize"),
+        "ext": fmt["ext"],
+        "title": info.get("title") or "Audio",
+        "uploader": info.get("uploader") or "Unknown",
+    }
+
+
+def _expected_download_bytes(probe_info: dict | None, format_selector: Optional[str]) -> int | None:
+    """aria2c sozlash uchun: tanlangan format(lar)ning taxminiy hajmi"""
+    if not probe_info or not format_selector:
+        return None
+    formats = probe_info.get("formats") or []
+    duration = probe_info.get("duration")
+    audio = [
+        f for f in formats
+        if f.get("vcodec") == "none" and f.get("acodec") not in (None, "none") and f.get("ext") == "m4a"
+    ]
+    best_audio = max(audio, key=lambda f: f.get("abr") or 0) if audio else None
+    if format_selector.startswith("bestaudio"):
+        return estimate_format_size_bytes(best_audio, duration) if best_audio else None
+    video_id = format_selector.split("+", 1)[0].split("/", 1)[0]
+    fmt = next((f for f in formats if f.get("format_id") == video_id), None)
+    if not fmt:
+        return None
+    total = estimate_format_size_bytes(fmt, duration) or 0
+    if "+" in format_selector and best_audio:
+        total += estimate_format_size_bytes(best_audio, duration) or 0
+    return total or None
+
+
+async def download_audio(
+    video_id: str,
+    chat_id: int,
+    handle: Optional[DownloadHandle] = None,
+    stem: Optional[str] = None
+) -> Tuple[Optional[str], Optional[str]]:
     """
     Music yuklab olish - MP3/M4A
-    Returns: (file_path, filename, file_id)
+    Returns: (file_path, filename). file_id keshi media_cache orqali task darajasida tekshiriladi.
+    stem: TMP_DIR'dagi fayl nomi prefiksi (prefetch o'z nomini beradi).
     """
     url = f"https://www.youtube.com/watch?v={video_id}"
-    url_hash = hashlib.md5(url.encode()).hexdigest()
-    
-    # 1. Keshni tekshirish
-    cached = await get_cached_media(url_hash)
-    if cached:
-        cached_path = cached.get('path')
-        cached_file_id = cached.get('file_id')
-        
-        # Agar file_id bo'lsa, fayl shart emas (Telegramdan qayta yuboramiz)
-        if cached_file_id:
-            logger.info(f"Using cached file_id for audio: {video_id}")
-            return None, cached.get('filename', 'audio.m4a'), cached_file_id
-            
-        # Agar fayl diskda bo'lsa
-        if cached_path and await _path_exists(cached_path):
-            logger.info(f"Using cached file for audio: {video_id}")
-            return cached_path, cached.get('filename', 'audio.m4a'), None
 
+    # Har bir chat o'z faylini oladi: bir task boshqasi yuklayotgan faylni o'chirib yubormasin
+    stem = stem or f"{video_id}_{chat_id}"
     ydl_opts = {
         **COMMON_OPTS,
         'quiet': False,
-        'logger': _YtDlpLogger(),
+        'logger': YtDlpLogger(),
         'format': 'bestaudio[ext=m4a]/bestaudio/best',
-        'outtmpl': str(Path(TMP_DIR) / f"{video_id}.%(ext)s"),
+        'outtmpl': str(Path(TMP_DIR) / f"{stem}.%(ext)s"),
     }
 
     title = "Audio"
     author = "Unknown"
+    handle = handle or DownloadHandle(None)
+    handle.stem = stem
+    await job_store.attach_stem(stem)
+
+    # Tezkor yo'l: stream URL'ni to'g'ridan-to'g'ri parallel Range'lar bilan olish
+    try:
+        stream = await resolve_audio_stream(url)
+        if stream:
+            output = Path(TMP_DIR) / f"{stem}.{stream['ext']}"
+            started = time.monotonic()
+            try:
+                async with governor.lease(YOUTUBE_ORIGIN, DEFAULT_PARTS) as lease:
+                    nbytes = await fetch_ranges(
+                        stream["url"], output, stream["filesize"], stream["http_headers"],
+                        parts=lease.connections, should_stop=lambda: handle.cancelled, throttle=lease.throttle,
+                    )
+            except asyncio.CancelledError:
+                if not download_registry.shutting_down:
+                    # Pool timeout - qoldiq fayl restart'da davom ettirilmaydi
+                    discard(output)
+                raise
+            logger.info(f"Audio fast path: {nbytes} bytes in {time.monotonic() - started:.2f}s ({video_id})")
+            metrics.incr("audio_fast_path.ok")
+            clean_title = f"{stream['title']} - {stream['uploader']}".replace('/', '-').replace('\\', '-')
+            return str(output), f"{clean_title}{output.suffix}"
+    except Exception as e:
+        if handle.cancelled:
+            raise handle.error()
+        logger.warning(f"Audio fast path failed, falling back to yt-dlp: {e}")
+        metrics.incr("audio_fast_path.fallback")
+
+    # Tezkor yo'lning tugallanmagan fayli qolgan bo'lsa - yt-dlp uni tayyor fayl deb o'ylamasin
+    for control in Path(TMP_DIR).glob(f"{stem}.*{CONTROL_SUFFIX}"):
+        discard(control.with_name(control.name[:-len(CONTROL_SUFFIX)]))
+
+    meter = ThroughputMeter()
+    aria2_plan = await aria2_tuner.plan(
+        "youtube.com", _expected_download_bytes(await load_probe_info(url), "bestaudio") or DEFAULT_AUDIO_BYTES
+    )
 
     try:
         logger.info(f"Downloading Audio (Fast Mode): {url}")
         
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = await asyncio.wait_for(
-                    asyncio.to_thread(ydl.extract_info, url, download=True),
-                    timeout=YTDLP_DOWNLOAD_TIMEOUT
-                )
-                if info:
-                    title = info.get('title', 'Audio')
-                    author = info.get('uploader', 'Unknown')
-        except asyncio.TimeoutError:
-            raise Exception("❌ Yuklash vaqti tugadi. Keyinroq urinib ko'ring.")
+            async with governor.lease(YOUTUBE_ORIGIN, aria2_plan.connections) as lease:
+                lease_opts, aria2_plan = _apply_lease(ydl_opts, aria2_plan, lease)
+                info = await _run_ydl_download("audio", lease_opts, url, handle, meter.wrap(None))
+                lease.record(meter.bytes)
+            if info:
+                title = info.get('title', 'Audio')
+                author = info.get('uploader', 'Unknown')
         except yt_dlp.utils.DownloadError as e:
+            if classify_error(str(e)) in ARIA2_ERROR_CLASSES:
+                await aria2_tuner.record("youtube.com", aria2_plan, 0, 0, ok=False)
             raise _map_download_error(str(e).lower(), "audio")
 
         clean_title = f"{title} - {author}".replace('/', '-').replace('\\', '-')
         
-        downloaded_file = _find_downloaded_file(Path(TMP_DIR), video_id)
+        downloaded_file = _find_downloaded_file(Path(TMP_DIR), stem)
         
         if downloaded_file:
             filename = f"{clean_title}{downloaded_file.suffix}"
+            nbytes, seconds = meter.result(downloaded_file.stat().st_size)
+            await aria2_tuner.record("youtube.com", aria2_plan, nbytes, seconds, ok=True)
             
-            # Keshga yozib qo'yamiz (hozircha fayl ID yo'q, u yuborilgandan keyin queue_worker'da qo'shilishi mumkin, 
-            # yoki shunchaki path ni saqlaymiz)
-            # Lekin eng muhimi queue_worker da update qilish.
-            return str(downloaded_file), filename, None
+            return str(downloaded_file), filename
             
     except Exception as e:
         logger.error(f"Audio download error: {e}")
         raise e 
         
-    return None, None, None
+    return None, None
 
 
 async def download_video(
@@ -603,32 +481,29 @@ async def download_video(
     chat_id: int,
     format_selector: Optional[str] = None,
     output_ext: Optional[str] = None,
-    progress_hook: Optional[Callable[[dict], None]] = None
-) -> Tuple[Optional[str], Optional[str], Optional[str]]: # Returns (path, file_id, title)
-    """Video yuklab olish"""
+    progress_hook: Optional[Callable[[dict], None]] = None,
+    handle: Optional[DownloadHandle] = None,
+    stem: Optional[str] = None
+) -> Tuple[Optional[str], Optional[str]]: # Returns (path, title)
+    """Video yuklab olish. stem: TMP_DIR'dagi fayl nomi prefiksi (prefetch o'z nomini beradi)"""
+    handle = handle or DownloadHandle(None)
     
     url_hash = hashlib.md5(url.encode()).hexdigest()
     
-    # 1. Keshni tekshirish
-    cached = await get_cached_media(url_hash)
-    if cached:
-        cached_file_id = cached.get('file_id')
-        if cached_file_id:
-            logger.info(f"Using cached file_id for video: {url}")
-            return None, cached_file_id
-            
-        cached_path = cached.get('path')
-        if cached_path and await _path_exists(cached_path):
-            logger.info(f"Using cached file for video: {url}")
-            return cached_path, None
-    
-    temp_file = Path(TMP_DIR) / f"{url_hash[:12]}_{chat_id}.mp4"
+    temp_file = Path(TMP_DIR) / f"{stem or f'{url_hash[:12]}_{chat_id}'}.mp4"
+    handle.stem = temp_file.stem
+    await job_store.attach_stem(temp_file.stem)
     
     try:
+        if handle.cancelled:
+            raise handle.error()
         if is_instagram_url(url):
             result = await download_instagram_direct(url, temp_file)
+            if handle.cancelled:
+                await handle.abort(handle.reason or "user")
+                raise handle.error()
             if result and await _path_exists(result):
-                return str(result), None
+                return str(result), "Video"
 
             # Fallback to yt-dlp for Instagram when direct JSON fails
             format_selector = "best"
@@ -640,7 +515,7 @@ async def download_video(
                 **({'cookiefile': ig_cookie} if ig_cookie else {}),
                 **({'proxy': ig_proxy} if ig_proxy else {}),
                 'quiet': False,
-                'logger': _YtDlpLogger(),
+                'logger': YtDlpLogger(),
                 'format': format_selector,
                 'postprocessors': [{
                     'key': 'FFmpegVideoRemuxer',
@@ -655,28 +530,26 @@ async def download_video(
             # Avoid external downloader for IG to reduce failures
             ydl_opts.pop("external_downloader", None)
             ydl_opts.pop("external_downloader_args", None)
-            if progress_hook:
-                ydl_opts['progress_hooks'] = [progress_hook]
 
             logger.info(f"Downloading Instagram via yt-dlp: {url}")
             video_title = "Video"
             try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info_dict = await asyncio.wait_for(
-                        asyncio.to_thread(ydl.extract_info, url, download=True),
-                        timeout=YTDLP_DOWNLOAD_TIMEOUT
+                async with governor.lease(INSTAGRAM_ORIGIN) as lease:
+                    meter = ThroughputMeter()
+                    info_dict = await _run_ydl_download(
+                        "instagram", {**ydl_opts, 'ratelimit': lease.rate_limit() or None},
+                        url, handle, meter.wrap(progress_hook),
                     )
-                    if info_dict:
-                        video_title = info_dict.get('title', 'Video')
-            except asyncio.TimeoutError:
-                raise Exception("❌ Yuklash vaqti tugadi. Keyinroq urinib ko'ring.")
+                    lease.record(meter.bytes)
+                if info_dict:
+                    video_title = info_dict.get('title', 'Video')
             except yt_dlp.utils.DownloadError as e:
                 raise _map_download_error(str(e).lower(), "video")
 
             downloaded_file = temp_file if temp_file.exists() else _find_downloaded_file(temp_file.parent, temp_file.stem)
             if not downloaded_file:
-                return None, None, None
-            return str(downloaded_file), None, video_title
+                return None, None
+            return str(downloaded_file), video_title
 
         format_selector = format_selector or "bestvideo*+bestaudio/best"
         merge_ext = output_ext if output_ext in {"mp4", "webm", "mkv"} else "mp4"
@@ -684,7 +557,7 @@ async def download_video(
         ydl_opts = {
             **COMMON_OPTS,
             'quiet': False,
-            'logger': _YtDlpLogger(),
+            'logger': YtDlpLogger(),
             'format': format_selector,
             'postprocessors': [{
                 'key': 'FFmpegVideoRemuxer',
@@ -696,93 +569,51 @@ async def download_video(
             'cachedir': False,
             'max_filesize': 2 * 1024 * 1024 * 1024,
         }
-        if progress_hook:
-            ydl_opts['progress_hooks'] = [progress_hook]
 
         logger.info(f"Downloading Video: {url}")
         video_title = "Video"
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # download=True performs the download and returns info
-                info_dict = await asyncio.wait_for(
-                    asyncio.to_thread(ydl.extract_info, url, download=True),
-                    timeout=YTDLP_DOWNLOAD_TIMEOUT
-                )
-                if info_dict:
-                    video_title = info_dict.get('title', 'Video')
-        except asyncio.TimeoutError:
-            raise Exception("❌ Yuklash vaqti tugadi. Keyinroq urinib ko'ring.")
-        except yt_dlp.utils.DownloadError as e:
-            err_msg = str(e).lower()
-            if "aria2c exited with code" in err_msg:
-                logger.warning("aria2c failed, retrying with internal downloader")
-                no_aria_opts = {**ydl_opts}
-                no_aria_opts.pop("external_downloader", None)
-                no_aria_opts.pop("external_downloader_args", None)
-                try:
-                    with yt_dlp.YoutubeDL(no_aria_opts) as ydl:
-                        info_dict = await asyncio.wait_for(
-                            asyncio.to_thread(ydl.extract_info, url, download=True),
-                            timeout=YTDLP_DOWNLOAD_TIMEOUT
-                        )
-                        if info_dict:
-                            video_title = info_dict.get('title', 'Video')
-                    err_msg = ""
-                except asyncio.TimeoutError:
-                    raise Exception("❌ Yuklash vaqti tugadi. Keyinroq urinib ko'ring.")
-                except yt_dlp.utils.DownloadError as e_noaria:
-                    err_msg = str(e_noaria).lower()
-            if "requested format is not available" in err_msg:
-                try:
-                    # 1. Fallback: Request qilingan formatni cookiesiz urinib ko'rish
-                    logger.info(f"Retrying with original format without cookies for {url}")
-                    fallback_opts_1 = {**ydl_opts}
-                    if 'cookiefile' in fallback_opts_1:
-                        del fallback_opts_1['cookiefile']
-                    fallback_opts_1.pop("external_downloader", None)
-                    fallback_opts_1.pop("external_downloader_args", None)
-                    
-                    with yt_dlp.YoutubeDL(fallback_opts_1) as ydl:
-                        info_dict = await asyncio.wait_for(
-                            asyncio.to_thread(ydl.extract_info, url, download=True),
-                            timeout=YTDLP_DOWNLOAD_TIMEOUT
-                        )
-                        if info_dict:
-                            video_title = info_dict.get('title', 'Video')
-
-                except asyncio.TimeoutError:
-                    raise Exception("❌ Yuklash vaqti tugadi. Keyinroq urinib ko'ring.")
-                except yt_dlp.utils.DownloadError as e_opt:
-                     # 2. Fallback: Agar o'xshamasa, 'best' formatni cookiesiz urinib ko'rish
-                    logger.warning(f"Original format retry failed: {e_opt}. Trying 'best' format...")
-                    
-                    fallback_opts_2 = {**ydl_opts, 'format': 'bestvideo*+bestaudio/best'}
-                    if 'cookiefile' in fallback_opts_2:
-                        del fallback_opts_2['cookiefile']
-                    fallback_opts_2.pop("external_downloader", None)
-                    fallback_opts_2.pop("external_downloader_args", None)
-                    
-                    try:
-                        with yt_dlp.YoutubeDL(fallback_opts_2) as ydl:
-                            info_dict = await asyncio.wait_for(
-                                asyncio.to_thread(ydl.extract_info, url, download=True),
-                                timeout=YTDLP_DOWNLOAD_TIMEOUT
-                            )
-                            if info_dict:
-                                video_title = info_dict.get('title', 'Video')
-                    except asyncio.TimeoutError:
-                        raise Exception("❌ Yuklash vaqti tugadi. Keyinroq urinib ko'ring.")
-                    except yt_dlp.utils.DownloadError as e2:
-                         raise _map_download_error(str(e2).lower(), "video")
-            else:
-                raise _map_download_error(err_msg, "video")
+        domain = domain_of(url)
+        err_msg = ""
+        # Format tanlash paytida olingan info: player/signature so'rovlari takrorlanmaydi
+        probe_info = await load_probe_info(url)
+        aria2_plan = await aria2_tuner.plan(domain, _expected_download_bytes(probe_info, format_selector))
+        for strategy in await strategy_stats.plan(domain):
+            started = time.monotonic()
+            meter = ThroughputMeter()
+            try:
+                async with governor.lease(origin_of(url), aria2_plan.connections) as lease:
+                    lease_opts, aria2_plan = _apply_lease(ydl_opts, aria2_plan, lease)
+                    info_dict = await _download_with_probe_info(
+                        strategy.apply(lease_opts), url, handle, meter.wrap(progress_hook), probe_info
+                    )
+                    lease.record(meter.bytes)
+            except yt_dlp.utils.DownloadError as e:
+                err_msg = str(e).lower()
+                error_class = classify_error(err_msg)
+                await strategy_stats.record_failure(domain, strategy, error_class)
+                if strategy.external_downloader and error_class in ARIA2_ERROR_CLASSES:
+                    await aria2_tuner.record(domain, aria2_plan, 0, 0, ok=False)
+                if error_class not in RETRYABLE_ERRORS:
+                    raise _map_download_error(err_msg, "video")
+                logger.warning(f"Strategy '{strategy.name}' failed ({error_class}) for {url}, trying next")
+                probe_info = None
+                continue
+            await strategy_stats.record_success(domain, strategy, time.monotonic() - started)
+            if info_dict:
+                video_title = info_dict.get('title', 'Video')
+            break
+        else:
+            raise _map_download_error(err_msg, "video")
 
         downloaded_file = temp_file if temp_file.exists() else _find_downloaded_file(temp_file.parent, temp_file.stem)
+        if strategy.external_downloader:
+            nbytes, seconds = meter.result(downloaded_file.stat().st_size if downloaded_file else 0)
+            await aria2_tuner.record(domain, aria2_plan, nbytes, seconds, ok=True)
 
         if not downloaded_file:
-            return None, None, None
+            return None, None
 
-        return str(downloaded_file), None, video_title
+        return str(downloaded_file), video_title
 
     except Exception as e:
         logger.error(f"Video download error: {e}", exc_info=True)
@@ -0,0 +1,203 @@
+"""
+Declarative download strategy ladder with per-domain learning.
+
+Each `Strategy` is a small transformation of the base yt-dlp options
+(external downloader on/off, cookies on/off, format override). Outcomes
+are recorded in hourly Redis hashes `dl_strategy:{domain}:{hour}`:
+
+    {strategy}:ok / {strategy}:ok_ms / {strategy}:fail / {strategy}:fail:{error_class}
+
+`plan()` starts a job at the strategy with the best recent success rate
+(ties -> faster time-to-success -> ladder order) and falls back through
+the rest of DEFAULT_LADDER. The per-class counters pick the domain's
+dominant recent error class (at least DOMINANT_MIN_FAILURES retryable
+failures); a strategy that failed with that class more often than it
+succeeded is skipped past - e.g. aria2c while the domain answers with
+`aria2c` / `forbidden` errors - and tried last. Without data the ladder
+order is unchanged.
+"""
+import logging
+import random
+import time
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+STATS_WINDOW_HOURS = 6
+STATS_TTL = (STATS_WINDOW_HOURS + 1) * 3600
+EXPLORE_RATE = 0.05  # eski tartibni vaqti-vaqti bilan qayta sinash
+DOMINANT_MIN_FAILURES = 3
+
+# Bu xatolarda boshqa strategiya yordam bermaydi (video o'chirilgan, 18+, va h.k.)
+RETRYABLE_ERRORS = {"aria2c", "format_unavailable", "forbidden", "network"}
+
+
+@dataclass(frozen=True)
+class Strategy:
+    name: str
+    external_downloader: bool = True
+    cookies: bool = True
+    format_override: str | None = None
+
+    def apply(self, opts: dict) -> dict:
+        result = {**opts}
+        if not self.external_downloader:
+            result.pop("external_downloader", None)
+            result.pop("external_downloader_args", None)
+        if not self.cookies:
+            result.pop("cookiefile", None)
+        if self.format_override:
+            result["format"] = self.format_override
+        return result
+
+
+# Cold-start tartibi: aria2c -> ichki downloader -> cookiesiz -> 'best' format
+DEFAULT_LADDER = (
+    Strategy("aria2c"),
+    Strategy("native", external_downloader=False),
+    Strategy("no_cookies", external_downloader=False, cookies=False),
+    Strategy("best_no_cookies", external_downloader=False, cookies=False,
+             format_override="bestvideo*+bestaudio/best"),
+)
+
+
+def classify_error(err_msg: str) -> str:
+    err_msg = err_msg.lower()
+    if "aria2c exited with code" in err_msg:
+        return "aria2c"
+    if "requested format is not available" in err_msg:
+        return "format_unavailable"
+    if "http error 403" in err_msg or "forbidden" in err_msg:
+        return "forbidden"
+    if "sign in" in err_msg or "age-gated" in err_msg:
+        return "login"
+    if "video unavailable" in err_msg or "private video" in err_msg:
+        return "unavailable"
+    if "geo-restricted" in err_msg or "available to" in err_msg or "copyright" in err_msg:
+        return "restricted"
+    if "larger than" in err_msg or "too large" in err_msg:
+        return "too_large"
+    if "timed out" in err_msg or "connection" in err_msg or "http error 5" in err_msg:
+        return "network"
+    return "other"
+
+
+def domain_of(url: str) -> str:
+    host = (urlparse(url).hostname or "").lower()
+    for prefix in ("www.", "m.", "music."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    if host == "youtu.be":
+        return "youtube.com"
+    return host or "unknown"
+
+
+class StrategyStats:
+    def __init__(self, ladder: tuple[Strategy, ...] = DEFAULT_LADDER):
+        self.ladder = ladder
+
+    @staticmethod
+    def _redis():
+        from loader import redis_client
+        return redis_client
+
+    @staticmethod
+    def _bucket(domain: str, hour: int) -> str:
+        return f"dl_strategy:{domain}:{hour}"
+
+    async def _load(self, domain: str) -> dict[str, float]:
+        redis_client = self._redis()
+        if not redis_client:
+            return {}
+        hour = int(time.time() // 3600)
+        totals: dict[str, float] = {}
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for offset in range(STATS_WINDOW_HOURS):
+                pipe.hgetall(self._bucket(domain, hour - offset))
+            for bucket in await pipe.execute():
+                for field, value in bucket.items():
+                    field = field.decode() if isinstance(field, bytes) else field
+                    totals[field] = totals.get(field, 0) + float(value)
+        except Exception as e:
+            logger.error(f"Strategy stats load error: {e}")
+        return totals
+
+    @staticmethod
+    def _dominant_error(stats: dict[str, float]) -> str | None:
+        """Domendagi eng ko'p uchragan (qayta urinsa bo'ladigan) xato turi"""
+        counts: dict[str, float] = {}
+        for field, value in stats.items():
+            _, kind, *error_class = field.split(":")
+            if kind == "fail" and error_class and error_class[0] in RETRYABLE_ERRORS:
+                counts[error_class[0]] = counts.get(error_class[0], 0) + value
+        if not counts:
+            return None
+        error_class, count = max(counts.items(), key=lambda item: item[1])
+        return error_class if count >= DOMINANT_MIN_FAILURES else None
+
+    async def plan(self, domain: str) -> list[Strategy]:
+        """Shu domen uchun hozir eng yaxshi ishlayotgan strategiyadan boshlanadigan ladder"""
+        if random.random() < EXPLORE_RATE:
+            return list(self.ladder)
+        stats = await self._load(domain)
+        if not stats:
+            return list(self.ladder)
+        dominant = self._dominant_error(stats)
+
+        def hit(strategy: Strategy) -> bool:
+            """Strategiya domendagi asosiy xatodan muvaffaqiyatidan ko'p yiqilgan"""
+            if dominant is None:
+                return False
+            return stats.get(f"{strategy.name}:fail:{dominant}", 0) > stats.get(f"{strategy.name}:ok", 0)
+
+        def score(item: tuple[int, Strategy]) -> tuple[bool, float, float, int]:
+            index, strategy = item
+            ok = stats.get(f"{strategy.name}:ok", 0)
+            fail = stats.get(f"{strategy.name}:fail", 0)
+            success_rate = (ok + 1) / (ok + fail + 2)  # Laplace: ma'lumot yo'q -> 0.5
+            avg_ms = stats.get(f"{strategy.name}:ok_ms", 0) / ok if ok else float("inf")
+            return hit(strategy), -success_rate, avg_ms, index
+
+        # Formatni o'zgartiradigan strategiya faqat oxirgi chora bo'lib qoladi
+        candidates = [(i, s) for i, s in enumerate(self.ladder) if not s.format_override]
+        start = min(candidates, key=score)[1]
+        if start is not self.ladder[0]:
+            metrics.incr(f"download_strategy.reordered.{start.name}")
+        # Asosiy xatodan yiqilayotganlari oxirida (sorted barqaror - qolganlari ladder tartibida)
+        return [start] + sorted((s for s in self.ladder if s is not start), key=hit)
+
+    async def _record(self, domain: str, fields: dict[str, int]) -> None:
+        redis_client = self._redis()
+        if not redis_client:
+            return
+        key = self._bucket(domain, int(time.time() // 3600))
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for field, amount in fields.items():
+                pipe.hincrby(key, field, amount)
+            pipe.expire(key, STATS_TTL)
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"Strategy stats record error: {e}")
+
+    async def record_success(self, domain: str, strategy: Strategy, elapsed: float) -> None:
+        metrics.incr(f"download_strategy.ok.{strategy.name}")
+        await self._record(domain, {
+            f"{strategy.name}:ok": 1,
+            f"{strategy.name}:ok_ms": int(elapsed * 1000),
+        })
+
+    async def record_failure(self, domain: str, strategy: Strategy, error_class: str) -> None:
+        metrics.incr(f"download_strategy.fail.{strategy.name}.{error_class}")
+        await self._record(domain, {
+            f"{strategy.name}:fail": 1,
+            f"{strategy.name}:fail:{error_class}": 1,
+        })
+
+
+# Global instance
+strategy_stats = StrategyStats()
@@ -0,0 +1,170 @@
+"""
+Telegram-aware format planner for the quality buttons.
+
+For every target height the candidates are progressive formats (one file,
+no merge) and video-only formats merged with the best m4a audio. Each is
+scored by effective cost:
+
+    expected bytes (video + audio)
+    * NON_NATIVE_FACTOR   if Telegram can't play the result inline (not H.264 mp4)
+    + MERGE_COST_BYTES    if ffmpeg has to merge video and audio
+    + REMUX_COST_BYTES    if the container has to be rewritten to mp4
+
+and the cheapest one becomes the plan for that button.
+"""
+from dataclasses import dataclass
+
+TARGET_HEIGHTS = {144, 240, 360, 480, 720, 1080, 1440, 2160}
+MAX_FORMAT_SIZE_BYTES = 900 * 1024 * 1024  # 900MB
+MERGE_COST_BYTES = 8 * 1024 * 1024
+REMUX_COST_BYTES = 4 * 1024 * 1024
+NON_NATIVE_FACTOR = 1.5
+FALLBACK_FORMAT_ID = "18"  # 360p H.264 + AAC progressive
+
+
+@dataclass
+class FormatPlan:
+    height: int
+    format_id: str
+    is_merge: int
+    ext: str
+    size_bytes: int
+    vcodec: str
+    native: bool
+    remux: bool
+    cost: float
+
+    @property
+    def note(self) -> str:
+        return "dash_video_only_merge_audio" if self.is_merge else "progressive"
+
+    def as_item(self) -> dict:
+        # fetch_youtube_formats_fast / `vf:` tugmalari ishlatadigan schema
+        return {
+            "height": self.height,
+            "format_id": self.format_id,
+            "is_merge": self.is_merge,
+            "ext": self.ext,
+            "size_bytes": self.size_bytes,
+            "size_mb_est": round(self.size_bytes / (1024 * 1024), 1) if self.size_bytes else 0.0,
+            "note": self.note,
+            "vcodec": self.vcodec,
+            "native": self.native,
+        }
+
+
+def estimate_format_size_bytes(fmt: dict, duration: int | None) -> int | None:
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if size:
+        return int(size)
+    tbr = fmt.get("tbr")  # kbps
+    if tbr and duration:
+        return int(tbr * 1000 / 8 * duration)
+    return None
+
+
+def is_storyboard(fmt: dict) -> bool:
+    return fmt.get("ext") == "mhtml" or (fmt.get("format_id") or "").startswith("sb")
+
+
+def _has_video(fmt: dict) -> bool:
+    vcodec = fmt.get("vcodec")
+    return bool(vcodec) and vcodec != "none"
+
+
+def _has_audio(fmt: dict) -> bool:
+    acodec = fmt.get("acodec")
+    return bool(acodec) and acodec != "none"
+
+
+def _is_h264(vcodec: str | None) -> bool:
+    return bool(vcodec) and vcodec.startswith(("avc1", "h264"))
+
+
+def _best_merge_audio(formats: list[dict], duration: int | None) -> tuple[int, bool]:
+    """
+    `get_format_selector` merge uchun bestaudio[ext=m4a] oladi.
+    Returns: (audio hajmi, AAC/m4a bormi)
+    """
+    audio = [f for f in formats if _has_audio(f) and not _has_video(f)]
+    m4a = [f for f in audio if f.get("ext") == "m4a"]
+    pool = m4a or audio
+    if not pool:
+        return 0, False
+    best = max(pool, key=lambda f: f.get("abr") or f.get("tbr") or 0)
+    return estimate_format_size_bytes(best, duration) or 0, bool(m4a)
+
+
+def _plan_candidate(fmt: dict, duration: int | None, audio_bytes: int, audio_is_aac: bool) -> FormatPlan | None:
+    size = estimate_format_size_bytes(fmt, duration)
+    if size and size > MAX_FORMAT_SIZE_BYTES:
+        return None
+    is_merge = 0 if _has_audio(fmt) else 1
+    vcodec = fmt.get("vcodec") or ""
+    source_ext = fmt.get("ext") or "mp4"
+    # Merge natijasi har doim mp4'ga yoziladi; progressive webm/3gp esa remux talab qiladi
+    remux = not is_merge and source_ext != "mp4"
+    native = _is_h264(vcodec) and (not is_merge or audio_is_aac)
+    total = (size or 0) + (audio_bytes if is_merge else 0)
+
+    cost = float(total) if total else float(MAX_FORMAT_SIZE_BYTES)
+    if not native:
+        cost *= NON_NATIVE_FACTOR
+    if is_merge:
+        cost += MERGE_COST_BYTES
+    if remux:
+        cost += REMUX_COST_BYTES
+    return FormatPlan(
+        height=fmt["height"],
+        format_id=fmt.get("format_id"),
+        is_merge=is_merge,
+        ext="mp4",
+        size_bytes=total,
+        vcodec=vcodec,
+        native=native,
+        remux=remux,
+        cost=cost,
+    )
+
+
+def plan_formats(info: dict) -> list[FormatPlan]:
+    """Har bir sifat tugmasi uchun eng arzon reja (past sifatdan yuqoriga)"""
+    formats = info.get("formats") or []
+    duration = info.get("duration")
+    audio_bytes, audio_is_aac = _best_merge_audio(formats, duration)
+
+    best: dict[int, FormatPlan] = {}
+    for fmt in formats:
+        height = fmt.get("height")
+        if not height or height not in TARGET_HEIGHTS:
+            continue
+        if is_storyboard(fmt) or not _has_video(fmt):
+            continue
+        plan = _plan_candidate(fmt, duration, audio_bytes, audio_is_aac)
+        if not plan:
+            continue
+        current = best.get(height)
+        if current is None or plan.cost < current.cost:
+            best[height] = plan
+
+    plans = [best[height] for height in sorted(best)]
+    if not plans:
+        fallback = next((f for f in formats if f.get("format_id") == FALLBACK_FORMAT_ID), None)
+        if fallback:
+            size = estimate_format_size_bytes(fallback, duration) or 0
+            plans.append(FormatPlan(
+                height=360,
+                format_id=FALLBACK_FORMAT_ID,
+                is_merge=0,
+                ext=fallback.get("ext") or "mp4",
+                size_bytes=size,
+                vcodec=fallback.get("vcodec") or "avc1",
+                native=True,
+                remux=False,
+                cost=float(size),
+            ))
+    return plans
+
+
+def select_best_formats(info: dict) -> list[dict]:
+    return [plan.as_item() for plan in plan_formats(info)]
@@ -1,5 +1,6 @@
 from typing import Any
 
+from services.local_cache import MISSING, local_cache
 from services.redis_client import get_sync_redis
 
 DEFAULT_LANG = "uz"
@@ -66,6 +67,10 @@ _TEXTS: dict[str, dict[str, str]] = {
         "uz": "⏳ <b>Video yuklanmoqda...</b>",
         "ru": "⏳ <b>Видео загружается...</b>",
     },
+    "download_resumed": {
+        "uz": "🔄 <b>Bot qayta ishga tushdi, yuklash davom ettirilmoqda...</b>",
+        "ru": "🔄 <b>Бот перезапущен, загрузка продолжается...</b>",
+    },
     "music_loading": {
         "uz": "⏳ <b>Musiqangiz yuklanmoqda...</b>",
         "ru": "⏳ <b>Ваша музыка загружается...</b>",
@@ -126,6 +131,34 @@ _TEXTS: dict[str, dict[str, str]] = {
         "uz": "📹 {title}\n👤 {uploader}\n{format}\n\n✅ Video yuborildi",
         "ru": "📹 {title}\n👤 {uploader}\n{format}\n\n✅ Видео отправлено",
     },
+    "queue_position": {
+        "uz": "🕒 <b>Navbatda: {position}-o'rin</b>\nTaxminiy kutish: {eta}",
+        "ru": "🕒 <b>В очереди: {position}-е место</b>\nПримерное ожидание: {eta}",
+    },
+    "video_queued_caption": {
+        "uz": "📹 {title}\n👤 {uploader}\n{format}\n\n🕒 <b>Navbatda: {position}-o'rin</b>\nTaxminiy kutish: {eta}",
+        "ru": "📹 {title}\n👤 {uploader}\n{format}\n\n🕒 <b>В очереди: {position}-е место</b>\nПримерное ожидание: {eta}",
+    },
+    "eta_seconds": {
+        "uz": "~{seconds} soniya",
+        "ru": "~{seconds} сек",
+    },
+    "eta_minutes": {
+        "uz": "~{minutes} daqiqa",
+        "ru": "~{minutes} мин",
+    },
+    "server_busy": {
+        "uz": "⏳ Hozir so'rovlar juda ko'p. Iltimos, birozdan keyin qayta urinib ko'ring.",
+        "ru": "⏳ Сейчас слишком много запросов. Пожалуйста, попробуйте немного позже.",
+    },
+    "busy_audio_only": {
+        "uz": "⏳ Hozir video navbati to'lgan. Hozircha faqat audio (MP3) yuklab bera olamiz:",
+        "ru": "⏳ Сейчас очередь видео переполнена. Пока можем скачать только аудио (MP3):",
+    },
+    "busy_degraded": {
+        "uz": "⚠️ Navbat band - video {label} sifatda yuklanadi",
+        "ru": "⚠️ Очередь загружена - видео будет загружено в качестве {label}",
+    },
     "format_label": {
         "uz": "🎞 Format: {label}",
         "ru": "🎞 Формат: {label}",
@@ -212,6 +245,10 @@ _TEXTS: dict[str, dict[str, str]] = {
         "uz": "❌ Musiqa yuklashda xatolik bo'ldi.",
         "ru": "❌ Ошибка при загрузке музыки.",
     },
+    "download_timed_out": {
+        "uz": "❌ Yuklash vaqti tugadi. Keyinroq urinib ko'ring.",
+        "ru": "❌ Время загрузки истекло. Попробуйте позже.",
+    },
     "download_error_generic": {
         "uz": "❌ Yuklashda xatolik yuz berdi! (Keyinroq urinib ko'ring)",
         "ru": "❌ Произошла ошибка при загрузке! (Попробуйте позже)",
@@ -267,10 +304,22 @@ _TEXTS: dict[str, dict[str, str]] = {
     "music_prev_btn": {
         "uz": "Oldingi ⬅️",
         "ru": "Предыдущий ⬅️",
-    }
+    },
+    "download_cancelling": {
+        "uz": "⏹ Yuklash bekor qilinmoqda...",
+        "ru": "⏹ Загрузка отменяется...",
+    },
 }
 
 _ERROR_MAP: dict[str, dict[str, str]] = {
+    "❌ Yuklash bekor qilindi.": {
+        "ru": "❌ Загрузка отменена.",
+        "uz": "❌ Yuklash bekor qilindi.",
+    },
+    "❌ Yuklash vaqti tugadi. Keyinroq urinib ko'ring.": {
+        "ru": "❌ Время загрузки истекло. Попробуйте позже.",
+        "uz": "❌ Yuklash vaqti tugadi. Keyinroq urinib ko'ring.",
+    },
     "❌ Audio hajmi juda katta (2GB dan ortiq).": {
         "ru": "❌ Аудио слишком большое (более 2 ГБ).",
         "uz": "❌ Audio hajmi juda katta (2GB dan ortiq).",
@@ -338,7 +387,7 @@ async def get_user_lang(user_id: int, redis_client) -> str:
     if not redis_client:
         return DEFAULT_LANG
     try:
-        lang = await redis_client.get(f"user:lang:{user_id}")
+        lang = await local_cache.get(redis_client, f"user:lang:{user_id}")
         if isinstance(lang, bytes):
             lang = lang.decode()
         if lang in SUPPORTED_LANGS:
@@ -354,17 +403,24 @@ async def set_user_lang(user_id: int, lang: str, redis_client) -> None:
     if lang not in SUPPORTED_LANGS:
         return
     try:
-        await redis_client.set(f"user:lang:{user_id}", lang)
+        await local_cache.set(redis_client, f"user:lang:{user_id}", lang)
     except Exception:
         pass
 
 
 def get_user_lang_sync(user_id: int) -> str:
+    key = f"user:lang:{user_id}"
+    lang = local_cache.peek(key)
+    if lang is not MISSING:
+        if isinstance(lang, bytes):
+            lang = lang.decode()
+        return lang if lang in SUPPORTED_LANGS else DEFAULT_LANG
     client = get_sync_redis()
     if not client:
         return DEFAULT_LANG
     try:
-        lang = client.get(f"user:lang:{user_id}")
+        lang = client.get(key)
+        local_cache.remember(key, lang)
         if isinstance(lang, bytes):
             lang = lang.decode()
         if lang in SUPPORTED_LANGS:
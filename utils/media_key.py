@@ -0,0 +1,39 @@
+"""
+Canonical identifiers for downloadable media.
+
+The same video reaches us as youtu.be / watch?v= / shorts URLs with extra
+query parameters; everything that is shared between chats (coalescing,
+file_id cache) is keyed by (media id, format selector, ext) instead of a
+hash of the raw URL.
+"""
+import hashlib
+import re
+
+from utils.validation import extract_youtube_id, is_instagram_url, is_youtube_url
+
+_INSTAGRAM_CODE_RE = re.compile(r'instagram\.com/(?:[^/]+/)?(?:p|reel|reels|tv)/([^/?#&]+)')
+_SHORTS_RE = re.compile(r'youtube\.com/shorts/([^/?#&]+)')
+
+
+def canonical_media_id(url: str) -> str:
+    if is_youtube_url(url):
+        match = _SHORTS_RE.search(url)
+        video_id = match.group(1) if match else extract_youtube_id(url)
+        if video_id:
+            return f"yt:{video_id}"
+    if is_instagram_url(url):
+        match = _INSTAGRAM_CODE_RE.search(url)
+        if match:
+            return f"ig:{match.group(1)}"
+    return f"url:{hashlib.sha256(url.encode()).hexdigest()[:16]}"
+
+
+def media_key(url: str, format_selector: str | None, ext: str | None) -> str:
+    """(media id, format selector, ext) -> `yt:ID|137+bestaudio...|mp4`"""
+    return f"{canonical_media_id(url)}|{format_selector or 'best'}|{ext or 'mp4'}"
+
+
+def split_media_key(key: str) -> tuple[str, str, str]:
+    """media_key() teskarisi: (media id, format selector, ext)"""
+    media_id, format_selector, ext = key.rsplit("|", 2)
+    return media_id, format_selector, ext
@@ -9,6 +9,10 @@ from utils.db_api.models import User as DBUser
 from loader import redis_client
 import logging
 
+# Redis volatile-lru bilan ishlaydi - TTL'siz kalit hech qachon o'chirilmaydi
+LAST_ACTIVE_TTL = 24 * 3600
+
+
 class ActivityMiddleware(BaseMiddleware):
     async def __call__(
         self,
@@ -23,7 +27,7 @@ class ActivityMiddleware(BaseMiddleware):
                 if redis_client:
                     now = datetime.now(timezone.utc).timestamp()
                     last_active_key = f"user:last_active:{user.id}"
-                    await redis_client.set(last_active_key, now)
+                    await redis_client.set(last_active_key, now, ex=LAST_ACTIVE_TTL)
 
                     ttl = 600 + random.randint(0, 120)
                     lock_key = f"user:last_active:lock:{user.id}"
@@ -0,0 +1,234 @@
+"""
+Parallel byte-range downloader for small single-file streams (audio).
+
+The file is preallocated and each range task writes its bytes at their
+offset with `os.pwrite` (in a thread, off the event loop), so there is no
+merge step. All requests go through
+one shared aiohttp session (keep-alive, DNS cache); `close_session()` is
+called on shutdown.
+
+Progress of every range is saved next to the file (`{file}.ranges`), so a
+download interrupted by a restart continues from the written offsets
+instead of starting over. The control file is removed when the download
+completes or fails for good.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTS = 4
+MIN_PART_SIZE = 1024 * 1024
+MAX_PART_SIZE = 10 * 1024 * 1024  # googlevideo katta range'larni sekinlashtiradi
+READ_CHUNK_SIZE = 256 * 1024
+WRITE_BLOCK_SIZE = 1024 * 1024
+FETCH_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=10, sock_read=30)
+CONTROL_SUFFIX = ".ranges"
+CONTROL_SAVE_INTERVAL = 1.0
+
+_session: aiohttp.ClientSession | None = None
+
+
+class RangeFetchError(Exception):
+    pass
+
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=64, ttl_dns_cache=300),
+            timeout=FETCH_TIMEOUT,
+        )
+    return _session
+
+
+async def close_session() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def split_ranges(total: int, parts: int = DEFAULT_PARTS) -> list[tuple[int, int]]:
+    """[start, end] (end inclusive) oraliqlar; har biri MIN..MAX_PART_SIZE orasida"""
+    count = max(1, min(parts, math.ceil(total / MIN_PART_SIZE)))
+    count = max(count, math.ceil(total / MAX_PART_SIZE))
+    size = math.ceil(total / count)
+    return [(start, min(start + size, total) - 1) for start in range(0, total, size)]
+
+
+async def _probe_size(session: aiohttp.ClientSession, url: str, headers: dict) -> int | None:
+    async with session.get(url, headers={**headers, "Range": "bytes=0-0"}) as response:
+        if response.status != 206:
+            return None
+        content_range = response.headers.get("Content-Range", "")
+        total = content_range.rsplit("/", 1)[-1]
+        return int(total) if total.isdigit() else None
+
+
+def control_path(output_path: Path) -> Path:
+    return Path(f"{output_path}{CONTROL_SUFFIX}")
+
+
+def _load_control(output_path: Path, total: int) -> list[list[int]] | None:
+    """Oldingi urinishdan qolgan [start, end, yozilgan_offset] ro'yxati"""
+    try:
+        with open(control_path(output_path)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("total") != total or not output_path.exists():
+        return None
+    return state["spans"]
+
+
+def _save_control(output_path: Path, total: int, spans: list[list[int]]) -> None:
+    path = control_path(output_path)
+    tmp = path.with_name(f"{path.name}.tmp")
+    with open(tmp, "w") as f:
+        json.dump({"total": total, "spans": spans}, f)
+    os.replace(tmp, path)
+
+
+def discard(output_path: Path) -> None:
+    """Tugallanmagan fayl va uning control faylini o'chirish"""
+    for path in (output_path, control_path(output_path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def _write_block(fd: int, block: bytearray, offset: int) -> None:
+    """os.pwrite thread'da; bekor qilinsa ham yozish tugaguncha kutamiz (fd undan keyin yopiladi)"""
+    write = asyncio.ensure_future(asyncio.to_thread(os.pwrite, fd, block, offset))
+    try:
+        await asyncio.shield(write)
+    except asyncio.CancelledError:
+        await asyncio.gather(write, return_exceptions=True)
+        raise
+
+
+async def _fetch_range(
+    session: aiohttp.ClientSession,
+    url: str,
+    headers: dict,
+    fd: int,
+    span: list[int],
+    on_bytes: Callable[[int], None],
+    should_stop: Callable[[], bool] | None,
+    throttle: Callable[[int], Awaitable[None]] | None,
+) -> None:
+    """span = [start, end, offset]: offset (yozilgan chegarasi) shu yerda yangilanadi"""
+    start, end, offset = span
+    if offset > end:
+        return
+    async with session.get(url, headers={**headers, "Range": f"bytes={offset}-{end}"}) as response:
+        if response.status != 206:
+            raise RangeFetchError(f"HTTP {response.status} for range {offset}-{end}")
+        block = bytearray()
+        async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+            if should_stop and should_stop():
+                raise RangeFetchError("cancelled")
+            block += chunk
+            if len(block) >= WRITE_BLOCK_SIZE:
+                await _write_block(fd, block, offset)
+                offset += len(block)
+                span[2] = offset
+                on_bytes(len(block))
+                if throttle:
+                    await throttle(len(block))
+                block.clear()
+        if block:
+            await _write_block(fd, block, offset)
+            offset += len(block)
+            span[2] = offset
+            on_bytes(len(block))
+    if offset != end + 1:
+        raise RangeFetchError(f"short range {start}-{end}: got {offset - start} bytes")
+
+
+async def fetch_ranges(
+    url: str,
+    output_path: Path,
+    total: int | None = None,
+    headers: dict | None = None,
+    parts: int = DEFAULT_PARTS,
+    progress_hook: Callable[[dict], None] | None = None,
+    should_stop: Callable[[], bool] | None = None,
+    throttle: Callable[[int], Awaitable[None]] | None = None,
+) -> int:
+    """
+    URL'ni bir nechta parallel Range so'rovlari bilan `output_path` ga yuklash.
+    Oldingi urinishning control fayli bo'lsa, yozilgan baytlar qayta olinmaydi.
+    Xato bo'lsa fayl o'chiriladi va RangeFetchError ko'tariladi; task bekor
+    qilinsa (restart) fayl va control fayl keyingi urinish uchun qoldiriladi.
+    throttle: har yozilgan blokdan keyin chaqiriladi (governor lease).
+    Returns: yozilgan baytlar soni
+    """
+    headers = headers or {}
+    session = get_session()
+    if not total:
+        total = await _probe_size(session, url, headers)
+        if not total:
+            raise RangeFetchError("server does not report size / support ranges")
+
+    spans = _load_control(output_path, total)
+    resumed = spans is not None
+    if not resumed:
+        spans = [[start, end, start] for start, end in split_ranges(total, parts)]
+    downloaded = sum(offset - start for start, _, offset in spans)
+    if resumed:
+        logger.info(f"Resuming ranged fetch {output_path.name}: {downloaded}/{total} bytes on disk")
+
+    def on_bytes(n: int) -> None:
+        nonlocal downloaded
+        downloaded += n
+        if progress_hook:
+            progress_hook({"status": "downloading", "downloaded_bytes": downloaded, "total_bytes": total})
+
+    async def save_periodically() -> None:
+        while True:
+            await asyncio.sleep(CONTROL_SAVE_INTERVAL)
+            _save_control(output_path, total, spans)
+
+    fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | (0 if resumed else os.O_TRUNC), 0o644)
+    saver = None
+    try:
+        if not resumed:
+            os.ftruncate(fd, total)  # oldindan ajratish
+        _save_control(output_path, total, spans)
+        saver = asyncio.create_task(save_periodically())
+        tasks = [
+            asyncio.create_task(_fetch_range(session, url, headers, fd, span, on_bytes, should_stop, throttle))
+            for span in spans
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    except asyncio.CancelledError:
+        # Restart/shutdown: yozilgan baytlar keyingi urinishda qayta olinmaydi
+        _save_control(output_path, total, spans)
+        raise
+    except BaseException:
+        discard(output_path)
+        raise
+    else:
+        os.remove(control_path(output_path))
+    finally:
+        if saver:
+            saver.cancel()
+        os.close(fd)
+    return total
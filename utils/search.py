@@ -4,6 +4,7 @@ import json
 import logging
 import os
 from loader import redis_client
+from services.local_cache import local_cache
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +16,7 @@ async def search_music(query: str):
     cache_key = f"search:music:v3:{query.lower().strip()}" # Changed key prefix to separate from old video search if needed, or keep same. Let's use new key to avoid conflicts.
     try:
         if redis_client:
-            cached_data = await redis_client.get(cache_key)
+            cached_data = await local_cache.get(redis_client, cache_key)
             if cached_data:
                 logger.info(f"Returning cached results for '{query}'")
                 return json.loads(cached_data)
@@ -41,7 +42,7 @@ async def search_music(query: str):
         if final_results and redis_client:
             try:
                 # Cache for 24 hours
-                await redis_client.setex(cache_key, 86400, json.dumps(final_results))
+                await local_cache.set(redis_client, cache_key, json.dumps(final_results), ex=86400)
             except Exception as e:
                 logger.error(f"Redis save error: {e}")
                 
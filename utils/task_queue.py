@@ -1,63 +1,369 @@
+"""
+Job dispatch for handlers.
+
+Every task runs in a named worker pool (`services.worker_pools`: music,
+video, recognize, broadcast, default) with its own concurrency, queue
+limit and timeout. By default (JOB_QUEUE=memory) every task runs on the
+pool's in-process asyncio queue. With JOB_QUEUE=redis, tasks registered
+with `@job_store.resumable` go to the pool's durable Redis Streams queue
+(`services.job_queue`) and can be run by any bot / worker process;
+everything else, and all tasks when Redis is not available, stays local.
+Durable jobs with a status message show their queue position and ETA
+while they wait (`services.queue_status`). With JOB_QUEUE=celery resumable
+jobs go to the Celery worker tier instead (`tasks.celery_app`) and this
+process only runs the rest.
+
+Per-pool load is exported every POOL_REPORT_INTERVAL as `pool.{name}.*`
+gauges (active, queued, parked, depth, saturation) plus the `saturated_seconds`
+and `timeouts` counters; `task_queue.snapshot()` returns the same.
+
+Load shedding: handlers ask `task_queue.admission(func)` before queueing
+and act on the pool's policy (reject / degrade / audio_only, see
+`services.worker_pools`), reporting what they did with `task_queue.shed()`;
+`add_task` itself raises PoolFull at the hard limit. Shed load is counted
+as `shed.{pool}.{action}` and `shed.total`.
+
+Pool sizes start at the configured concurrency and are adjusted at runtime
+by `services.autoscaler` (queue wait, CPU, event-loop lag, free tmpfs).
+"""
 import asyncio
 import logging
+import time
+from collections import deque
 from typing import Callable, Any
 
+from core.config import get_settings
+from services import metrics
+from services.autoscaler import autoscaler
+from services.job_queue import STREAM_KEY, JobQueue
+from services.job_store import job_store
+from services.job_timings import current_timing, job_timings, size_bucket
+from services.message_utils import report_job_timeout
+from services.queue_status import queue_status
+from services.scheduler import expected_seconds
+from services.scratch_budget import Reservation, current_reservation, scratch_budget
+from services.worker_pools import DEFAULT_POOL, REJECT, PoolSpec, pool_specs, route
+from utils.cancellation import download_registry
+
 logger = logging.getLogger(__name__)
 
-class TaskQueue:
-    def __init__(self, num_workers: int = 4):
+POOL_REPORT_INTERVAL = 5  # seconds
+DOWNLOAD_POOLS = ("music", "video")
+
+
+class PoolFull(Exception):
+    """Pool'ning navbat chegarasi (queue_limit) to'lgan"""
+
+    def __init__(self, pool: str):
+        super().__init__(f"Worker pool {pool!r} is full")
+        self.pool = pool
+
+
+def _count_shed(pool: str, action: str) -> None:
+    metrics.incr(f"shed.{pool}.{action}")
+    metrics.incr("shed.total")
+
+
+class WorkerPool:
+    def __init__(self, spec: PoolSpec):
+        self.spec = spec
+        self.name = spec.name
+        # Hozirgi worker'lar soni - autoscaler spec.concurrency'dan o'zgartirishi mumkin
+        self.concurrency = spec.concurrency
         self.queue: asyncio.Queue = asyncio.Queue()
-        self.num_workers = num_workers
-        self.workers = []
+        self.workers: dict[int, asyncio.Task] = {}
+        self._busy_workers: set[int] = set()
         self._running = False
+        self._active = 0
+        # TMP_DIR budjeti tugaganda kutib turgan tasklar (FIFO)
+        self._parked: deque = deque()
+        stream = STREAM_KEY if self.name == DEFAULT_POOL else f"{STREAM_KEY}:{self.name}"
+        self.job_queue = JobQueue(stream=stream, pool=self.name, timeout=spec.timeout)
+        self._celery = None
+        self._consumer: asyncio.Task | None = None
+        self._monitor: asyncio.Task | None = None
+        self._depth = 0
+        scratch_budget.add_release_listener(self._admit_parked)
+
+    def _durable(self) -> bool:
+        return get_settings().job_queue == "redis" and self.job_queue.available
+
+    def _remote(self):
+        """Boshqa process'lar bajaradigan navbat (Redis stream yoki Celery); yo'q bo'lsa None"""
+        if get_settings().job_queue == "celery":
+            if self._celery is None:
+                from tasks.celery_app import CeleryQueue
+                self._celery = CeleryQueue(self.name)
+            return self._celery
+        return self.job_queue if self._durable() else None
+
+    @property
+    def active(self) -> int:
+        return self._active + self.job_queue.executing
+
+    @property
+    def queued(self) -> int:
+        return self.queue.qsize() + len(self._parked) + len(self.job_queue.scheduler)
+
+    @property
+    def busy(self) -> bool:
+        """Bo'sh worker yo'q yoki job'lar navbatda kutmoqda"""
+        return bool(self.queued) or self.active >= self.concurrency
+
+    @property
+    def local_load(self) -> int:
+        return self.queue.qsize() + len(self._parked) + self._active
+
+    async def load(self) -> int:
+        """Pool'dagi tugallanmagan job'lar (Redis navbatidagilar - barcha process'lar bo'yicha)"""
+        depth = 0
+        remote = self._remote()
+        if remote:
+            try:
+                depth = await remote.depth()
+            except Exception as e:
+                logger.error(f"Pool {self.name} depth error: {e}")
+        return depth + self.local_load
+
+    def wait_seconds(self) -> float:
+        """Navbat kutishi: hali kutayotgan eng eski job'ning yoshi (navbat bo'sh bo'lsa 0)"""
+        # Budjetdan qaytgan task'lar yangilaridan keyin turishi mumkin - shuning uchun min
+        enqueued = [item[4] for item in self.queue._queue] + [item[4] for item in self._parked]
+        oldest = self.job_queue.scheduler.oldest_enqueued()
+        if oldest:
+            enqueued.append(oldest)
+        return time.time() - min(enqueued) if enqueued else 0.0
+
+    async def submit(self, func: Callable, args: tuple, kwargs: dict, scratch_bytes: int, cost: float) -> None:
+        remote = self._remote() if not args and job_store.is_resumable(func) else None
+        if remote:
+            try:
+                if await remote.depth() >= self.spec.queue_limit:
+                    self._reject()
+                entry_id = await remote.enqueue(func.__name__, kwargs, scratch_bytes, cost=cost)
+                if remote is self.job_queue and kwargs.get("status_message_id") and kwargs.get("chat_id"):
+                    queue_status.watch(self, entry_id, kwargs)
+                return
+            except PoolFull:
+                raise
+            except Exception as e:
+                logger.error(f"Job queue enqueue error, running in-process: {e}")
+        if self.local_load >= self.spec.queue_limit:
+            self._reject()
+        if scratch_bytes and self._parked:
+            # Oldinroq kelgan katta job'lar kichiklar ortida qolib ketmasin
+            self._park((func, args, kwargs, scratch_bytes, time.time()))
+            return
+        self.queue.put_nowait((func, args, kwargs, scratch_bytes, time.time()))
+
+    def _reject(self) -> None:
+        _count_shed(self.name, REJECT)
+        raise PoolFull(self.name)
+
+    def _park(self, item: tuple) -> None:
+        self._parked.append(item)
+        metrics.incr("task_queue.parked")
+        metrics.set_gauge(f"pool.{self.name}.parked", len(self._parked))
+
+    def _admit_parked(self) -> None:
+        """Budjet bo'shaganda kutayotgan tasklarni navbat tartibida qaytarish"""
+        while self._parked:
+            func, args, kwargs, scratch_bytes, enqueued_at = self._parked[0]
+            reservation = scratch_budget.try_reserve(scratch_bytes)
+            if reservation is None:
+                break
+            self._parked.popleft()
+            self.queue.put_nowait((func, args, kwargs, reservation, enqueued_at))
+        metrics.set_gauge(f"pool.{self.name}.parked", len(self._parked))
 
-    async def add_task(self, func: Callable, *args, **kwargs):
-        """Add a task to the queue."""
-        await self.queue.put((func, args, kwargs))
+    async def _run(self, func: Callable, args: tuple, kwargs: dict) -> None:
+        if asyncio.iscoroutinefunction(func):
+            work = func(*args, **kwargs)
+        else:
+            work = asyncio.to_thread(func, *args, **kwargs)
+        if not self.spec.timeout:
+            return await work
+        try:
+            await asyncio.wait_for(work, self.spec.timeout)
+        except asyncio.TimeoutError:
+            metrics.incr(f"pool.{self.name}.timeouts")
+            await report_job_timeout(kwargs)
+            raise TimeoutError(f"{getattr(func, '__name__', func)} timed out after {int(self.spec.timeout)}s") from None
 
     async def _worker(self, worker_id: int):
         """Worker coroutine that consumes tasks from the queue."""
-        logger.info(f"Worker {worker_id} started")
-        while self._running:
+        logger.info(f"Worker {self.name}-{worker_id} started")
+        # Pool kichraytirilganda ortiqcha worker joriy job'ini tugatib chiqadi
+        while self._running and worker_id < self.concurrency:
             try:
                 # Wait for a task
                 task_item = await self.queue.get()
-                func, args, kwargs = task_item
-                
+                func, args, kwargs, scratch, enqueued_at = task_item
+
+                reservation = scratch if isinstance(scratch, Reservation) else None
+                if scratch and reservation is None:
+                    reservation = None if self._parked else scratch_budget.try_reserve(scratch)
+                    if reservation is None:
+                        self._park(task_item)
+                        self.queue.task_done()
+                        continue
+                token = current_reservation.set(reservation)
+                timing = (self.name, size_bucket(reservation.nbytes if reservation else 0), self.queue.qsize())
+                timing_token = current_timing.set(timing)
+                self._busy_workers.add(worker_id)
+                self._active += 1
+                started = time.monotonic()
+
                 try:
-                    if asyncio.iscoroutinefunction(func):
-                        await func(*args, **kwargs)
-                    else:
-                        await asyncio.to_thread(func, *args, **kwargs)
+                    await self._run(func, args, kwargs)
                 except Exception as e:
-                    logger.error(f"Error in worker {worker_id} processing task: {e}", exc_info=True)
+                    logger.error(f"Error in worker {self.name}-{worker_id} processing task: {e}", exc_info=True)
+                else:
+                    await job_timings.record(*timing[:2], "run", time.monotonic() - started, timing[2])
                 finally:
+                    self._active -= 1
+                    self._busy_workers.discard(worker_id)
+                    current_timing.reset(timing_token)
+                    current_reservation.reset(token)
+                    if reservation:
+                        reservation.release()
                     self.queue.task_done()
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                logger.error(f"Worker {worker_id} loop error: {e}")
-                
-        logger.info(f"Worker {worker_id} stopped")
+                logger.error(f"Worker {self.name}-{worker_id} loop error: {e}")
+
+        if self.workers.get(worker_id) is asyncio.current_task():
+            del self.workers[worker_id]
+        logger.info(f"Worker {self.name}-{worker_id} stopped")
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(POOL_REPORT_INTERVAL)
+            remote = self._remote()
+            if remote:
+                try:
+                    self._depth = await remote.depth()
+                except Exception as e:
+                    logger.error(f"Pool {self.name} depth error: {e}")
+            active = self.active
+            metrics.set_gauge(f"pool.{self.name}.active", active)
+            metrics.set_gauge(f"pool.{self.name}.queued", self.queued)
+            metrics.set_gauge(f"pool.{self.name}.depth", self._depth)
+            metrics.set_gauge(f"pool.{self.name}.saturation", round(active / self.concurrency, 2))
+            if active >= self.concurrency:
+                metrics.incr(f"pool.{self.name}.saturated_seconds", POOL_REPORT_INTERVAL)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "queue_limit": self.spec.queue_limit,
+            "timeout": self.spec.timeout,
+            "active": self.active,
+            "queued": self.queued,
+            "depth": self._depth,
+        }
+
+    def _spawn_workers(self) -> None:
+        for worker_id in range(self.concurrency):
+            task = self.workers.get(worker_id)
+            if task is None or task.done() or task.cancelling():
+                self.workers[worker_id] = asyncio.create_task(self._worker(worker_id))
+
+    async def resize(self, concurrency: int) -> None:
+        """Worker'lar sonini o'zgartirish; ortiqcha band worker'lar joriy job'ini tugatib chiqadi"""
+        self.concurrency = concurrency
+        if not self._running:
+            return
+        self._spawn_workers()
+        for worker_id, task in list(self.workers.items()):
+            if worker_id >= concurrency and worker_id not in self._busy_workers:
+                task.cancel()
+        if self._consumer:
+            await self.job_queue.resize(concurrency)
+
+    def start(self) -> None:
+        self._running = True
+        self._spawn_workers()
+        if self._durable():
+            self._consumer = asyncio.create_task(self.job_queue.run(self.concurrency))
+            self._consumer.add_done_callback(self._consumer_done)
+        self._monitor = asyncio.create_task(self._report())
+
+    def _consumer_done(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception():
+            logger.error(f"Job queue consumer ({self.name}) stopped: {task.exception()}")
+
+    async def stop(self) -> None:
+        self._running = False
+        # Ishlayotgan Redis job'lari ack qilinmaydi - restart'dan keyin davom etadi
+        tasks = [*self.workers.values(), *filter(None, [self._consumer, self._monitor])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.workers.clear()
+        self._consumer = None
+        self._monitor = None
+
+
+class TaskQueue:
+    def __init__(self, pools: dict[str, PoolSpec] | None = None):
+        self.pools = {name: WorkerPool(spec) for name, spec in (pools or pool_specs()).items()}
+        self._running = False
+        self._autoscaler: asyncio.Task | None = None
+
+    @property
+    def busy(self) -> bool:
+        """Yuklab olish pool'larida bo'sh worker yo'q yoki job'lar navbatda kutmoqda"""
+        return any(self.pools[name].busy for name in DOWNLOAD_POOLS if name in self.pools)
+
+    def pool_for(self, func: Callable) -> WorkerPool:
+        return self.pools.get(route(func)) or self.pools[DEFAULT_POOL]
+
+    async def admission(self, func: Callable) -> str:
+        """ACCEPT, yoki pool navbati to'lib borayotganda uning siyosati (REJECT / DEGRADE / AUDIO_ONLY)"""
+        pool = self.pool_for(func)
+        return pool.spec.admission(await pool.load())
+
+    def shed(self, func: Callable, action: str) -> None:
+        """Handler job'ni rad etdi / arzonroq variantga almashtirdi"""
+        _count_shed(self.pool_for(func).name, action)
+
+    async def add_task(self, func: Callable, *args, scratch_bytes: int = 0, duration: int | None = None, **kwargs):
+        """
+        Add a task to its worker pool; raises PoolFull when the pool's queue limit is reached.
+        scratch_bytes: TMP_DIR'da kerak bo'ladigan taxminiy joy (0 - budjetsiz).
+        duration: media davomiyligi (sekund), ma'lum bo'lsa - scheduler job narxini aniqroq baholaydi.
+        """
+        await self.pool_for(func).submit(func, args, kwargs, scratch_bytes, expected_seconds(scratch_bytes, duration))
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        return {name: pool.snapshot() for name, pool in self.pools.items()}
 
     def start(self):
         """Start the worker tasks."""
         if self._running:
             return
         self._running = True
-        for i in range(self.num_workers):
-            task = asyncio.create_task(self._worker(i))
-            self.workers.append(task)
-        logger.info(f"TaskQueue started with {self.num_workers} workers")
+        for pool in self.pools.values():
+            pool.start()
+        if get_settings().autoscale:
+            self._autoscaler = asyncio.create_task(autoscaler.run(list(self.pools.values())))
+        logger.info(
+            "TaskQueue started: " + ", ".join(f"{name}={pool.spec.concurrency}" for name, pool in self.pools.items())
+        )
 
     async def stop(self):
         """Stop all workers and cancel pending tasks."""
         self._running = False
-        for task in self.workers:
-            task.cancel()
-        await asyncio.gather(*self.workers, return_exceptions=True)
-        self.workers.clear()
+        # Bekor qilinadigan yuklashlar fayllarini restart'dan keyin davom etish uchun qoldiradi
+        download_registry.shutting_down = True
+        if self._autoscaler:
+            self._autoscaler.cancel()
+            await asyncio.gather(self._autoscaler, return_exceptions=True)
+            self._autoscaler = None
+        await asyncio.gather(*(pool.stop() for pool in self.pools.values()))
         logger.info("TaskQueue stopped")
 
 # Global instance
-task_queue = TaskQueue(num_workers=5)
+task_queue = TaskQueue()
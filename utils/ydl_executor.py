@@ -0,0 +1,185 @@
+"""
+Execution backend for blocking yt-dlp work.
+
+`thread` mode (default) runs jobs via `asyncio.to_thread`, sharing the GIL
+with the aiogram event loop. `process` mode runs them in a spawn-based
+process pool: progress dicts come back over a Manager queue and each
+worker is replaced after `YTDLP_WORKER_MAX_JOBS` jobs to cap memory creep.
+
+Job functions must be importable module-level callables that accept a
+`progress` keyword (see `utils.ydl_pool.run_extract`).
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue as queue_module
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from core.config import get_settings
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Progress hook dict'idan faqat pickle qilinadigan maydonlar IPC orqali yuboriladi
+PROGRESS_FIELDS = (
+    "status",
+    "downloaded_bytes",
+    "total_bytes",
+    "total_bytes_estimate",
+    "speed",
+    "eta",
+    "elapsed",
+    "filename",
+)
+PROGRESS_POLL_INTERVAL = 0.5  # seconds
+
+
+def _init_worker() -> None:
+    import utils.ydl_pool
+    utils.ydl_pool.IN_WORKER_PROCESS = True
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+
+class _QueueProgress:
+    def __init__(self, progress_queue):
+        self.progress_queue = progress_queue
+
+    def __call__(self, data: dict) -> None:
+        try:
+            self.progress_queue.put_nowait({k: data.get(k) for k in PROGRESS_FIELDS})
+        except Exception:
+            pass
+
+
+def _process_entry(func: Callable, args: tuple, progress_queue) -> Any:
+    import yt_dlp
+    progress = _QueueProgress(progress_queue) if progress_queue is not None else None
+    try:
+        return func(*args, progress=progress)
+    except yt_dlp.utils.DownloadError as e:
+        # exc_info ichidagi traceback pickle qilinmaydi - faqat xabarni qaytaramiz
+        raise yt_dlp.utils.DownloadError(str(e)) from None
+    except yt_dlp.utils.DownloadCancelled:
+        raise yt_dlp.utils.DownloadCancelled() from None
+
+
+class YdlExecutor:
+    def __init__(self, mode: str = "thread", workers: int = 2, max_jobs_per_worker: int = 20):
+        self.mode = mode
+        self.workers = workers
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self._pool: ProcessPoolExecutor | None = None
+        self._manager = None
+        # _ensure_pool bir vaqtda bir nechta thread'dan chaqiriladi (asyncio.to_thread)
+        self._pool_lock = threading.Lock()
+
+    def _ensure_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            return self._create_pool()
+
+    def _create_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            ctx = multiprocessing.get_context("spawn")
+            if self._manager is None:
+                self._manager = ctx.Manager()
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=ctx,
+                initializer=_init_worker,
+                max_tasks_per_child=self.max_jobs_per_worker,
+            )
+            logger.info(
+                f"yt-dlp process pool started: {self.workers} workers, "
+                f"recycle after {self.max_jobs_per_worker} jobs"
+            )
+        return self._pool
+
+    async def start(self) -> None:
+        """Process rejimida pool va Manager'ni oldindan ishga tushirish"""
+        if self.mode == "process":
+            await asyncio.to_thread(self._ensure_pool)
+
+    def new_event(self):
+        """Job'lar orasida ulashiladigan Event (bekor qilish uchun)"""
+        if self.mode == "process":
+            self._ensure_pool()
+            return self._manager.Event()
+        return threading.Event()
+
+    async def run(self, func: Callable, *args, progress_hook: Callable[[dict], None] | None = None) -> Any:
+        metrics.incr(f"ydl_executor.{self.mode}.jobs")
+        if self.mode != "process":
+            return await asyncio.to_thread(func, *args, progress=progress_hook)
+
+        pool = await asyncio.to_thread(self._ensure_pool)
+        loop = asyncio.get_running_loop()
+        progress_queue = self._manager.Queue() if progress_hook else None
+        future = loop.run_in_executor(pool, _process_entry, func, args, progress_queue)
+        pump = None
+        if progress_queue is not None:
+            pump = asyncio.create_task(self._pump_progress(progress_queue, progress_hook, future))
+        try:
+            return await future
+        except BrokenProcessPool as e:
+            # Worker o'ldirilgan (masalan OOM) - keyingi job uchun yangi pool
+            logger.error(f"yt-dlp process pool broken: {e}")
+            metrics.incr("ydl_executor.process.broken")
+            self._discard_pool(pool)
+            raise Exception("❌ Yuklashda xatolik yuz berdi! (Keyinroq urinib ko'ring)")
+        finally:
+            if pump:
+                if future.done():
+                    await asyncio.gather(pump, return_exceptions=True)
+                else:
+                    pump.cancel()
+
+    def _discard_pool(self, pool: ProcessPoolExecutor) -> None:
+        """Buzilgan pool'ni yopish; boshqa job allaqachon yangisini ochgan bo'lsa tegmaymiz"""
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    async def _pump_progress(progress_queue, progress_hook: Callable[[dict], None], future: asyncio.Future) -> None:
+        def _get():
+            try:
+                return progress_queue.get(timeout=PROGRESS_POLL_INTERVAL)
+            except queue_module.Empty:
+                return None
+
+        while True:
+            data = await asyncio.to_thread(_get)
+            if data is None:
+                if future.done():
+                    return
+                continue
+            try:
+                progress_hook(data)
+            except Exception as e:
+                logger.debug(f"Progress hook error: {e}")
+
+    def shutdown(self) -> None:
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+
+_settings = get_settings()
+
+# Global instance
+ydl_executor = YdlExecutor(
+    mode=_settings.ytdlp_executor,
+    workers=_settings.ytdlp_process_workers,
+    max_jobs_per_worker=_settings.ytdlp_worker_max_jobs,
+)
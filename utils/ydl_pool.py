@@ -0,0 +1,230 @@
+"""
+Pool of long-lived `yt_dlp.YoutubeDL` instances.
+
+Building a YoutubeDL instance sets up every extractor, and the YouTube
+extractor keeps player JS / signature functions in memory, so a warm
+instance skips that work on the next job. Instances are keyed by profile
+name plus a fingerprint of the base options; per-job options (outtmpl,
+format, progress hooks, aria2c args, rate limit) are applied on checkout and undone on return.
+
+A YoutubeDL instance is not thread safe: a checked-out instance belongs to
+exactly one job until it is returned.
+"""
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+import yt_dlp
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Options that change per job and therefore are not part of the pool key
+JOB_OPTION_KEYS = ("outtmpl", "format", "progress_hooks", "logger", "external_downloader_args", "ratelimit")
+MAX_IDLE_PER_PROFILE = 2
+MAX_USES_PER_INSTANCE = 200
+# ydl_executor process worker'larida True bo'ladi
+IN_WORKER_PROCESS = False
+
+
+class YtDlpLogger:
+    """yt-dlp xabarlarini bizning logger'ga yo'naltirish (process'lar orasida pickle qilinadi)"""
+
+    def debug(self, msg):
+        if not msg.startswith('[debug] '):
+            logger.debug(f"[yt-dlp] {msg}")
+
+    def info(self, msg):
+        logger.info(f"[yt-dlp] {msg}")
+
+    def warning(self, msg):
+        if "Requested format is not available" in str(msg):
+            return
+        logger.warning(f"[yt-dlp] {msg}")
+
+    def error(self, msg):
+        if "Requested format is not available" in str(msg):
+            return
+        logger.error(f"[yt-dlp] {msg}")
+
+
+def _split_opts(opts: dict) -> tuple[dict, dict]:
+    base = {k: v for k, v in opts.items() if k not in JOB_OPTION_KEYS}
+    job = {k: opts[k] for k in JOB_OPTION_KEYS if k in opts}
+    return base, job
+
+
+def _fingerprint(base_opts: dict) -> str:
+    return json.dumps(base_opts, sort_keys=True, default=repr)
+
+
+class YoutubeDLPool:
+    def __init__(self, max_idle_per_profile: int = MAX_IDLE_PER_PROFILE, max_uses: int = MAX_USES_PER_INSTANCE):
+        self.max_idle_per_profile = max_idle_per_profile
+        self.max_uses = max_uses
+        self._idle: dict[tuple[str, str], list[yt_dlp.YoutubeDL]] = {}
+        self._uses: dict[int, int] = {}
+        self._stats: dict[str, dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, profile: str, field: str) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(profile, {"hits": 0, "misses": 0, "discarded": 0})
+            stats[field] += 1
+        metrics.incr(f"ydl_pool.{profile}.{field}")
+
+    @contextmanager
+    def checkout(self, profile: str, opts: dict) -> Iterator[yt_dlp.YoutubeDL]:
+        """
+        Pool'dan YoutubeDL olish. `opts` ichidagi outtmpl/format/progress_hooks
+        faqat shu job uchun qo'llanadi.
+        """
+        base_opts, job_opts = _split_opts(opts)
+        key = (profile, _fingerprint(base_opts))
+
+        with self._lock:
+            idle = self._idle.get(key)
+            ydl = idle.pop() if idle else None
+
+        if ydl is None:
+            self._count(profile, "misses")
+            ydl = yt_dlp.YoutubeDL({**base_opts, **({"logger": job_opts["logger"]} if "logger" in job_opts else {})})
+        else:
+            self._count(profile, "hits")
+
+        saved = self._apply_job_opts(ydl, job_opts)
+        reusable = False
+        try:
+            yield ydl
+            reusable = True
+        except (yt_dlp.utils.DownloadError, yt_dlp.utils.DownloadCancelled):
+            # Oddiy yuklash xatosi instance holatini buzmaydi
+            reusable = True
+            raise
+        finally:
+            self._restore_job_opts(ydl, saved)
+            self._release(key, ydl, reusable)
+
+    @staticmethod
+    def _apply_job_opts(ydl: yt_dlp.YoutubeDL, job_opts: dict) -> dict:
+        saved = {
+            "outtmpl": ydl.params.get("outtmpl"),
+            "format": ydl.params.get("format"),
+            "format_selector": ydl.format_selector,
+            "progress_hooks": list(ydl._progress_hooks),
+            "external_downloader_args": ydl.params.get("external_downloader_args"),
+            "ratelimit": ydl.params.get("ratelimit"),
+        }
+        if "outtmpl" in job_opts:
+            outtmpl = job_opts["outtmpl"]
+            if not isinstance(outtmpl, dict):
+                outtmpl = {**(saved["outtmpl"] or {}), "default": outtmpl}
+            ydl.params["outtmpl"] = outtmpl
+        if "format" in job_opts:
+            ydl.params["format"] = job_opts["format"]
+            ydl.format_selector = ydl.build_format_selector(job_opts["format"])
+        if "external_downloader_args" in job_opts:
+            # aria2_tuner har bir job uchun alohida tanlaydi
+            ydl.params["external_downloader_args"] = job_opts["external_downloader_args"]
+        if "ratelimit" in job_opts:
+            # Governor'ning tezlik ulushi - har bir lease'da boshqacha
+            ydl.params["ratelimit"] = job_opts["ratelimit"]
+        for hook in job_opts.get("progress_hooks") or []:
+            ydl.add_progress_hook(hook)
+        return saved
+
+    @staticmethod
+    def _restore_job_opts(ydl: yt_dlp.YoutubeDL, saved: dict) -> None:
+        ydl.params["outtmpl"] = saved["outtmpl"]
+        ydl.params["format"] = saved["format"]
+        ydl.format_selector = saved["format_selector"]
+        ydl._progress_hooks[:] = saved["progress_hooks"]
+        ydl.params["external_downloader_args"] = saved["external_downloader_args"]
+        ydl.params["ratelimit"] = saved["ratelimit"]
+
+    def _release(self, key: tuple[str, str], ydl: yt_dlp.YoutubeDL, reusable: bool) -> None:
+        with self._lock:
+            uses = self._uses.get(id(ydl), 0) + 1
+            idle = self._idle.setdefault(key, [])
+            keep = reusable and uses < self.max_uses and len(idle) < self.max_idle_per_profile
+            if keep:
+                self._uses[id(ydl)] = uses
+                idle.append(ydl)
+            else:
+                self._uses.pop(id(ydl), None)
+        if not keep:
+            self._count(key[0], "discarded")
+            self._close(ydl)
+
+    @staticmethod
+    def _close(ydl: yt_dlp.YoutubeDL) -> None:
+        try:
+            ydl.close()
+        except Exception as e:
+            logger.debug(f"YoutubeDL close error: {e}")
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        with self._lock:
+            result = {profile: dict(stats) for profile, stats in self._stats.items()}
+            for (profile, _), idle in self._idle.items():
+                result.setdefault(profile, {"hits": 0, "misses": 0, "discarded": 0})
+                result[profile]["idle"] = result[profile].get("idle", 0) + len(idle)
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            instances = [ydl for idle in self._idle.values() for ydl in idle]
+            self._idle.clear()
+            self._uses.clear()
+        for ydl in instances:
+            self._close(ydl)
+
+
+def _cancel_hook(cancel_event) -> Callable[[dict], None]:
+    def hook(_data: dict) -> None:
+        if cancel_event.is_set():
+            raise yt_dlp.utils.DownloadCancelled()
+    return hook
+
+
+def run_extract(
+    profile: str,
+    opts: dict,
+    url: str,
+    download: bool = True,
+    cancel_event=None,
+    info: dict | None = None,
+    progress: Callable[[dict], None] | None = None,
+) -> dict | None:
+    """
+    Sinxron: pool'dagi instance bilan extract_info.
+    Thread yoki worker process ichida `ydl_executor` orqali chaqiriladi.
+    `cancel_event` o'rnatilsa keyingi progress hook'da yuklash to'xtatiladi.
+    `info` berilsa (oldindan olingan info dict) extract bosqichi o'tkazib
+    yuboriladi va to'g'ridan-to'g'ri process_ie_result chaqiriladi.
+    """
+    hooks = list(opts.get("progress_hooks", []))
+    if cancel_event is not None:
+        if cancel_event.is_set():
+            raise yt_dlp.utils.DownloadCancelled()
+        hooks.insert(0, _cancel_hook(cancel_event))
+    if progress:
+        hooks.append(progress)
+    if hooks:
+        opts = {**opts, "progress_hooks": hooks}
+    with ydl_pool.checkout(profile, opts) as ydl:
+        if info is not None:
+            info = ydl.process_ie_result(info, download=download)
+        else:
+            info = ydl.extract_info(url, download=download)
+        if info and IN_WORKER_PROCESS:
+            # Natija pickle orqali asosiy process'ga qaytadi
+            info = ydl.sanitize_info(info)
+        return info
+
+
+# Global instance
+ydl_pool = YoutubeDLPool()
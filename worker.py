@@ -0,0 +1,86 @@
+"""
+Qo'shimcha job worker: Redis navbatlaridagi (jobs:stream:{pool}) video,
+musiqa va tanish (recognize) job'larini bajaradi, Telegram polling qilmaydi.
+Pool'lar va ularning hajmi - WORKER_POOLS (services.worker_pools). Bot bilan bir vaqtda bir
+nechta nusxada ishga tushirish mumkin:
+
+    JOB_QUEUE=redis python worker.py   (bot ham JOB_QUEUE=redis bilan ishlashi kerak)
+
+JOB_QUEUE=celery bo'lsa bu o'rniga Celery worker'lari ishlatiladi (tasks.celery_app);
+ular ham shu yerdagi setup() / teardown()'dan foydalanadi.
+"""
+import asyncio
+import logging
+
+import redis.asyncio as redis
+
+import loader
+from loader import REDIS_HOST, REDIS_PORT
+import tasks.bot_tasks  # noqa: F401  task'lar job_store'da nomi bilan ro'yxatdan o'tadi
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def setup() -> list[asyncio.Task]:
+    """Redis, yt-dlp executor va fon tasklari; fon tasklarini qaytaradi"""
+    # Worker Redis'siz ishlay olmaydi - navbat shu yerda
+    loader.redis_client = redis.Redis(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        decode_responses=False,
+        socket_connect_timeout=2
+    )
+    await loader.redis_client.ping()
+
+    from services.metrics import metrics_worker
+    from services.media_index import media_index
+    from services.local_cache import local_cache
+    from services.job_timings import job_timings
+    from utils.cancellation import download_registry
+    background = [
+        asyncio.create_task(metrics_worker()),
+        asyncio.create_task(media_index.run()),
+        asyncio.create_task(job_timings.run()),
+        asyncio.create_task(local_cache.invalidation_listener()),
+        asyncio.create_task(download_registry.cancel_listener()),
+    ]
+
+    from utils.ydl_executor import ydl_executor
+    await ydl_executor.start()
+    return background
+
+
+async def teardown(background: list[asyncio.Task]) -> None:
+    from utils.cancellation import download_registry
+    download_registry.shutting_down = True
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await loader.redis_client.close()
+
+    from utils.ydl_executor import ydl_executor
+    ydl_executor.shutdown()
+
+    from utils.ranged_fetch import close_session
+    await close_session()
+
+
+async def main():
+    background = await setup()
+    logger.info("✅ Redis connected, starting job worker")
+
+    from utils.task_queue import task_queue
+    task_queue.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await task_queue.stop()
+        await teardown(background)
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Worker to'xtatildi")